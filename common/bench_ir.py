@@ -0,0 +1,35 @@
+import json
+import time
+import argparse
+import tracemalloc
+
+import ir
+
+# memory held by a program as json dicts against the same program as
+# `ir` objects, and how long converting takes
+
+def measure(fn, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn(*args)
+    elapsed = time.perf_counter() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, size, elapsed
+
+def main(args):
+    print("file,instrs,json_bytes,ir_bytes,bytes_per_instr_json,bytes_per_instr_ir,convert_s")
+    for filename in args.files:
+        with open(filename) as f:
+            text = f.read()
+        bril, json_size, _ = measure(json.loads, text)
+        funcs, ir_size, elapsed = measure(ir.functions, bril)
+        n = sum(len(func.instrs) for func in funcs) or 1
+
+        print(f"{filename},{n},{json_size},{ir_size},{json_size / n:.0f},{ir_size / n:.0f},{elapsed:.4f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the memory footprint of json and ir programs")
+    parser.add_argument("files", nargs="+", help="Bril programs in JSON form")
+    main(parser.parse_args())
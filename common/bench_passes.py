@@ -0,0 +1,205 @@
+import os
+import sys
+import json
+import time
+import argparse
+import importlib.util
+from collections import Counter
+
+# the passes live in the homework directories; hw2/cfg.py puts this
+# directory back on the path for ir etc. hw3's modules don't import its
+# `utils`, so hw4's can stay the only one.
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'hw4'))
+sys.path.insert(0, os.path.join(HERE, '..', 'hw2'))
+sys.path.append(os.path.join(HERE, '..', 'hw3'))
+import briltxt
+import dce
+from lvn import LVN_Class
+import dominator
+import ssa
+import loops
+from defuse import DefUse
+from analyses import ANALYSES as DENSE_ANALYSES, SparseLiveness, SparseConstantPropagation
+from framework import analyze_dataflow
+from worklist import ORDERS
+from bitvec import BACKENDS
+from passmgr import AnalysisManager
+import ir
+import stats
+import workloads
+
+
+# time each pass on synthetic programs (see workloads.py) or given files,
+# and optionally check the times against a saved baseline
+
+def timed_pass(analyses, needs, run):
+    """A benchmark that times `run(func, am)` alone: the analyses in
+    `needs` are computed before the clock starts. Returns the seconds
+    and, when stats are on, the counters `run` added to.
+    """
+    def bench(func):
+        am = AnalysisManager(func, analyses)
+        for name in needs:
+            am.get(name)
+        before = Counter(stats.counters) if stats.enabled else None
+        start = time.perf_counter()
+        run(func, am)
+        seconds = time.perf_counter() - start
+        return seconds, stats.counters - before if stats.enabled else None
+    return bench
+
+def analysis(analyses, name, needs=()):
+    return timed_pass(analyses, needs, lambda func, am: am.get(name))
+
+def dense(name, order='scc', backend='int'):
+    # `analyze_dataflow`, hw3's dense worklist solver
+    return timed_pass(dominator.ANALYSES, ('cfg',), lambda func, am: analyze_dataflow(
+        func, am.get('blocks'), DENSE_ANALYSES[name](backend), order, am.get('cfg')))
+
+PASSES = {
+    'cfg': analysis(dominator.ANALYSES, 'cfg'),
+    'liveness': analysis(dce.ANALYSES, 'liveness', ('cfg',)),
+    'dce': timed_pass(dce.ANALYSES, ('cfg',), dce.DCE_Class.function_dce),
+    'lvn': timed_pass(dce.ANALYSES, ('cfg',), lambda func, am: LVN_Class().function_lvn(func, am)),
+    'dominators': analysis(dominator.ANALYSES, 'dominators', ('cfg',)),
+    'dom_tree': analysis(dominator.ANALYSES, 'dom_tree', ('dominators',)),
+    'frontier': analysis(dominator.ANALYSES, 'frontier', ('dominators',)),
+    'to_ssa': timed_pass(dominator.ANALYSES, ('dom_tree', 'frontier_ids'), ssa.to_ssa),
+    'sparse_live': timed_pass(dominator.ANALYSES, ('cfg',), lambda func, am: SparseLiveness().solve(
+        DefUse(func, am.get('blocks'), am.get('cfg')))),
+    'sparse_cprop': timed_pass(dominator.ANALYSES, ('cfg',), lambda func, am: SparseConstantPropagation().solve(
+        DefUse(func, am.get('blocks'), am.get('cfg')))),
+    'licm': timed_pass(loops.ANALYSES, ('dom_tree',), loops.licm),
+}
+# run by default; the dense solver passes below take minutes on the
+# 10000-instruction loop_nest, so they only run when asked for
+DEFAULT_PASSES = list(PASSES)
+
+# hw3's dense solver: liveness under every worklist order and with every
+# bit-vector backend (numpy is optional), and constant propagation
+for order in ORDERS:
+    PASSES[f'dense_live_{order}'] = dense('live', order)
+for backend in BACKENDS:
+    if backend != 'int' and importlib.util.find_spec(backend):
+        PASSES[f'dense_live_{backend}'] = dense('live', backend=backend)
+PASSES['dense_cprop'] = dense('cprop')
+
+def bench_program(bril, passes, repeat):
+    """Seconds per pass over all functions of `bril` (JSON), the best of
+    `repeat` runs. Every run starts from fresh `ir` functions, since DCE
+    and LVN change them.
+    """
+    times = {}
+    for name in passes:
+        best = None
+        for _ in range(repeat):
+            t = sum(PASSES[name](func)[0] for func in ir.each_function(bril))
+            best = t if best is None else min(best, t)
+        times[name] = best
+    return times
+
+def count_program(bril, passes):
+    """The counters (see stats.py) each pass adds to in one run over all
+    functions of `bril`, not counting the analyses it needs. Unlike
+    times, they are the same on every machine.
+    """
+    counts = {}
+    for name in passes:
+        counts[name] = Counter()
+        for func in ir.each_function(bril):
+            counts[name] += PASSES[name](func)[1]
+    return counts
+
+def programs(args):
+    for filename in args.files:
+        yield filename, None, briltxt.load(filename)
+    if not args.files:
+        for kind in args.workloads:
+            for size in args.sizes:
+                yield kind, size, workloads.generate(kind, size, args.seed)
+
+def run(args):
+    results = []
+    for workload, size, bril in programs(args):
+        instrs = sum(len(func['instrs']) for func in bril['functions'])
+        if args.counters:
+            for name, counts in count_program(bril, args.passes).items():
+                print(' '.join([workload, str(size if size is not None else instrs), name]
+                               + [f"{c}={n}" for c, n in sorted(counts.items())]))
+            continue
+        times = bench_program(bril, args.passes, args.repeat)
+        for name, seconds in times.items():
+            result = {'workload': workload, 'size': size if size is not None else instrs,
+                      'instrs': instrs, 'functions': len(bril['functions']),
+                      'pass': name, 'seconds': round(seconds, 6),
+                      'us_per_instr': round(seconds / instrs * 1e6, 3)}
+            results.append(result)
+            if not args.baseline:
+                print_result(result, args.format, header=len(results) == 1)
+    return results
+
+FIELDS = ('workload', 'size', 'instrs', 'functions', 'pass', 'seconds', 'us_per_instr')
+
+def print_result(result, format, header=False):
+    if format == 'csv':
+        if header:
+            print(','.join(FIELDS))
+        print(','.join(str(result[field]) for field in FIELDS))
+    else:
+        print(json.dumps(result))
+    sys.stdout.flush()
+
+def key(result):
+    return result['workload'], result['size'], result['pass']
+
+def check(results, args):
+    """Compare against the baseline file, or record it if there is none
+    yet. Prints one line per result that only changes when a pass got
+    slower, so the output can be a turnt snapshot.
+    """
+    if not os.path.exists(args.baseline):
+        with open(args.baseline, 'w') as f:
+            for result in results:
+                f.write(json.dumps(result) + '\n')
+        print(f"# recorded {args.baseline}", file=sys.stderr)
+        base = {}
+    else:
+        with open(args.baseline) as f:
+            base = {key(r): r for r in map(json.loads, f)}
+
+    slower = 0
+    for result in results:
+        workload, size, name = key(result)
+        old = base.get(key(result))
+        # small times are mostly noise, so they need to grow by an absolute
+        # amount as well
+        if old and result['seconds'] > old['seconds'] * args.tolerance \
+                and result['seconds'] - old['seconds'] > args.min_seconds:
+            slower += 1
+            print(f"slower {workload} {size} {name}: {result['seconds']:.4f}s, was {old['seconds']:.4f}s")
+        else:
+            print(f"ok {workload} {size} {name}")
+    return slower
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the passes on synthetic Bril programs")
+    parser.add_argument("files", nargs="*", help="Bril programs (text or JSON) to time instead of the synthetic workloads")
+    parser.add_argument("--workloads", nargs="+", choices=sorted(workloads.WORKLOADS), default=list(workloads.WORKLOADS))
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000], help="About how many instructions each program has")
+    parser.add_argument("--passes", nargs="+", choices=list(PASSES), default=DEFAULT_PASSES, help="Passes to time (default: all but the dense_* ones)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per pass; the best time is reported")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--format", choices=["json", "csv"], default="json", help="JSON lines or CSV")
+    parser.add_argument("--baseline", help="Compare against this file of JSON results (recorded on the first run)")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="How many times slower than the baseline counts as a regression")
+    parser.add_argument("--min_seconds", type=float, default=0.005, help="Ignore slowdowns smaller than this")
+    parser.add_argument("--counters", action="store_true", help="Print the counters every pass adds to instead of timing it (the same on every machine)")
+    args = parser.parse_args()
+    if args.counters:
+        stats.enable_counters()
+
+    results = run(args)
+    if args.baseline and check(results, args):
+        sys.exit(1)
@@ -0,0 +1,100 @@
+"""Forming the ordered block map of a function.
+
+A block map is an `OrderedDict` from block name to the block's `ir`
+instructions, label left out, in program order. `function_blocks` also
+gives every block a terminator. hw3 and hw4 both form their blocks here.
+"""
+from collections import OrderedDict
+
+import ir
+
+
+def fresh_names(seed, names):
+    """Generate new names `seed1`, `seed2`, ... that are not in `names`
+    at the time they are generated. `names` may grow in between, but
+    names must never be removed from it: the counter only goes up, so
+    generating k names costs O(k) lookups in total, not O(k^2) as with
+    calling `utils.fresh()` over and over.
+    """
+    i = 0
+    while True:
+        i += 1
+        name = seed + str(i)
+        if name not in names:
+            yield name
+
+def block_names(labels):
+    """Name the blocks whose labels are `labels`, in order (`None` for an
+    anonymous block). Anonymous blocks get the names `b1`, `b2`, ... that
+    no label of the function uses, including labels further down, so a
+    generated name never collides with a real one. The interpreter and
+    every CFG name blocks this way.
+    """
+    labels = list(labels)
+    anonymous = fresh_names('b', {label for label in labels if label is not None})
+    return [label if label is not None else next(anonymous) for label in labels]
+
+def labeled_blocks(instrs):
+    """Like `form_blocks`, but generate `(label, block)` pairs, with the
+    label left out of the block (`None` for a block that doesn't start
+    with one). No block is copied to take its label off.
+    """
+    label = None
+    cur_block = []
+
+    for instr in instrs:
+        if instr.op is not None:
+            cur_block.append(instr)
+            if instr.op in ir.TERMINATORS:
+                yield label, cur_block
+                label = None
+                cur_block = []
+        else:
+            if cur_block or label is not None:
+                yield label, cur_block
+            label = instr.label
+            cur_block = []
+
+    if cur_block or label is not None:
+        yield label, cur_block
+
+def name_blocks(pairs):
+    """Build the block map from `(label, block)` pairs. Anonymous blocks
+    are named by `block_names`.
+    """
+    pairs = list(pairs)
+    names = block_names(label for label, _ in pairs)
+    return OrderedDict(zip(names, (block for _, block in pairs)))
+
+def block_map(blocks):
+    """Given a sequence of basic blocks, which are lists of instructions,
+    produce a `OrderedDict` mapping names to blocks.
+
+    The name of the block comes from the label it starts with, if any.
+    Anonymous blocks, which don't start with a label, get an
+    automatically generated name. Blocks in the mapping have their
+    labels removed.
+    """
+    return name_blocks((block[0].label, block[1:]) if block[0].op is None else (None, block)
+                       for block in blocks)
+
+def add_terminators(blocks):
+    """Given an ordered block map, modify the blocks to add terminators
+    to all blocks (avoiding "fall-through" control flow transfers).
+    """
+    names = list(blocks)
+    last = len(names) - 1
+    for i, block in enumerate(blocks.values()):
+        if not block or block[-1].op not in ir.TERMINATORS:
+            if i == last:
+                # In the last block, return.
+                block.append(ir.Instr('ret'))
+            else:
+                # Otherwise, jump to the next block.
+                block.append(ir.Instr('jmp', labels=(names[i + 1],)))
+
+def function_blocks(func, am):
+    # the ordered block map, with terminators
+    blocks = name_blocks(labeled_blocks(func.instrs))
+    add_terminators(blocks)
+    return blocks
@@ -0,0 +1,183 @@
+"""Control flow graphs over dense integer block ids.
+
+Blocks are numbered 0..n-1 in program order, so the entry is block 0.
+Edges are stored CSR-style in `array('i')`s: the successors of block `b`
+are `succs.edges[succs.offsets[b]:succs.offsets[b + 1]]`, which is what
+`cfg.succs[b]` returns (and the same for `cfg.preds`). Postorder and
+reverse postorder from the entry are computed once, when the graph is
+built.
+
+Code that still thinks in block names can use the CFG as a read-only
+mapping from a block name to the names of its successors (the dict that
+`build_cfg` used to return), and `cfg.successors` / `cfg.predecessors`
+as name -> list of names views (the dicts from `generate_graph`).
+"""
+from array import array
+from collections.abc import Mapping, Sequence
+
+from blocks import block_names
+
+
+class Adjacency(Sequence):
+    """The edge lists of every block, in CSR form."""
+    __slots__ = ('offsets', 'edges')
+
+    def __init__(self, offsets, edges):
+        self.offsets = offsets
+        self.edges = edges
+
+    def __getitem__(self, b):
+        return self.edges[self.offsets[b]:self.offsets[b + 1]]
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def degree(self, b):
+        return self.offsets[b + 1] - self.offsets[b]
+
+
+def csr(lists):
+    # pack a list of per-block edge lists
+    offsets = array('i', [0])
+    edges = array('i')
+    for targets in lists:
+        edges.extend(targets)
+        offsets.append(len(edges))
+    return Adjacency(offsets, edges)
+
+
+def transpose(adj):
+    # reverse every edge with a counting pass, keeping source order
+    n = len(adj)
+    offsets = array('i', bytes(4 * (n + 1)))
+    for t in adj.edges:
+        offsets[t + 1] += 1
+    for b in range(n):
+        offsets[b + 1] += offsets[b]
+
+    edges = array('i', bytes(4 * offsets[n]))
+    fill = offsets[:n]
+    for b in range(n):
+        for t in adj[b]:
+            edges[fill[t]] = b
+            fill[t] += 1
+    return Adjacency(offsets, edges)
+
+
+def postorder(succs, roots, n):
+    """Depth-first postorder of everything reachable from `roots`, in
+    order. Iterative, so deep graphs don't hit the recursion limit.
+    """
+    visited = bytearray(n)
+    order = array('i')
+    for root in roots:
+        if visited[root]:
+            continue
+        visited[root] = 1
+        stack = [(root, iter(succs[root]))]
+        while stack:
+            node, children = stack[-1]
+            for child in children:
+                if not visited[child]:
+                    visited[child] = 1
+                    stack.append((child, iter(succs[child])))
+                    break
+            else:
+                stack.pop()
+                order.append(node)
+    return order
+
+
+def successor_ids(lasts, index):
+    """Successor lists for blocks whose last instructions are `lasts`
+    (None for an empty block), given the block id of every label.
+    Blocks that don't end in a jump, branch or return fall through.
+    """
+    n = len(lasts)
+    succs = []
+    for b, last in enumerate(lasts):
+        op = last.op if last is not None else None
+        if op == 'jmp' or op == 'br':
+            succs.append([index[label] for label in last.labels])
+        elif op == 'ret' or b + 1 == n:
+            succs.append(())
+        else:
+            succs.append((b + 1,))
+    return succs
+
+
+class NameView(Mapping):
+    """Block name -> list of neighbour names, over an `Adjacency`."""
+
+    def __init__(self, cfg, adj):
+        self.cfg = cfg
+        self.adj = adj
+
+    def __getitem__(self, name):
+        names = self.cfg.names
+        return [names[t] for t in self.adj[self.cfg.index[name]]]
+
+    def __iter__(self):
+        return iter(self.cfg.names)
+
+    def __len__(self):
+        return len(self.cfg.names)
+
+
+class CFG(Mapping):
+    def __init__(self, names, succs, entry=0):
+        self.names = list(names)
+        self.index = {name: b for b, name in enumerate(self.names)}
+        self.succs = succs if isinstance(succs, Adjacency) else csr(succs)
+        self.preds = transpose(self.succs)
+        self.entry = entry
+
+        n = len(self.names)
+        # only blocks reachable from the entry are ordered; rpo_number
+        # is -1 for the rest
+        self.postorder = postorder(self.succs, [entry] if n else [], n)
+        self.rpo = self.postorder[::-1]
+        self.rpo_number = array('i', [-1]) * n
+        for i, b in enumerate(self.rpo):
+            self.rpo_number[b] = i
+
+    @classmethod
+    def from_block_map(cls, blocks):
+        # an ordered name -> `ir` instructions map, labels already stripped
+        names = list(blocks.keys())
+        index = {name: b for b, name in enumerate(names)}
+        lasts = [block[-1] if block else None for block in blocks.values()]
+        return cls(names, successor_ids(lasts, index))
+
+    @classmethod
+    def from_block_list(cls, blocks):
+        # a list of blocks that still start with their label, if any
+        # (DCE can leave an anonymous block empty)
+        names = block_names(block[0].label if block and block[0].op is None else None
+                            for block in blocks)
+        index = {name: b for b, name in enumerate(names)}
+        return cls(names, successor_ids([block[-1] if block else None for block in blocks], index))
+
+    def exits(self):
+        # blocks with no successors
+        return [b for b in range(len(self.names)) if not self.succs.degree(b)]
+
+    def reachable(self, b):
+        return self.rpo_number[b] != -1
+
+    @property
+    def successors(self):
+        return NameView(self, self.succs)
+
+    @property
+    def predecessors(self):
+        return NameView(self, self.preds)
+
+    def __getitem__(self, name):
+        return [self.names[t] for t in self.succs[self.index[name]]]
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
@@ -0,0 +1,653 @@
+"""An in-process Bril interpreter that profiles what it runs.
+
+`brili -p` is a process launch (and a Node start) per program, just to
+find out how many instructions a pass saved. Here a program is decoded
+once into Python closures and run in the same process:
+
+- every variable of a function gets a register, an index into a list,
+  and every label a block number, so a step never looks up a name;
+- every instruction becomes a closure specialized for its opcode and
+  registers, picked from `STEPS` (a table from opcode to closure
+  factory) when the program is decoded. A block is a list of these, and
+  its terminator returns the number of the edge it takes;
+- phis at the top of a block become copies on the edges into it, made
+  by the terminator of the block they come from (all phis of a block
+  read their arguments before any is written).
+
+Running a block adds one to its counter and taking an edge one to the
+edge's, both lists. Blocks run all their instructions (unless the
+program fails), so the total number of instructions executed and the
+per-opcode counts are the block counts times what each block contains,
+added up after the run.
+
+`run(program, args)` returns a `Profile`. The counts are the ones
+`brili -p` reports: every instruction is counted, labels aren't. The
+core, float, char and memory extensions are supported. A read of a
+variable that was never assigned is not checked, and fails in whatever
+operation gets the None.
+
+    python3 interp.py [-p] [--profile] [ARGS...] < prog.json
+"""
+import sys
+import json
+import math
+import argparse
+from collections import Counter
+
+import ir
+from ir import INT_MIN, INT_MAX, wrap
+from blocks import block_names
+import stats
+
+
+class BrilError(Exception):
+    pass
+
+
+def format_value(v):
+    # the way brili prints values
+    if v is True:
+        return 'true'
+    if v is False:
+        return 'false'
+    if isinstance(v, float):
+        if math.isnan(v):
+            return 'NaN'
+        if math.isinf(v):
+            return 'Infinity' if v > 0 else '-Infinity'
+        return f'{v:.17f}'
+    if v is None:
+        raise BrilError('undefined variable')
+    return str(v)
+
+
+def parse_value(text, type):
+    if type == 'int':
+        return wrap(int(text))
+    if type == 'bool':
+        if text not in ('true', 'false'):
+            raise BrilError(f'bad bool argument {text!r}')
+        return text == 'true'
+    if type == 'float':
+        return float(text)
+    if type == 'char':
+        if len(text) != 1:
+            raise BrilError(f'bad char argument {text!r}')
+        return text
+    raise BrilError(f'can not pass a {ir.format_type(type)} argument')
+
+
+### MEMORY
+class Pointer:
+    __slots__ = ('cells', 'offset')
+
+    def __init__(self, cells, offset):
+        self.cells = cells
+        self.offset = offset
+
+    def __repr__(self):
+        return f'<pointer {id(self.cells):x}+{self.offset}>'
+
+
+def _cell(p):
+    if not isinstance(p, Pointer):
+        raise BrilError('not a live pointer')
+    if not 0 <= p.offset < len(p.cells):
+        raise BrilError('pointer out of bounds')
+    return p.offset
+
+
+### STEPS
+# A factory gets the decoded instruction (registers for dest and args,
+# the raw `ir.Instr`, the interpreter) and returns `step(regs)`.
+
+def _int_op(expr):
+    # add, sub and mul wrap around; everything else can't overflow
+    def make(d, a, b, instr, interp):
+        if expr == 'add':
+            def step(regs):
+                r = regs[a] + regs[b]
+                regs[d] = r if INT_MIN <= r <= INT_MAX else wrap(r)
+        elif expr == 'sub':
+            def step(regs):
+                r = regs[a] - regs[b]
+                regs[d] = r if INT_MIN <= r <= INT_MAX else wrap(r)
+        else:
+            def step(regs):
+                r = regs[a] * regs[b]
+                regs[d] = r if INT_MIN <= r <= INT_MAX else wrap(r)
+        return step
+    return make
+
+
+def _make_div(d, a, b, instr, interp):
+    def step(regs):
+        y = regs[b]
+        if y == 0:
+            raise BrilError('division by zero')
+        regs[d] = ir.div(regs[a], y)
+    return step
+
+
+def _compare(op):
+    # separate closures, so the comparison is inline in each
+    def make(d, a, b, instr, interp):
+        if op == 'eq':
+            def step(regs):
+                regs[d] = regs[a] == regs[b]
+        elif op == 'lt':
+            def step(regs):
+                regs[d] = regs[a] < regs[b]
+        elif op == 'gt':
+            def step(regs):
+                regs[d] = regs[a] > regs[b]
+        elif op == 'le':
+            def step(regs):
+                regs[d] = regs[a] <= regs[b]
+        else:
+            def step(regs):
+                regs[d] = regs[a] >= regs[b]
+        return step
+    return make
+
+
+def _make_and(d, a, b, instr, interp):
+    def step(regs):
+        regs[d] = regs[a] and regs[b]
+    return step
+
+
+def _make_or(d, a, b, instr, interp):
+    def step(regs):
+        regs[d] = regs[a] or regs[b]
+    return step
+
+
+def _make_not(d, a, b, instr, interp):
+    def step(regs):
+        regs[d] = not regs[a]
+    return step
+
+
+def _make_id(d, a, b, instr, interp):
+    def step(regs):
+        regs[d] = regs[a]
+    return step
+
+
+def _make_const(d, a, b, instr, interp):
+    value = instr.value
+    t = instr.type
+    if t == 'int':
+        value = wrap(int(value))
+    elif t == 'float':
+        value = float(value)
+    elif t == 'bool':
+        value = bool(value)
+
+    def step(regs):
+        regs[d] = value
+    return step
+
+
+def _make_nop(d, a, b, instr, interp):
+    return None
+
+
+def _apply(fn):
+    # the slower, generic form, for the float and char extensions
+    def make(d, a, b, instr, interp):
+        if b is None:
+            def step(regs):
+                regs[d] = fn(regs[a])
+        else:
+            def step(regs):
+                regs[d] = fn(regs[a], regs[b])
+        return step
+    return make
+
+
+def _fdiv(x, y):
+    if y == 0:
+        if x == 0 or math.isnan(x):
+            return math.nan
+        return math.copysign(math.inf, x) * math.copysign(1.0, y)
+    return x / y
+
+
+def _int2char(n):
+    try:
+        return chr(n)
+    except (ValueError, OverflowError):
+        raise BrilError(f'no character has code {n}') from None
+
+
+def _make_print(d, a, b, instr, interp):
+    args = interp.registers(instr.args)
+    write = interp.write
+
+    def step(regs):
+        write(' '.join([format_value(regs[x]) for x in args]))
+    return step
+
+
+def _make_call(d, a, b, instr, interp):
+    callee = interp.function(instr.funcs[0])
+    args = interp.registers(instr.args)
+    call = interp.call
+    if d is None:
+        def step(regs):
+            call(callee, [regs[x] for x in args])
+    else:
+        def step(regs):
+            regs[d] = call(callee, [regs[x] for x in args])
+    return step
+
+
+def _make_alloc(d, a, b, instr, interp):
+    live = interp.heap
+
+    def step(regs):
+        n = regs[a]
+        if n <= 0:
+            raise BrilError(f'can not allocate {n} cells')
+        cells = [None] * n
+        live[id(cells)] = cells
+        regs[d] = Pointer(cells, 0)
+    return step
+
+
+def _make_free(d, a, b, instr, interp):
+    live = interp.heap
+
+    def step(regs):
+        p = regs[a]
+        if not isinstance(p, Pointer) or p.offset != 0 or live.pop(id(p.cells), None) is None:
+            raise BrilError('freeing something that is not an allocation')
+        # other pointers into the allocation see that it is gone
+        p.cells.clear()
+    return step
+
+
+def _make_store(d, a, b, instr, interp):
+    def step(regs):
+        p = regs[a]
+        p.cells[_cell(p)] = regs[b]
+    return step
+
+
+def _make_load(d, a, b, instr, interp):
+    def step(regs):
+        p = regs[a]
+        value = p.cells[_cell(p)]
+        if value is None:
+            raise BrilError('load from memory that was never stored to')
+        regs[d] = value
+    return step
+
+
+def _make_ptradd(d, a, b, instr, interp):
+    def step(regs):
+        p = regs[a]
+        regs[d] = Pointer(p.cells, p.offset + regs[b])
+    return step
+
+
+STEPS = {
+    'const': _make_const, 'id': _make_id, 'nop': _make_nop,
+    'add': _int_op('add'), 'sub': _int_op('sub'), 'mul': _int_op('mul'), 'div': _make_div,
+    'eq': _compare('eq'), 'lt': _compare('lt'), 'gt': _compare('gt'),
+    'le': _compare('le'), 'ge': _compare('ge'),
+    'and': _make_and, 'or': _make_or, 'not': _make_not,
+    'print': _make_print, 'call': _make_call,
+    'fadd': _apply(lambda x, y: x + y), 'fsub': _apply(lambda x, y: x - y),
+    'fmul': _apply(lambda x, y: x * y), 'fdiv': _apply(_fdiv),
+    'feq': _compare('eq'), 'flt': _compare('lt'), 'fgt': _compare('gt'),
+    'fle': _compare('le'), 'fge': _compare('ge'),
+    'ceq': _compare('eq'), 'clt': _compare('lt'), 'cgt': _compare('gt'),
+    'cle': _compare('le'), 'cge': _compare('ge'),
+    'char2int': _apply(ord), 'int2char': _apply(_int2char),
+    'alloc': _make_alloc, 'free': _make_free, 'store': _make_store,
+    'load': _make_load, 'ptradd': _make_ptradd,
+}
+
+
+### DECODING
+class _Function:
+    """A decoded function. Blocks and edges are numbered; edge `e`
+    leads to block `target[e]`, or returns if that is -1.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.params = []        # registers of the arguments
+        self.nregs = 0
+        self.names = []         # block number -> name
+        self.body = []          # block number -> [step]
+        self.term = []          # block number -> fn(regs) -> edge
+        self.target = []        # edge -> block number, or -1
+        self.source = []        # edge -> block number
+        self.ops = []           # block number -> Counter of its opcodes
+        self.block_counts = []
+        self.edge_counts = []
+
+
+def _split(instrs):
+    # (label, instrs) for every block: a block starts at a label or
+    # after a terminator, like `form_blocks`
+    blocks = []
+    cur = None
+    for instr in instrs:
+        if instr.op is None:
+            cur = (instr.label, [])
+            blocks.append(cur)
+            continue
+        if cur is None:
+            cur = (None, [])
+            blocks.append(cur)
+        cur[1].append(instr)
+        if instr.op in ir.TERMINATORS:
+            cur = None
+    return blocks or [(None, [])]
+
+
+class Interpreter:
+    """A program decoded for running. `run()` can be called more than
+    once; each run starts its counts from zero. What the program prints
+    is passed to `write(line)`, or, without one, collected in the
+    profile's `output`.
+    """
+    def __init__(self, program, write=None):
+        self.output = None
+        if write is None:
+            self.output = []
+            write = self.output.append
+        self.write = write
+        self.heap = {}
+        funcs = ir.functions(program) if isinstance(program, dict) else list(program)
+        self.funcs = {f.name: _Function(f.name) for f in funcs}
+        self.types = {f.name: [t for _, t in f.args] for f in funcs}
+        for f in funcs:
+            self._decode(f, self.funcs[f.name])
+
+    def function(self, name):
+        if name not in self.funcs:
+            raise BrilError(f'no function @{name}')
+        return self.funcs[name]
+
+    def registers(self, names):
+        reg = self._reg
+        return [reg(name) for name in names]
+
+    def _decode(self, func, fn):
+        regs = {}
+        # register 0 is where `ret` leaves its value; the variables,
+        # including ones only terminators and phis name, come after it
+        ret = 0
+
+        def reg(name):
+            r = regs.get(name)
+            if r is None:
+                r = regs[name] = len(regs) + 1
+            return r
+        self._reg = reg
+
+        fn.params = [reg(name) for name, _ in func.args]
+        blocks = _split(func.instrs)
+        number = {}
+        for (label, _), name in zip(blocks, block_names(label for label, _ in blocks)):
+            if label is not None:
+                number.setdefault(label, len(fn.names))
+            fn.names.append(name)
+
+        phis = []       # block number -> [(dest, {pred label: arg})]
+        for b, (label, instrs) in enumerate(blocks):
+            lead = []
+            i = 0
+            while i < len(instrs) and instrs[i].op == 'phi':
+                instr = instrs[i]
+                lead.append((reg(instr.dest), dict(zip(instr.labels, instr.args))))
+                i += 1
+            phis.append(lead)
+            steps = []
+            for instr in instrs[i:]:
+                op = instr.op
+                if op in ir.TERMINATORS:
+                    break
+                if op == 'phi':
+                    raise BrilError(f'@{func.name}: phi after other instructions in .{fn.names[b]}')
+                make = STEPS.get(op)
+                if make is None:
+                    raise BrilError(f'@{func.name}: unknown opcode {op}')
+                args = instr.args
+                step = make(reg(instr.dest) if instr.dest is not None else None,
+                            reg(args[0]) if args else None,
+                            reg(args[1]) if len(args) > 1 else None,
+                            instr, self)
+                if step is not None:
+                    steps.append(step)
+            fn.body.append(steps)
+            fn.ops.append(Counter(instr.op for instr in instrs))
+
+        for b, (pred, instrs) in enumerate(blocks):
+            last = instrs[-1] if instrs else None
+            op = last.op if last is not None and last.op in ir.TERMINATORS else None
+            if op in ('jmp', 'br'):
+                for name in last.labels:
+                    if name not in number:
+                        raise BrilError(f'@{func.name}: no label .{name}')
+                targets = [number[name] for name in last.labels]
+            elif op == 'ret' or b + 1 == len(blocks):
+                targets = [-1]
+            else:
+                targets = [b + 1]
+
+            # the edges, with the copies for the phis they lead to
+            edges = []
+            copies = []
+            for t in targets:
+                edges.append(len(fn.target))
+                fn.target.append(t)
+                fn.source.append(b)
+                lead = phis[t] if t != -1 else ()
+                # phis pick their argument by the label of the block
+                # control came from; anonymous blocks have none
+                copies.append([(d, reg(args[pred]) if pred in args else None)
+                               for d, args in lead])
+            fn.term.append(self._terminator(op, last, edges, copies, reg, ret))
+
+        fn.nregs = len(regs) + 1
+        fn.block_counts = [0] * len(fn.names)
+        fn.edge_counts = [0] * len(fn.target)
+
+    def _terminator(self, op, instr, edges, copies, reg, ret):
+        moves = [_copier(c) for c in copies]
+        if op == 'br':
+            cond = reg(instr.args[0])
+            yes, no = edges
+            move_yes, move_no = moves
+            if move_yes is None and move_no is None:
+                def term(regs):
+                    return yes if regs[cond] else no
+            else:
+                def term(regs):
+                    if regs[cond]:
+                        if move_yes is not None:
+                            move_yes(regs)
+                        return yes
+                    if move_no is not None:
+                        move_no(regs)
+                    return no
+            return term
+
+        e, = edges
+        move, = moves
+        if op == 'ret' and instr.args:
+            value = reg(instr.args[0])
+
+            def term(regs):
+                regs[ret] = regs[value]
+                return e
+        elif move is None:
+            def term(regs):
+                return e
+        else:
+            def term(regs):
+                move(regs)
+                return e
+        return term
+
+    ### RUNNING
+    def call(self, fn, argv):
+        if len(argv) != len(fn.params):
+            raise BrilError(f'@{fn.name} takes {len(fn.params)} arguments, got {len(argv)}')
+        regs = [None] * fn.nregs
+        for r, v in zip(fn.params, argv):
+            regs[r] = v
+        body, term, target = fn.body, fn.term, fn.target
+        blocks, edges = fn.block_counts, fn.edge_counts
+        b = 0
+        while b >= 0:
+            blocks[b] += 1
+            for step in body[b]:
+                step(regs)
+            e = term[b](regs)
+            edges[e] += 1
+            b = target[e]
+        return regs[0]
+
+    def run(self, args=()):
+        """Run @main with `args` (values, or strings as on the command
+        line), and return the `Profile`.
+        """
+        for fn in self.funcs.values():
+            fn.block_counts = [0] * len(fn.names)
+            fn.edge_counts = [0] * len(fn.target)
+        self.heap.clear()
+        if self.output is not None:
+            self.output.clear()
+
+        main = self.function('main')
+        types = self.types['main']
+        if len(args) != len(types):
+            raise BrilError(f'@main takes {len(types)} arguments, got {len(args)}')
+        argv = [parse_value(a, t) if isinstance(a, str) else a for a, t in zip(args, types)]
+
+        # bril calls nest a few Python frames deep
+        limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(max(limit, 100000))
+        try:
+            with stats.timed('interp'):
+                self.call(main, argv)
+        except (TypeError, AttributeError, IndexError) as e:
+            raise BrilError(f'bad operand ({e}); a variable may be undefined') from e
+        finally:
+            sys.setrecursionlimit(limit)
+        if self.heap:
+            raise BrilError('some memory locations have not been freed by the end of execution')
+
+        profile = Profile(self.funcs.values())
+        profile.output = list(self.output) if self.output is not None else None
+        if stats.enabled:
+            stats.count('interp.instrs', profile.total)
+            stats.count('interp.blocks', sum(sum(c.values()) for c in profile.blocks.values()))
+        return profile
+
+
+def _copier(pairs):
+    if not pairs:
+        return None
+    dests = [d for d, _ in pairs]
+    srcs = [s for _, s in pairs]
+    if len(pairs) == 1:
+        d, s = pairs[0]
+        if s is None:
+            def move(regs):
+                regs[d] = None
+        else:
+            def move(regs):
+                regs[d] = regs[s]
+        return move
+
+    def move(regs):
+        # every phi reads before any of them writes
+        values = [regs[s] if s is not None else None for s in srcs]
+        for d, v in zip(dests, values):
+            regs[d] = v
+    return move
+
+
+class Profile:
+    """What a run executed.
+
+    - `total`: instructions executed, as `brili -p` counts them;
+    - `ops`: instructions executed per opcode;
+    - `blocks`: function -> block name -> times it ran;
+    - `edges`: function -> (from, to) block names -> times taken
+      (returns aren't edges).
+
+    Blocks and edges that never ran are left out.
+    """
+    def __init__(self, funcs):
+        self.ops = Counter()
+        self.blocks = {}
+        self.edges = {}
+        for fn in funcs:
+            names = fn.names
+            blocks = {}
+            for b, n in enumerate(fn.block_counts):
+                if n:
+                    blocks[names[b]] = n
+                    for op, k in fn.ops[b].items():
+                        self.ops[op] += n * k
+            edges = Counter()
+            for e, n in enumerate(fn.edge_counts):
+                t = fn.target[e]
+                if n and t != -1:
+                    edges[names[fn.source[e]], names[t]] += n
+            if blocks:
+                self.blocks[fn.name] = blocks
+                self.edges[fn.name] = dict(edges)
+        self.total = sum(self.ops.values())
+
+    def to_json(self):
+        return {
+            'total_dyn_inst': self.total,
+            'ops': dict(self.ops.most_common()),
+            'functions': {
+                name: {
+                    'blocks': blocks,
+                    'edges': {f'{a} -> {b}': n for (a, b), n in self.edges[name].items()},
+                }
+                for name, blocks in self.blocks.items()
+            },
+        }
+
+
+def run(program, args=(), write=None):
+    """Run `program` (Bril JSON, or `ir.Function`s). Returns the
+    `Profile`, with what the program printed as a list of lines in
+    `profile.output`, or written with `write(line)` if that is given.
+    """
+    return Interpreter(program, write).run(args)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a BRIL program (JSON on stdin) and profile it")
+    parser.add_argument("args", nargs="*", help="Arguments for @main")
+    parser.add_argument("-p", "--total", action="store_true", help="Print the number of instructions executed on stderr, like brili -p")
+    parser.add_argument("--profile", action="store_true", help="Print the block, edge and opcode counts as JSON on stderr")
+    parser.add_argument("--stats", action="store_true", help="Print the run time and counters as JSON on stderr")
+    args = parser.parse_args()
+    if args.stats:
+        stats.enable()
+
+    try:
+        profile = run(json.load(sys.stdin), args.args, print)
+    except BrilError as e:
+        print(f'error: {e}', file=sys.stderr)
+        sys.exit(2)
+    if args.total:
+        print(f'total_dyn_inst: {profile.total}', file=sys.stderr)
+    if args.profile:
+        json.dump(profile.to_json(), sys.stderr, indent=2)
+        sys.stderr.write('\n')
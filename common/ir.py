@@ -0,0 +1,209 @@
+"""A compact in-memory form of Bril programs.
+
+The dicts from `json.load` cost a few hundred bytes per instruction,
+and every `instr.get('args', [])` is a lookup plus a throwaway list.
+Here an instruction is an `Instr` with one slot per field: opcodes,
+variable names, labels and function names are interned strings, and
+`args`, `labels` and `funcs` are tuples, empty when the instruction has
+none. Fields an instruction doesn't have are None. Labels are `Label`
+objects, whose `op` is None, so `instr.op is None` tells them apart.
+
+Programs are converted from JSON when they are read (`functions()`)
+and back to JSON only when they are written out (`program_to_json()`).
+"""
+import sys
+
+intern = sys.intern
+
+# Instructions that terminate a basic block.
+TERMINATORS = frozenset(('br', 'jmp', 'ret'))
+
+# Value operations: no side effects, and the result only depends on the
+# arguments.
+PURE_OPS = frozenset((
+    'add', 'mul', 'sub', 'div', 'eq', 'lt', 'gt', 'le', 'ge', 'not', 'and', 'or',
+    'fadd', 'fmul', 'fsub', 'fdiv', 'feq', 'flt', 'fgt', 'fle', 'fge',
+    'ceq', 'clt', 'cgt', 'cle', 'cge', 'char2int', 'int2char', 'ptradd',
+))
+# The pure operations that can fail at run time.
+TRAPPING_OPS = frozenset(('div', 'int2char'))
+
+INT_MIN = -(1 << 63)
+INT_MAX = (1 << 63) - 1
+
+
+def wrap(n):
+    # bril integers are 64-bit two's complement
+    n &= (1 << 64) - 1
+    return n - (1 << 64) if n >> 63 else n
+
+
+def div(a, b):
+    # truncates towards zero; raises ZeroDivisionError when b is 0
+    q = abs(a) // abs(b)
+    return wrap(q if (a < 0) == (b < 0) else -q)
+
+
+# Constant folding of the int and bool operations (and `id`).
+FOLD = {
+    'add': lambda a, b: wrap(a + b),
+    'sub': lambda a, b: wrap(a - b),
+    'mul': lambda a, b: wrap(a * b),
+    'div': div,
+    'eq': lambda a, b: a == b,
+    'lt': lambda a, b: a < b,
+    'gt': lambda a, b: a > b,
+    'le': lambda a, b: a <= b,
+    'ge': lambda a, b: a >= b,
+    'not': lambda a: not a,
+    'and': lambda a, b: a and b,
+    'or': lambda a, b: a or b,
+    'id': lambda a: a,
+}
+
+
+def _intern_all(names):
+    return tuple([intern(name) for name in names]) if names else ()
+
+
+def _type(t):
+    # primitive types are strings; pointer types are {'ptr': ...} dicts
+    return intern(t) if isinstance(t, str) else t
+
+
+class Label:
+    __slots__ = ('label',)
+    # read like an instruction that does nothing
+    op = None
+    dest = None
+    args = ()
+    labels = ()
+
+    def __init__(self, label):
+        self.label = intern(label)
+
+    def to_json(self):
+        return {'label': self.label}
+
+    def __repr__(self):
+        return f'.{self.label}:'
+
+
+class Instr:
+    __slots__ = ('op', 'dest', 'type', 'args', 'funcs', 'labels', 'value')
+
+    def __init__(self, op, dest=None, type=None, args=(), funcs=(), labels=(), value=None):
+        # strings are expected to be interned already (see from_json)
+        self.op = op
+        self.dest = dest
+        self.type = type
+        self.args = args
+        self.funcs = funcs
+        self.labels = labels
+        self.value = value
+
+    @classmethod
+    def from_json(cls, instr):
+        get = instr.get
+        dest = get('dest')
+        return cls(intern(instr['op']),
+                   intern(dest) if dest is not None else None,
+                   _type(get('type')),
+                   _intern_all(get('args')),
+                   _intern_all(get('funcs')),
+                   _intern_all(get('labels')),
+                   get('value'))
+
+    def to_json(self):
+        # keys in sorted order, like bril2json
+        instr = {}
+        if self.args:
+            instr['args'] = list(self.args)
+        if self.dest is not None:
+            instr['dest'] = self.dest
+        if self.funcs:
+            instr['funcs'] = list(self.funcs)
+        if self.labels:
+            instr['labels'] = list(self.labels)
+        instr['op'] = self.op
+        if self.type is not None:
+            instr['type'] = self.type
+        if self.value is not None:
+            instr['value'] = self.value
+        return instr
+
+    def copy(self, **changes):
+        new = Instr(self.op, self.dest, self.type, self.args, self.funcs, self.labels, self.value)
+        for field, value in changes.items():
+            setattr(new, field, value)
+        return new
+
+    def __repr__(self):
+        # bril text, without the trailing semicolon
+        if self.op == 'const':
+            value = str(self.value).lower() if isinstance(self.value, bool) else self.value
+            rhs = f'const {value}'
+        else:
+            rhs = ' '.join([self.op] + ['@' + f for f in self.funcs] + list(self.args)
+                           + ['.' + label for label in self.labels])
+        if self.dest is None:
+            return rhs
+        if self.type is None:
+            return f'{self.dest} = {rhs}'
+        return f'{self.dest}: {format_type(self.type)} = {rhs}'
+
+
+def format_type(t):
+    if isinstance(t, dict):
+        return f"ptr<{format_type(t['ptr'])}>"
+    return str(t)
+
+
+def from_json(instr):
+    # an instruction or a label
+    if 'op' in instr:
+        return Instr.from_json(instr)
+    return Label(instr['label'])
+
+
+class Function:
+    __slots__ = ('name', 'args', 'type', 'instrs')
+
+    def __init__(self, name, args=(), type=None, instrs=None):
+        self.name = name
+        self.args = args        # (name, type) pairs
+        self.type = type
+        self.instrs = instrs if instrs is not None else []
+
+    @classmethod
+    def from_json(cls, func):
+        args = tuple([(intern(a['name']), _type(a['type'])) for a in func.get('args', ())])
+        return cls(func['name'], args, _type(func.get('type')),
+                   [from_json(instr) for instr in func.get('instrs', ())])
+
+    def to_json(self):
+        func = {}
+        if self.args:
+            func['args'] = [{'name': name, 'type': t} for name, t in self.args]
+        func['instrs'] = [instr.to_json() for instr in self.instrs]
+        func['name'] = self.name
+        if self.type is not None:
+            func['type'] = self.type
+        return func
+
+
+def each_function(bril):
+    """The functions of a program, as `Function`s, converted one at a
+    time (so `bril['functions']` may be a stream). Accepts JSON or
+    functions that are already converted.
+    """
+    for f in bril['functions']:
+        yield f if isinstance(f, Function) else Function.from_json(f)
+
+
+def functions(bril):
+    return list(each_function(bril))
+
+
+def program_to_json(funcs):
+    return {'functions': [f.to_json() for f in funcs]}
@@ -0,0 +1,66 @@
+"""Per-function analysis caching for pass pipelines.
+
+An `AnalysisManager` computes the analyses of one function on demand and
+keeps them until a transform says they may be stale. Analyses are plain
+functions `fn(func, am)` in a name -> function table (each homework has
+its own `ANALYSES`). They get the analyses they build on through
+`am.get()`, which is also how the manager learns what depends on what.
+
+A transform that changes the function calls `am.invalidate(preserved)`
+with the names of the analyses it kept valid, e.g. DCE keeps the blocks
+and the CFG. Everything else is dropped, along with anything that was
+computed from something dropped, and is recomputed the next time it is
+asked for.
+"""
+from collections import Counter
+
+import stats
+
+
+class AnalysisManager:
+    def __init__(self, func, analyses, **options):
+        self.func = func
+        self.analyses = analyses
+        # settings analyses may read, like which dominator algorithm to use
+        self.options = options
+        self.cache = {}
+        self.uses = {}              # analysis -> analyses it was computed from
+        self.computed = Counter()   # how often each analysis was computed
+        self.active = []
+
+    def get(self, name):
+        if self.active:
+            self.uses[self.active[-1]].add(name)
+        if name in self.cache:
+            return self.cache[name]
+
+        self.uses[name] = set()
+        self.active.append(name)
+        try:
+            with stats.timed(name):
+                result = self.analyses[name](self.func, self)
+        finally:
+            self.active.pop()
+        self.cache[name] = result
+        self.computed[name] += 1
+        return result
+
+    def cached(self, name):
+        return self.cache.get(name)
+
+    def update(self, name, result):
+        # a transform that kept an analysis up to date hands it back
+        self.cache[name] = result
+        self.uses.setdefault(name, set())
+
+    def invalidate(self, preserved=()):
+        stale = {name for name in self.cache if name not in preserved}
+        grew = bool(stale)
+        while grew:
+            grew = False
+            for name in self.cache:
+                if name not in stale and self.uses[name] & stale:
+                    stale.add(name)
+                    grew = True
+        for name in stale:
+            del self.cache[name]
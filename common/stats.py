@@ -0,0 +1,109 @@
+"""Counters and timers behind the `--stats` flag of the scripts.
+
+Everything here is off unless `enable()` was called. Instrumented code
+checks `stats.enabled` before doing anything, and solvers keep their own
+local counts and add them with one `count()` call when they finish. So
+with the flag off, a pass pays for one attribute test per call. `timed()`
+returns a shared do-nothing context manager in that case.
+
+With the flag on:
+
+- `timed(name)` records the calls, wall time and peak memory of a pass.
+  Peak memory is measured with `tracemalloc`, which makes everything
+  noticeably slower, so compare times between runs with `--stats`, not
+  with runs without it. A pass that runs inside another counts towards
+  both.
+- `count(name, n)` adds to a counter.
+
+Numbers are collected in this process only, so the hw2 scripts don't
+use a process pool when `--stats` is given. The report is printed as
+JSON on stderr when the script exits.
+"""
+import sys
+import json
+import time
+import atexit
+import resource
+import tracemalloc
+from contextlib import nullcontext
+from collections import Counter
+
+enabled = False
+counters = Counter()
+passes = {}     # name -> {'calls', 'seconds', 'peak_bytes'}
+
+_start = None
+_NOOP = nullcontext()
+_stack = []     # running timers, innermost last
+
+
+def enable(out=sys.stderr):
+    global enabled, _start
+    enabled = True
+    _start = time.perf_counter()
+    tracemalloc.start()
+    atexit.register(report, out)
+
+
+def enable_counters():
+    # counters only: no memory tracing and no report at exit, for
+    # callers that read `counters` themselves
+    global enabled
+    enabled = True
+
+
+def count(name, n=1):
+    counters[name] += n
+
+
+class _Timer:
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        current, peak = tracemalloc.get_traced_memory()
+        if _stack:
+            # the outer pass's peak so far, before the counter is reset
+            _stack[-1].peak = max(_stack[-1].peak, peak)
+        tracemalloc.reset_peak()
+        self.base = current
+        self.peak = current
+        _stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        _stack.pop()
+        _, peak = tracemalloc.get_traced_memory()
+        self.peak = max(self.peak, peak)
+        if _stack:
+            _stack[-1].peak = max(_stack[-1].peak, self.peak)
+
+        entry = passes.setdefault(self.name, {'calls': 0, 'seconds': 0.0, 'peak_bytes': 0})
+        entry['calls'] += 1
+        entry['seconds'] += elapsed
+        # memory the pass needed on top of what was there when it started
+        entry['peak_bytes'] = max(entry['peak_bytes'], self.peak - self.base)
+
+
+def timed(name):
+    return _Timer(name) if enabled else _NOOP
+
+
+def summary():
+    for entry in passes.values():
+        entry['seconds'] = round(entry['seconds'], 6)
+    return {
+        'wall_seconds': round(time.perf_counter() - _start, 6),
+        # ru_maxrss is in kilobytes on Linux
+        'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'passes': passes,
+        'counters': dict(sorted(counters.items())),
+    }
+
+
+def report(out=sys.stderr):
+    json.dump(summary(), out, indent=2)
+    out.write('\n')
+    out.flush()
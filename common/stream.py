@@ -0,0 +1,134 @@
+"""Reading and writing Bril JSON one function at a time.
+
+`json.load` has to build the whole program before a pass can start, and
+`json.dump(..., indent=4)` keeps the whole result around while it
+writes, with about as much whitespace as data. `iter_functions()` reads
+the `functions` array incrementally and yields one function dict at a
+time, and `ProgramWriter` writes functions out compactly as soon as they
+are done. A pipeline that goes function by function therefore holds one
+function (plus a read buffer) in memory at a time.
+"""
+import json
+
+_decoder = json.JSONDecoder()
+_SPACE = ' \t\n\r'
+
+CHUNK = 1 << 16
+
+
+class _Reader:
+    def __init__(self, f, chunk=CHUNK):
+        self.f = f
+        self.chunk = chunk
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def more(self, size):
+        # drop what has been consumed and append the next `size` chars
+        data = self.f.read(size)
+        if not data:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def peek(self):
+        # next non-space character, or '' at the end of the input
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _SPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.more(self.chunk):
+                return ''
+
+    def expect(self, c):
+        got = self.peek()
+        if got != c:
+            raise ValueError(f"expected {c!r} in Bril JSON, got {got or 'end of input'!r}")
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                val, end = _decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                # most likely cut off by the end of the buffer; read as much
+                # again as is pending, so a huge value is re-scanned only a
+                # logarithmic number of times
+                if not self.more(max(self.chunk, len(self.buf) - self.pos)):
+                    raise
+                continue
+            if end == len(self.buf) and not self.eof and self.more(self.chunk):
+                # a number may continue in the next chunk
+                continue
+            self.pos = end
+            return val
+
+
+def iter_functions(f, chunk=CHUNK):
+    """Yield the function dicts of the Bril JSON program in file `f`,
+    one at a time. Other top-level keys are read and skipped.
+    """
+    r = _Reader(f, chunk)
+    r.expect('{')
+    if r.peek() == '}':
+        return
+    while True:
+        key = r.value()
+        r.expect(':')
+        if key == 'functions':
+            r.expect('[')
+            if r.peek() == ']':
+                r.pos += 1
+            else:
+                while True:
+                    yield r.value()
+                    if r.peek() == ']':
+                        r.pos += 1
+                        break
+                    r.expect(',')
+        else:
+            r.value()
+        if r.peek() == '}':
+            return
+        r.expect(',')
+
+
+class ProgramWriter:
+    """Write a program to file `f` function by function, as compact JSON.
+    Use as a context manager, or call `close()` to finish the program.
+    """
+    def __init__(self, f):
+        self.f = f
+        self.count = 0
+        f.write('{"functions":[')
+
+    def write(self, func):
+        if self.count:
+            self.f.write(',')
+        json.dump(func, self.f, separators=(',', ':'))
+        self.count += 1
+
+    def close(self):
+        self.f.write(']}\n')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0] is None:
+            self.close()
+
+
+def transform(fin, fout, fn, chunk=CHUNK):
+    """Stream every function of `fin` through `fn` (JSON dict in, JSON
+    dict out) into `fout`. Returns the number of functions.
+    """
+    with ProgramWriter(fout) as out:
+        for func in iter_functions(fin, chunk):
+            out.write(fn(func))
+    return out.count
@@ -0,0 +1,279 @@
+"""Synthetic Bril programs for benchmarking the passes.
+
+Every generator takes a `size`, which is roughly the number of
+instructions it produces, and a `seed`, and returns a program as the
+JSON dicts `bril2json` would give. The programs are well formed: every
+variable is defined before it is read, and every loop has a counter, so
+they also run (and terminate) in an interpreter.
+
+The shapes stress different parts of the passes:
+
+- `loop_nest`: one deep nest of counted loops, so a deep dominator tree
+  and a long chain of back edges for the dataflow solvers;
+- `branch_ladder`: a long if / else-if chain whose arms all meet in one
+  block, so one join with very many predecessors;
+- `irreducible`: loops with two entries, which have no single header,
+  so the dominator and frontier code can't rely on reducibility;
+- `many_vars`: a loop over blocks that use hundreds of variables, so
+  liveness works with wide bit vectors;
+- `many_functions`: many small functions that call each other, so
+  per-function overhead dominates;
+- `local_temps`: a loop over many blocks, each computing with its own
+  temporaries that are dead when it ends, so there are thousands of
+  variables but each one only lives in one block.
+
+The bodies repeat expressions and define values that are never used, so
+LVN and DCE both have work to do.
+"""
+import sys
+import json
+import random
+import argparse
+
+OPS = ('add', 'mul', 'sub', 'add', 'mul')
+
+
+class _Builder:
+    def __init__(self, seed, nvars):
+        self.rng = random.Random(seed)
+        self.vars = [f'v{i}' for i in range(nvars)]
+        self.instrs = []
+        self.labels = 0
+        for i, v in enumerate(self.vars):
+            self.const(v, i % 7 - 3)
+        self.const('one', 1)
+
+    def label(self, prefix):
+        self.labels += 1
+        return f'{prefix}.{self.labels}'
+
+    def emit(self, **instr):
+        self.instrs.append(instr)
+
+    def place(self, label):
+        self.instrs.append({'label': label})
+
+    def const(self, dest, value, type='int'):
+        self.emit(op='const', dest=dest, type=type, value=value)
+
+    def body(self, n, vars=None):
+        """`n` arithmetic instructions over `vars`: some recompute an
+        earlier expression, some are never read.
+        """
+        rng = self.rng
+        vars = vars or self.vars
+        done = []
+        for _ in range(n):
+            r = rng.random()
+            if r < 0.2 and done:
+                # the same expression again, into another variable
+                op, args = rng.choice(done)
+                self.emit(op=op, dest=rng.choice(vars), type='int', args=list(args))
+            elif r < 0.3:
+                # dead unless something later happens to read it
+                self.const(rng.choice(vars), rng.randint(-9, 9))
+            else:
+                op = rng.choice(OPS)
+                args = (rng.choice(vars), rng.choice(vars))
+                done.append((op, args))
+                self.emit(op=op, dest=rng.choice(vars), type='int', args=list(args))
+
+    def loop_head(self, counter, trips):
+        """Start a loop that runs `trips` times. Returns the labels to
+        pass to `loop_tail`.
+        """
+        head, body, exit = self.label('head'), self.label('body'), self.label('exit')
+        self.const(counter, 0)
+        self.const(counter + '.n', trips)
+        self.place(head)
+        self.emit(op='lt', dest=counter + '.c', type='bool', args=[counter, counter + '.n'])
+        self.emit(op='br', args=[counter + '.c'], labels=[body, exit])
+        self.place(body)
+        return head, exit
+
+    def loop_tail(self, counter, head, exit):
+        self.emit(op='add', dest=counter, type='int', args=[counter, 'one'])
+        self.emit(op='jmp', labels=[head])
+        self.place(exit)
+
+    def finish(self, name='main', args=(), type=None):
+        if type is None:
+            self.emit(op='print', args=self.vars[:4])
+        else:
+            self.emit(op='ret', args=[self.vars[0]])
+        func = {'name': name, 'instrs': self.instrs}
+        if args:
+            func['args'] = [{'name': a, 'type': 'int'} for a in args]
+        if type is not None:
+            func['type'] = type
+        return func
+
+
+def loop_nest(size, seed=0):
+    b = _Builder(seed, 16)
+    # each level costs about 14 instructions
+    depth = max(1, size // 14)
+    loops = []
+    for d in range(depth):
+        # only the outer loops go around more than once, or running it
+        # would take 2^depth iterations
+        loops.append((f'i{d}',) + b.loop_head(f'i{d}', 2 if d < 3 else 1))
+        b.body(3)
+    for counter, head, exit in reversed(loops):
+        b.body(2)
+        b.loop_tail(counter, head, exit)
+    return {'functions': [b.finish()]}
+
+
+def branch_ladder(size, seed=0):
+    b = _Builder(seed, 16)
+    # each rung costs about 9 instructions
+    width = max(1, size // 9)
+    join = 'join'
+    b.emit(op='add', dest='x', type='int', args=['v0', 'v1'])
+    for k in range(width):
+        arm, next_test = b.label('arm'), b.label('test')
+        b.const('k', k)
+        b.emit(op='eq', dest='c', type='bool', args=['x', 'k'])
+        b.emit(op='br', args=['c'], labels=[arm, next_test])
+        b.place(arm)
+        b.body(3)
+        b.emit(op='jmp', labels=[join])
+        b.place(next_test)
+    b.body(2)
+    b.place(join)
+    return {'functions': [b.finish()]}
+
+
+def irreducible(size, seed=0):
+    b = _Builder(seed, 16)
+    # each region costs about 22 instructions
+    for r in range(max(1, size // 22)):
+        left, right, exit = b.label('left'), b.label('right'), b.label('exit')
+        b.const('k', 3)
+        b.emit(op='lt', dest='c', type='bool', args=[b.rng.choice(b.vars), b.rng.choice(b.vars)])
+        # enter the cycle left -> right -> left at either end
+        b.emit(op='br', args=['c'], labels=[left, right])
+        for here, there in ((left, right), (right, left)):
+            b.place(here)
+            b.body(4)
+            b.emit(op='sub', dest='k', type='int', args=['k', 'one'])
+            b.const('z', 0)
+            b.emit(op='gt', dest='c', type='bool', args=['k', 'z'])
+            b.emit(op='br', args=['c'], labels=[there, exit])
+        b.place(exit)
+    return {'functions': [b.finish()]}
+
+
+def many_vars(size, seed=0):
+    # about one variable per 4 instructions, at least 64
+    b = _Builder(seed, max(64, size // 4))
+    head, exit = b.loop_head('i', 2)
+    blocks = max(1, size // 40)
+    for _ in range(blocks):
+        side, skip = b.label('side'), b.label('skip')
+        b.body(30)
+        b.emit(op='lt', dest='c', type='bool', args=[b.rng.choice(b.vars), b.rng.choice(b.vars)])
+        b.emit(op='br', args=['c'], labels=[side, skip])
+        b.place(side)
+        b.body(4)
+        b.place(skip)
+    b.loop_tail('i', head, exit)
+    func = b.finish()
+    # read every variable, so liveness has to carry all of them
+    for i in range(0, len(b.vars), 8):
+        func['instrs'].insert(-1, {'op': 'print', 'args': b.vars[i:i + 8]})
+    return {'functions': [func]}
+
+
+def many_functions(size, seed=0):
+    # each function costs about 40 instructions
+    n = max(2, size // 40)
+    funcs = []
+    for f in range(n):
+        b = _Builder(seed * n + f, 8)
+        if f:
+            b.emit(op='add', dest='v0', type='int', args=['v0', 'p'])
+        # only main loops, or the chain of calls would run 2^n times
+        head, exit = b.loop_head('i', 1 if f else 2)
+        b.body(10)
+        if f + 1 < n:
+            b.emit(op='call', dest='v1', type='int', funcs=[f'f{f + 1}'], args=['v1'])
+        b.body(10)
+        b.loop_tail('i', head, exit)
+        if f:
+            funcs.append(b.finish(f'f{f}', args=('p',), type='int'))
+        else:
+            funcs.append(b.finish())
+    return {'functions': funcs}
+
+
+def local_temps(size, seed=0):
+    b = _Builder(seed, 8)
+    head, exit = b.loop_head('i', 2)
+    # each block costs about 12 instructions
+    for k in range(max(1, size // 12)):
+        skip = b.label('skip')
+        temps = [f't{k}.{j}' for j in range(8)]
+        for j, t in enumerate(temps):
+            args = [b.rng.choice(b.vars), temps[j - 1]] if j else [b.rng.choice(b.vars), 'one']
+            b.emit(op=b.rng.choice(OPS), dest=t, type='int', args=args)
+        b.emit(op='add', dest=b.rng.choice(b.vars), type='int', args=[temps[-1], temps[3]])
+        b.emit(op='lt', dest='c', type='bool', args=[temps[-1], temps[0]])
+        b.emit(op='br', args=['c'], labels=[skip, skip])
+        b.place(skip)
+    b.loop_tail('i', head, exit)
+    return {'functions': [b.finish()]}
+
+
+def random_cfg(size, seed=0):
+    """Short blocks joined by random jumps and branches, for checking
+    analyses against each other. It is not one of the workloads: loops
+    need not end, some blocks are unreachable, and `u` is read on paths
+    where it was never written (the argument `x` is never constant).
+    """
+    b = _Builder(seed, 4)
+    rng = b.rng
+    vars = b.vars + ['x', 'u']
+    labels = [f'l{i}' for i in range(max(2, size // 6))]
+    # a block without its label is anonymous, and unreachable unless the
+    # one before falls through
+    anonymous = {label for label in labels[1:] if rng.random() < 0.1}
+    targets = [label for label in labels if label not in anonymous]
+    for label in labels:
+        if label not in anonymous:
+            b.place(label)
+        b.body(rng.randint(0, 4), vars)
+        r = rng.random()
+        if r < 0.3:
+            b.emit(op='jmp', labels=[rng.choice(targets)])
+        elif r < 0.6:
+            b.emit(op='lt', dest='c', type='bool', args=[rng.choice(vars), rng.choice(vars)])
+            b.emit(op='br', args=['c'], labels=[rng.choice(targets), rng.choice(targets)])
+        elif r < 0.7:
+            b.emit(op='print', args=[rng.choice(vars)])
+            b.emit(op='ret')
+    return {'functions': [b.finish(args=('x',))]}
+
+WORKLOADS = {
+    'loop_nest': loop_nest,
+    'branch_ladder': branch_ladder,
+    'irreducible': irreducible,
+    'many_vars': many_vars,
+    'many_functions': many_functions,
+    'local_temps': local_temps,
+}
+
+
+def generate(kind, size, seed=0):
+    return WORKLOADS[kind](size, seed)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic Bril program")
+    parser.add_argument("kind", choices=sorted(WORKLOADS))
+    parser.add_argument("size", type=int, help="About how many instructions to generate")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    json.dump(generate(args.kind, args.size, args.seed), sys.stdout)
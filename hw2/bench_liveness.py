@@ -0,0 +1,128 @@
+import sys
+import time
+import random
+import argparse
+
+# cfg puts ../common on the path
+import cfg
+import ir
+import workloads
+from dce import Liveness
+
+# Random edits to the blocks of the workloads and of random CFGs
+# (workloads.random_cfg), with liveness kept up to date by
+# Liveness.update(), timed against solving it again from scratch. With
+# --check, the live-in and live-out sets are compared with the full
+# solve after every edit; exits 1 on the first mismatch.
+
+def random_edit(blocks, rng):
+    """Edit one block in place: delete a definition, add a read or a
+    write, or retarget its jump or branch. Returns the block's id and
+    whether its successors changed, or None if the edit picked doesn't
+    apply to the block.
+    """
+    b = rng.randrange(len(blocks))
+    block = blocks[b]
+    # the label stays first and the terminator last
+    first = 1 if block and block[0].op is None else 0
+    last = len(block) - 1 if block and block[-1].op in ir.TERMINATORS else len(block)
+    vars = [instr.dest for blk in blocks for instr in blk if instr.dest is not None]
+    r = rng.random()
+    if r < 0.3:
+        defs = [i for i in range(first, last) if block[i].dest is not None]
+        if not defs:
+            return None
+        del block[rng.choice(defs)]
+    elif r < 0.5 and vars:
+        block.insert(rng.randint(first, last), ir.Instr('print', args=(rng.choice(vars),)))
+    elif r < 0.7 and vars:
+        block.insert(rng.randint(first, last),
+                     ir.Instr('const', dest=rng.choice(vars), type='int', value=0))
+    else:
+        labels = [blk[0].label for blk in blocks if blk and blk[0].op is None]
+        term = block[-1] if block else None
+        if not labels or term is None or term.op not in ('jmp', 'br'):
+            return None
+        block[-1] = ir.Instr(term.op, args=term.args,
+                             labels=tuple(rng.choice(labels) for _ in term.labels))
+        return b, True
+    return b, False
+
+def names(live, masks):
+    # bit masks as sets of names, since a full solve numbers the
+    # variables in a different order
+    return [{var for var, i in live.index.items() if mask >> i & 1} for mask in masks]
+
+def check(live, blocks, graph):
+    full = Liveness(blocks, graph)
+    for which in ('live_in', 'live_out'):
+        want = names(full, getattr(full, which))
+        got = names(live, getattr(live, which))
+        if got != want:
+            b = next(b for b in range(len(want)) if got[b] != want[b])
+            return f"{which} of block {b}"
+    return None
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+def run(bril, what, args, rng):
+    """Edit every function of `bril`. Returns the seconds spent in
+    update() and in full solves, and whether every update matched (None
+    without --check).
+    """
+    t_inc = t_full = 0.0
+    for func in ir.each_function(bril):
+        blocks = cfg.function_blocks(func)
+        graph = cfg.block_cfg(blocks)
+        live = Liveness(blocks, graph)
+        for _ in range(args.edits):
+            edit = random_edit(blocks, rng)
+            if edit is None:
+                continue
+            b, moved = edit
+            if moved:
+                graph = cfg.block_cfg(blocks)
+                _, t = timed(live.update, {b}, graph)
+            else:
+                _, t = timed(live.update, {b})
+            t_inc += t
+            t_full += timed(Liveness, blocks, graph)[1]
+            if args.check:
+                problem = check(live, blocks, graph)
+                if problem:
+                    print(f"# {what} @{func.name}: {problem} differs after editing block {b}", file=sys.stderr)
+                    return t_inc, t_full, False
+    return t_inc, t_full, True if args.check else None
+
+def main(args):
+    rng = random.Random(args.seed)
+    print("workload,size,edits,update_s,full_s,match")
+    for kind in args.workloads:
+        for size in args.sizes:
+            t_inc, t_full, match = run(workloads.generate(kind, size, args.seed), f'{kind} {size}', args, rng)
+            print(f"{kind},{size},{args.edits},{t_inc:.4f},{t_full:.4f},{'' if match is None else match}")
+            sys.stdout.flush()
+            if match is False:
+                sys.exit(1)
+
+    if args.check:
+        for seed in range(args.seed, args.seed + args.functions):
+            _, _, match = run(workloads.random_cfg(10 + seed % 90, seed), f'random_cfg seed {seed}', args, rng)
+            if not match:
+                sys.exit(1)
+        print(f"# {args.functions} random functions match", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time (and check) incremental liveness against solving it again")
+    parser.add_argument("--workloads", nargs="+", choices=sorted(workloads.WORKLOADS), default=list(workloads.WORKLOADS))
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000])
+    parser.add_argument("--edits", type=int, default=50, help="Random edits per function")
+    parser.add_argument("--check", action="store_true", help="Compare with a full solve after every edit")
+    parser.add_argument("--functions", type=int, default=3000, help="Random functions to edit with --check")
+    parser.add_argument("--seed", type=int, default=0)
+
+    main(parser.parse_args())
@@ -0,0 +1,44 @@
+import sys
+import json
+import time
+import shutil
+import argparse
+import subprocess
+import briltxt
+
+# per-file latency of getting a program into memory: shelling out to
+# bril2json (what dce.py/lvn.py used to do) against the in-process parser
+
+def time_per_file(fn, files, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for filename in files:
+            fn(filename)
+    return (time.perf_counter() - start) / (repeat * len(files))
+
+def via_bril2json(filename):
+    return json.loads(subprocess.check_output(f"bril2json < {filename}", shell=True))
+
+def main(args):
+    files = args.files
+    print(f"{len(files)} files, {args.repeat} runs each")
+
+    if shutil.which("bril2json"):
+        t_old = time_per_file(via_bril2json, files, args.repeat)
+        print(f"bril2json subprocess: {t_old * 1000:8.3f} ms/file")
+        # make sure we agree with the reference parser
+        for filename in files:
+            if via_bril2json(filename) != briltxt.load(filename):
+                print(f"  mismatch on {filename}", file=sys.stderr)
+    else:
+        print("bril2json subprocess:      n/a (bril2json not on PATH)")
+
+    t_new = time_per_file(briltxt.load, files, args.repeat)
+    print(f"briltxt in-process:   {t_new * 1000:8.3f} ms/file")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare bril2json against the in-process Bril parser")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--repeat", type=int, default=20)
+    main(parser.parse_args())
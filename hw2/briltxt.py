@@ -0,0 +1,262 @@
+"""A small, dependency-free reader and printer for the Bril text format.
+
+`parse_bril` turns Bril text into the same JSON-shaped dicts that
+`bril2json` produces, and `program_to_string` goes the other way, so the
+passes can be run without shelling out to the bril tools.
+"""
+import json
+import re
+import sys
+
+# A token is a string/char literal, a punctuation mark, or a bare word.
+TOKEN = re.compile(r"""
+    \s*(?:
+        (?P<char>'(?:\\.|[^'\\])*')
+      | (?P<punct>[(){}:;=,<>])
+      | (?P<word>[^\s(){}:;=,<>']+)
+    )""", re.VERBOSE)
+
+
+class BrilSyntaxError(Exception):
+    pass
+
+
+def _strip_comment(line):
+    # a '#' starts a comment unless it is inside a character literal
+    if '#' not in line:
+        return line
+    quoted = False
+    for i, c in enumerate(line):
+        if c == "'":
+            quoted = not quoted
+        elif c == '#' and not quoted:
+            return line[:i]
+    return line
+
+
+def tokenize(text):
+    toks = []
+    for lineno, line in enumerate(text.splitlines(), 1):
+        line = _strip_comment(line)
+        pos = 0
+        end = len(line.rstrip())
+        while pos < end:
+            m = TOKEN.match(line, pos)
+            if not m or m.end() == pos:
+                raise BrilSyntaxError(f"line {lineno}: unexpected {line[pos:]!r}")
+            pos = m.end()
+            toks.append((m.group(m.lastgroup), lineno))
+    return toks
+
+
+class _Parser:
+    def __init__(self, toks):
+        self.toks = toks
+        self.pos = 0
+
+    def peek(self, offset=0):
+        i = self.pos + offset
+        return self.toks[i][0] if i < len(self.toks) else None
+
+    def next(self):
+        if self.pos >= len(self.toks):
+            raise BrilSyntaxError("unexpected end of input")
+        tok = self.toks[self.pos][0]
+        self.pos += 1
+        return tok
+
+    def expect(self, tok):
+        got = self.next()
+        if got != tok:
+            line = self.toks[self.pos - 1][1]
+            raise BrilSyntaxError(f"line {line}: expected {tok!r}, got {got!r}")
+
+    def program(self):
+        functions = []
+        while self.peek() is not None:
+            functions.append(self.function())
+        return {'functions': functions}
+
+    def type(self):
+        name = self.next()
+        if self.peek() == '<':
+            self.next()
+            inner = self.type()
+            self.expect('>')
+            return {name: inner}
+        return name
+
+    def function(self):
+        name = self.next()
+        if not name.startswith('@'):
+            raise BrilSyntaxError(f"expected a function name, got {name!r}")
+        func = {'name': name[1:]}
+        if self.peek() == '(':
+            self.next()
+            args = []
+            while self.peek() != ')':
+                arg = self.next()
+                self.expect(':')
+                args.append({'name': arg, 'type': self.type()})
+                if self.peek() == ',':
+                    self.next()
+            self.next()
+            if args:
+                func['args'] = args
+        if self.peek() == ':':
+            self.next()
+            func['type'] = self.type()
+        self.expect('{')
+        instrs = []
+        while self.peek() != '}':
+            instrs.append(self.instr())
+        self.next()
+        func['instrs'] = instrs
+        return func
+
+    def instr(self):
+        first = self.next()
+        # label
+        if first.startswith('.') and self.peek() == ':':
+            self.next()
+            return {'label': first[1:]}
+
+        instr = {}
+        if self.peek() in (':', '='):
+            instr['dest'] = first
+            if self.peek() == ':':
+                self.next()
+                instr['type'] = self.type()
+            self.expect('=')
+            op = self.next()
+        else:
+            op = first
+        instr['op'] = op
+
+        operands = []
+        while self.peek() != ';':
+            operands.append(self.next())
+        self.next()
+
+        if op == 'const':
+            if len(operands) != 1:
+                raise BrilSyntaxError(f"const takes one value, got {operands}")
+            instr['value'] = _literal(operands[0], instr.get('type'))
+            return _ordered(instr)
+
+        args, funcs, labels = [], [], []
+        for operand in operands:
+            if operand.startswith('@'):
+                funcs.append(operand[1:])
+            elif operand.startswith('.'):
+                labels.append(operand[1:])
+            else:
+                args.append(operand)
+        if args:
+            instr['args'] = args
+        if funcs:
+            instr['funcs'] = funcs
+        if labels:
+            instr['labels'] = labels
+        return _ordered(instr)
+
+
+# bril2json emits keys in this order
+_KEY_ORDER = ('args', 'dest', 'funcs', 'labels', 'op', 'type', 'value')
+
+
+def _ordered(instr):
+    return {k: instr[k] for k in _KEY_ORDER if k in instr}
+
+
+def _literal(tok, typ):
+    if tok in ('true', 'false'):
+        return tok == 'true'
+    if typ == 'char' or tok.startswith("'"):
+        return tok.strip("'").encode().decode('unicode_escape')
+    if typ == 'float':
+        return float(tok)
+    try:
+        return int(tok)
+    except ValueError:
+        return float(tok)
+
+
+def parse_bril(text):
+    """Parse Bril text into a JSON-style program dict."""
+    return _Parser(tokenize(text)).program()
+
+
+def load(filename):
+    """Read a program from `filename`, which may be Bril text or JSON.
+    JSON input (a `.json` file, or text starting with '{') is read as is.
+    """
+    with open(filename) as f:
+        text = f.read()
+    if filename.endswith('.json') or text.lstrip().startswith('{'):
+        return json.loads(text)
+    return parse_bril(text)
+
+
+### PRINTING
+def type_to_string(typ):
+    if isinstance(typ, dict):
+        (name, inner), = typ.items()
+        return f'{name}<{type_to_string(inner)}>'
+    return typ
+
+
+def value_to_string(value, typ=None):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if typ == 'char':
+        return repr(value)
+    return str(value)
+
+
+def instr_to_string(instr):
+    if instr['op'] == 'const':
+        rhs = f"const {value_to_string(instr['value'], instr.get('type'))}"
+    else:
+        rhs = instr['op']
+        for f in instr.get('funcs', []):
+            rhs += f' @{f}'
+        for a in instr.get('args', []):
+            rhs += f' {a}'
+        for l in instr.get('labels', []):
+            rhs += f' .{l}'
+    if 'dest' in instr:
+        if 'type' in instr:
+            return f"{instr['dest']}: {type_to_string(instr['type'])} = {rhs}"
+        return f"{instr['dest']} = {rhs}"
+    return rhs
+
+
+def function_to_string(func):
+    header = '@' + func['name']
+    if func.get('args'):
+        header += '(' + ', '.join(f"{a['name']}: {type_to_string(a['type'])}"
+                                  for a in func['args']) + ')'
+    if 'type' in func:
+        header += ': ' + type_to_string(func['type'])
+    lines = [header + ' {']
+    for instr in func['instrs']:
+        if 'label' in instr:
+            lines.append(f".{instr['label']}:")
+        else:
+            lines.append(f'  {instr_to_string(instr)};')
+    lines.append('}')
+    return '\n'.join(lines)
+
+
+def program_to_string(bril):
+    return '\n'.join(function_to_string(f) for f in bril['functions']) + '\n'
+
+
+if __name__ == "__main__":
+    # bril2json / bril2txt replacement: `python3 briltxt.py [--txt]`
+    if '--txt' in sys.argv[1:]:
+        sys.stdout.write(program_to_string(json.load(sys.stdin)))
+    else:
+        json.dump(parse_bril(sys.stdin.read()), sys.stdout, indent=2)
+        print()
@@ -1,22 +1,30 @@
+import os
+import sys
 
-from collections import OrderedDict
+# code shared between the homeworks lives in ../common
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from flowgraph import CFG
+# anonymous blocks are named the same way in every homework
+from blocks import block_map
+from passmgr import AnalysisManager
+import ir
 
 #Instructions that terminate a basic block.
-TERMINATORS = 'br', 'jmp', 'ret'
+TERMINATORS = ir.TERMINATORS
 
 def form_blocks(instrs):
     # Start with an empty block.
     cur_block = []
 
     for instr in instrs:
-        if 'op' in instr:  # It's an instruction.
+        if instr.op is not None:  # It's an instruction.
             # Add the instruction to the currently-being-formed block.
             cur_block.append(instr)
 
             # If this is a terminator (branching instruction), it's the
             # last instruction in the block. Finish this block and
             # start a new one.
-            if instr['op'] in TERMINATORS:
+            if instr.op in TERMINATORS:
                 yield cur_block
                 cur_block = []
         
@@ -36,12 +44,12 @@ def print_blocks(bril):
     """Given a Bril program, print out its basic blocks.
     """
 
-    func = bril['functions'][0]  # We only process one function.
-    for block in form_blocks(func['instrs']):
+    func = ir.functions(bril)[0]  # We only process one function.
+    for block in form_blocks(func.instrs):
         # Mark the block.
         leader = block[0]
-        if 'label' in leader:
-            print( f"block {leader['label']}")
+        if leader.op is None:
+            print( f"block {leader.label}")
             block = block[1:]  # Hide the label
         else:
             print('anonymous block:')
@@ -51,66 +59,45 @@ def print_blocks(bril):
             print(instr)
 
 
-
-def block_map(blocks):
-    """Given a sequence of basic blocks, which are lists of instructions,
-    produce a `OrderedDict` mapping names to blocks.
-
-    The name of the block comes from the label it starts with, if any.
-    Anonymous blocks, which don't start with a label, get an
-    automatically generated name. Blocks in the mapping have their
-    labels removed.
-    """
-    by_name = OrderedDict()
-
-    for block in blocks:
-        # Generate a name for the block.
-        if 'label' in block[0]:
-            # The block has a label. Remove the label but use it for the
-            # block's name.
-            name = block[0]['label']
-            block = block[1:]
-        else:
-            # Make up a new name for this anonymous block.
-            name = f'gen_bk_{len(by_name)}'
-
-        # Add the block to the mapping.
-        by_name[name] = block
-
-    return by_name
-
 def build_cfg(ordered_blocks):
-    cfg = {}
+    # a CFG is also a block name -> successor names mapping
+    return CFG.from_block_map(ordered_blocks)
 
-    labels = list(ordered_blocks.keys())
 
-    for i, (block_name, block) in enumerate(ordered_blocks.items()):
-        last = block[-1]
-        op = last['op']
 
-        if op == 'jmp':
-            cfg[block_name] = last['labels']
-        elif op == 'br':
-            cfg[block_name] = last['labels']
-        else:
-            if i+1 < len(labels):  # last block does not fall through
-                cfg[block_name] = [labels[i+1]]
-            else:
-                cfg[block_name] = []
-    return cfg
+def get_blocks(func):
+    blks = form_blocks(func.instrs)
+    od = block_map(blks)
+    return od
 
+def get_cfg(func, am=None):
+    # through an analysis manager, so blocks it already formed are reused
+    if am is None:
+        am = AnalysisManager(func, ANALYSES)
+    return am.get('cfg')
 
+def function_blocks(func):
+    """The basic blocks of `func`, with each block's label (if any) kept
+    as its first entry, so `join_blocks` can put the function back
+    together.
+    """
+    return list(form_blocks(func.instrs))
 
-def get_blocks(bril):
-    blks = form_blocks(bril['functions'][0]['instrs'])
-    od = block_map(blks)
-    # for (name, instrs) in od.items():
-        # print (name, instrs)
-    return od
+def block_cfg(blocks):
+    """Integer-indexed CFG of blocks from `function_blocks`. Blocks
+    without a terminator fall through.
+    """
+    return CFG.from_block_list(blocks)
 
-def get_cfg(bril):
-    blks = form_blocks(bril['functions'][0]['instrs'])
-    od = block_map(blks)
-    cfg = build_cfg(od)
-    # print(cfg)
-    return cfg
+def join_blocks(blocks):
+    instrs = []
+    for block in blocks:
+        instrs.extend(block)
+    return instrs
+
+# analyses an AnalysisManager can compute for hw2 passes; dce.py adds
+# liveness. Transforms edit 'blocks' in place and rejoin the function.
+ANALYSES = {
+    'blocks': lambda func, am: function_blocks(func),
+    'cfg': lambda func, am: block_cfg(am.get('blocks')),
+}
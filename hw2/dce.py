@@ -1,54 +1,295 @@
 import json
 import sys
-import subprocess
-from cfg import get_blocks, get_cfg
+import argparse
+import briltxt
+import cfg
+from cfg import join_blocks
+from passmgr import AnalysisManager
+import ir
+from parallel import map_functions, stream_functions
+import stats
+
+# instructions with a destination that must stay even if it is never read
+EFFECT_OPS = {'call', 'alloc'}
+
+class Liveness:
+    """Live-in and live-out bitmasks of every block. Variables are
+    interned to bit positions in `index`.
+
+    A pass that edits some blocks in place (same blocks, same CFG, or
+    the same blocks with new edges) hands the liveness it started from
+    to `update()` with the ids of the blocks it changed, instead of
+    throwing it away. Facts that may have depended on a removed read, a
+    new write or a removed edge are deleted first, by walking back from
+    the changed blocks for just those variables; then the deleted facts
+    and the changed blocks are solved again. Starting below the answer
+    everywhere, the solver reaches exactly what a full solve finds, and
+    it only visits the blocks the edit could affect. `bench_liveness.py
+    --check` compares the two after random edits.
+    """
+    def __init__(self, blocks, cfg):
+        self.blocks = blocks
+        self.cfg = cfg
+        self.index = {}
+        # use (read before written) and def masks of every block
+        self.use = []
+        self.defs = []
+        for block in blocks:
+            u, d = self.summarize(block)
+            self.use.append(u)
+            self.defs.append(d)
+        n = len(blocks)
+        self.live_in = [0] * n
+        self.live_out = [0] * n
+        # the worklist is a stack: pop blocks in postorder first, then
+        # whatever is unreachable
+        reached = set(cfg.postorder)
+        worklist = [i for i in range(n) if i not in reached]
+        worklist.extend(reversed(cfg.postorder))
+        self.solve(worklist)
+
+    def bit(self, var):
+        index = self.index
+        if var not in index:
+            index[var] = len(index)
+        return 1 << index[var]
+
+    def summarize(self, block):
+        u = d = 0
+        for instr in block:
+            for var in instr.args:
+                b = self.bit(var)
+                if not d & b:
+                    u |= b
+            if instr.dest is not None:
+                d |= self.bit(instr.dest)
+        return u, d
+
+    def solve(self, worklist, before=None):
+        # `before`, if given, gets the old live-out set of every block
+        # whose set changes
+        succs, preds = self.cfg.succs, self.cfg.preds
+        use, defs = self.use, self.defs
+        live_in, live_out = self.live_in, self.live_out
+        queued = set(worklist)
+        pushes, pops = len(worklist), 0
+        while worklist:
+            i = worklist.pop()
+            queued.discard(i)
+            pops += 1
+            out = 0
+            for s in succs[i]:
+                out |= live_in[s]
+            if before is not None and out != live_out[i]:
+                before.setdefault(i, live_out[i])
+            live_out[i] = out
+            new_in = use[i] | (out & ~defs[i])
+            if new_in != live_in[i]:
+                live_in[i] = new_in
+                for p in preds[i]:
+                    if p not in queued:
+                        queued.add(p)
+                        worklist.append(p)
+                        pushes += 1
+
+        if stats.enabled:
+            # one transfer function evaluation per pop
+            stats.count('liveness.solves')
+            stats.count('liveness.pops', pops)
+            stats.count('liveness.pushes', pushes)
+            stats.count('liveness.transfers', pops)
+
+    def update(self, changed, cfg=None):
+        """Bring the facts up to date after the blocks in `changed` were
+        edited (and, given `cfg`, after their successors changed).
+        Returns the blocks whose live-out set is different now.
+        """
+        old_succs = self.cfg.succs
+        if cfg is not None:
+            self.cfg = cfg
+        succs, preds = self.cfg.succs, self.cfg.preds
+        use, defs = self.use, self.defs
+        live_in, live_out = self.live_in, self.live_out
+        before = {}
+
+        # delete every fact that might have been supported by what went
+        # away: the bits are cleared in the changed block, then in every
+        # block they reach backwards through blocks that neither write
+        # nor read them
+        pending = {}    # block -> bits to clear from its live-in set
+        for c in changed:
+            u, d = self.summarize(self.blocks[c])
+            lost = (use[c] & ~u) | (d & ~defs[c])
+            use[c], defs[c] = u, d
+            if cfg is not None:
+                gone = set(old_succs[c]) - set(succs[c])
+                lost_out = 0
+                for s in gone:
+                    lost_out |= live_in[s]
+                before.setdefault(c, live_out[c])
+                live_out[c] &= ~lost_out
+                lost |= lost_out
+            pending[c] = lost
+        stack = list(pending)
+        touched = set(changed)
+        clears = 0
+        while stack:
+            b = stack.pop()
+            mask = pending.pop(b) & live_in[b]
+            if not mask:
+                continue
+            live_in[b] &= ~mask
+            for p in preds[b]:
+                m = mask & live_out[p]
+                if m:
+                    clears += 1
+                    before.setdefault(p, live_out[p])
+                    live_out[p] &= ~m
+                    touched.add(p)
+                    # a block that reads the variable keeps it live in
+                    m &= ~defs[p] & ~use[p]
+                    if m:
+                        if p in pending:
+                            pending[p] |= m
+                        else:
+                            pending[p] = m
+                            stack.append(p)
+
+        # same order as a full solve: postorder first, unreachable last
+        rank = self.cfg.rpo_number
+        self.solve(sorted(touched, key=rank.__getitem__), before)
+
+        if stats.enabled:
+            stats.count('liveness.updates')
+            stats.count('liveness.cleared', clears)
+        return {b for b, old in before.items() if live_out[b] != old}
+
+
+def liveness(blocks, cfg):
+    return Liveness(blocks, cfg)
+
+# hw2 analyses plus liveness
+ANALYSES = dict(cfg.ANALYSES,
+                liveness=lambda func, am: liveness(am.get('blocks'), am.get('cfg')))
 
 class DCE_Class:
-    def __init__(self, input):
+    # only instructions with a destination are ever removed, never
+    # labels or terminators, so the blocks (edited in place) and the CFG
+    # stay valid
+    preserves = ('blocks', 'cfg')
+
+    def __init__(self, input, workers=None):
         self.input = self.parse_json(input)
-        self.used = set()
+        self.workers = workers
+        self.removed = []
 
     def parse_json(self, input):
-        return json.loads(input)
+        # already-parsed programs are used as is
+        if isinstance(input, (str, bytes)):
+            return json.loads(input)
+        return input
 
-    # perform deadcode elimination on a single block
-    def block_dce(self, block):
-        for instr in block:
-            if "args" not in instr.keys():
-                continue
-            self.used.update(instr["args"])
-        
+    # perform deadcode elimination on a single block, given the
+    # variables live at its end
+    @staticmethod
+    def block_dce(block, live, index, removed):
+        # returns whether anything was removed
+        before = len(removed)
         for i in range(len(block)-1, -1, -1):
-            if "dest" in block[i].keys() and block[i]["dest"] not in self.used:
-                rm_instr = block.pop(i)
-                print(rm_instr)
-                # print(f"Instruction removed:\n {rm_instr}. Destination {rm_instr["dest"]} was not used")   
-        return block
-    
-    def run_dce(self):
-        blocks = get_blocks(self.input)
+            instr = block[i]
+            if instr.dest is not None:
+                b = 1 << index[instr.dest]
+                # nobody reads the value and computing it has no side effect
+                if not live & b and instr.op not in EFFECT_OPS:
+                    removed.append(block.pop(i))
+                    continue
+                live &= ~b
+            for var in instr.args:
+                live |= 1 << index[var]
+        return len(removed) != before
 
-        # this assumes the program only has a single block
-        self.input["functions"][0]["instrs"] = self.block_dce(list(blocks.values())[0])
+    @staticmethod
+    def function_dce(func, am=None):
+        if am is None:
+            am = AnalysisManager(func, ANALYSES)
+        with stats.timed('dce'):
+            blocks = am.get('blocks')
+            removed = []
 
-        # for block in blocks.values():
-        #     block = self.block_dce(block)
-        #     print(1)
-        #     break
+            # removing an instruction can make the definitions it read
+            # dead in other blocks, so repeat until nothing changes. After
+            # the first round, liveness is updated for the blocks that
+            # lost instructions, and only blocks whose live-out set
+            # changed (or that just changed themselves) are looked at again
+            live = am.get('liveness')
+            todo = range(len(blocks))
+            rounds = 0
+            while todo:
+                rounds += 1
+                changed = [b for b in todo
+                           if DCE_Class.block_dce(blocks[b], live.live_out[b], live.index, removed)]
+                if not changed:
+                    break
+                todo = sorted(live.update(changed) | set(changed))
+            if removed:
+                func.instrs = join_blocks(blocks)
+                am.invalidate(DCE_Class.preserves + ('liveness',))
+
+        if stats.enabled:
+            stats.count('dce.rounds', rounds)
+            stats.count('dce.removed', len(removed))
+        return func, removed
+
+    def run_dce(self):
+        # every function, on a process pool when the program is large
+        results = map_functions(dce_function, ir.functions(self.input), self.workers)
+        self.input["functions"] = [func.to_json() for func, _ in results]
+        for _, removed in results:
+            self.removed.extend(removed)
+            for rm_instr in removed:
+                print(rm_instr.to_json())
         return self.input
-    
+
+# module-level so the process pool can pickle it
+def dce_function(func):
+    return DCE_Class.function_dce(func)
+
 
 if __name__ == "__main__":
-    filename = sys.argv[1]
-    bril_in = subprocess.check_output(f"bril2json < {filename}", shell=True)  
+    parser = argparse.ArgumentParser(description="Dead code elimination on BRIL programs")
+    parser.add_argument("filename")
+    parser.add_argument("-j", "--jobs", type=int, help="Worker processes for large programs (default: one per core)")
+    parser.add_argument("--stream", action="store_true", help="Process one function at a time and write compact JSON (bounded memory, one process)")
+    parser.add_argument("--stats", action="store_true", help="Print pass times, peak memory and counters as JSON on stderr (runs in one process)")
+    args = parser.parse_args()
+    if args.stats:
+        stats.enable()
+
+    filename = args.filename
+
+    if args.stream:
+        count = 0
+        def dce_streamed(func):
+            global count
+            func, removed = DCE_Class.function_dce(func)
+            for rm_instr in removed:
+                print(rm_instr.to_json())
+            count += len(removed)
+            return func
+
+        stream_functions(dce_streamed, filename, f"{filename}_dce")
+        print(f"removed {count} instructions", file=sys.stderr)
+        sys.exit()
+
+    with stats.timed('load'):
+        bril_in = briltxt.load(filename)
 
     # filename = filename.replace("_t.bril", "_j.bril")
-    
-    dce = DCE_Class(bril_in)
+
+    dce = DCE_Class(bril_in, args.jobs)
     after_dce = dce.run_dce()
-     
+    print(f"removed {len(dce.removed)} instructions", file=sys.stderr)
+
     # output new program after running dce
-    with open(f"{filename}_dce", 'w') as json_file:
+    with stats.timed('write'), open(f"{filename}_dce", 'w') as json_file:
         json.dump(after_dce, json_file, indent=4)
-
-        
\ No newline at end of file
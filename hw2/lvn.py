@@ -1,87 +1,244 @@
 import json
 import sys
-import subprocess
-from cfg import get_blocks, get_cfg
+import argparse
+import briltxt
+import cfg
+from cfg import join_blocks
+from passmgr import AnalysisManager
+import ir
+from parallel import map_functions, stream_functions
+from ir import PURE_OPS, FOLD
+import stats
+
+COMMUTATIVE = {'add', 'mul', 'eq', 'and', 'or', 'fadd', 'fmul', 'feq', 'ceq'}
+
+NOT_CONST = object()
 
 class LVN_Class:
-    def __init__(self, input):
-        self.input = self.parse_json(input)
-        self.hash_table = {}
-        self.vn2var = {}
-        self.vn = 1
+    # rewrites stay inside their block and never touch labels or jump
+    # targets, so the blocks (edited in place) and the CFG stay valid
+    preserves = ('blocks', 'cfg')
 
-        self.print_hash_table()
-        self.print_vn2var()
+    def __init__(self, input=None, workers=None):
+        self.input = self.parse_json(input) if input is not None else None
+        self.workers = workers
+        self.rewritten = 0
+        self.reset()
+
+    def reset(self):
+        # value numbering tables are local to a block; value numbers are
+        # list indices, so starting over is just new empty containers
+        self.hash_table = {}   # value tuple -> vn
+        self.vn2var = {}       # variable -> vn it currently holds
+        self.canonical = []    # vn -> variable holding it (None if lost)
+        self.constant = []     # vn -> constant value or NOT_CONST
+        self.holders = []      # vn -> every variable that was given it
+        self.holds = {}        # variable -> vn it physically holds
 
     def parse_json(self, input):
-        return json.loads(input)
-
-    def vn_gen(self, var):
-        if var not in self.vn2var.keys():
-            self.vn2var[var] = self.vn
-            self.vn += 1
-        return self.vn2var[var] 
-    
-    def lvn(self, block):
+        # already-parsed programs are used as is
+        if isinstance(input, (str, bytes)):
+            return json.loads(input)
+        return input
+
+    def new_vn(self, var, const=NOT_CONST):
+        self.canonical.append(var)
+        self.constant.append(const)
+        self.holders.append([var])
+        return len(self.canonical) - 1
+
+    def read(self, var):
+        # variables coming from outside the block hold themselves
+        if var not in self.vn2var:
+            self.vn2var[var] = self.holds[var] = self.new_vn(var)
+        return self.vn2var[var]
+
+    def write(self, var, vn, home):
+        # `var` is the variable the program assigns, `home` the one the
+        # rewritten instruction actually writes
+        old = self.holds.get(home)
+        self.holds[home] = vn
+        if old is not None and old != vn and self.canonical[old] == home:
+            # home loses its old value; hand that value number to another
+            # variable that still holds it, if there is one
+            self.canonical[old] = next((h for h in self.holders[old]
+                                        if self.holds.get(h) == old), None)
+        self.vn2var[var] = vn
+        if home not in self.holders[vn]:
+            self.holders[vn].append(home)
+
+    def value(self, instr, vns):
+        op = instr.op
+        if op == 'const':
+            return ('const', instr.type, instr.value)
+        if op not in PURE_OPS:
+            return None
+        if op in COMMUTATIVE:
+            vns = sorted(vns)
+        return (op, *vns)
+
+    def fold(self, instr, vns):
+        fn = FOLD.get(instr.op)
+        if fn is None:
+            return NOT_CONST
+        consts = [self.constant[vn] for vn in vns]
+        if any(c is NOT_CONST for c in consts):
+            return NOT_CONST
+        try:
+            return fn(*consts)
+        except ZeroDivisionError:
+            return NOT_CONST
+
+    def lvn(self, block, fresh):
+        # where each variable is last written in the block; earlier writes
+        # get a fresh name so the value they hold survives
+        last_def = {}
         for i, instr in enumerate(block):
-            if "dest" in instr.keys():
-                if "args" in instr.keys():
-                    values = [self.vn_gen(arg) for arg in instr["args"]]
-                    hash_entry = (instr["op"], *values)
-                    canonical_var = instr["dest"]
-
-                else:   
-                    val = instr["value"]
-                    values = [self.vn_gen(instr["dest"])]
-                    hash_entry = (instr["op"], val)
-                    canonical_var = instr["dest"]
-                
-                if hash_entry in self.hash_table.keys():
-                    vn = self.hash_table[hash_entry]["vn"]
-                    canonical_var = self.hash_table[hash_entry]["canncl_var"]
-                    self.vn2var[instr["dest"]] = vn
-                    block[i] = {
-                                "dest": instr["dest"],
-                                "op": "const",
-                                "type": "int",
-                                "value": canonical_var
-                            }
-                
-                else:
-                    new_vn = self.vn_gen(instr["dest"])
-                    self.hash_table[hash_entry] = {"vn": new_vn, "canncl_var": canonical_var}
-            else:
+            if instr.dest is not None:
+                last_def[instr.dest] = i
+
+        for i, original in enumerate(block):
+            if original.op is None:
                 continue
+            instr = original
+
+            vns = [self.read(arg) for arg in instr.args]
+            # copy propagation: read every value from its canonical home
+            # (phi arguments are read at the end of other blocks)
+            if vns and instr.op != 'phi':
+                args = tuple([self.canonical[vn] for vn in vns])
+                if args != instr.args:
+                    instr = block[i] = instr.copy(args=args)
+
+            if instr.dest is None:
+                if instr is not original:
+                    self.rewritten += 1
+                continue
+            dest = instr.dest
+            home = dest if last_def[dest] == i else fresh(dest)
+
+            if instr.op == 'id':
+                # a copy just takes the value number of its source
+                vn = vns[0]
+                const = self.constant[vn]
+            else:
+                const = self.fold(instr, vns) if instr.op in FOLD else NOT_CONST
+                if const is not NOT_CONST:
+                    instr = block[i] = ir.Instr('const', dest, instr.type, value=const)
+                elif instr.op == 'const':
+                    const = instr.value
+                key = self.value(instr, vns)
+                vn = self.hash_table.get(key) if key is not None else None
+                if vn is not None and self.canonical[vn] is None:
+                    vn = None
+
+                if vn is None:
+                    vn = self.new_vn(home, const)
+                    if key is not None:
+                        self.hash_table[key] = vn
+                elif const is NOT_CONST:
+                    # computed before: copy it instead
+                    instr = block[i] = ir.Instr('id', dest, instr.type, args=(self.canonical[vn],))
+
+            if const is not NOT_CONST and instr.op != 'const':
+                instr = block[i] = ir.Instr('const', dest, instr.type, value=const)
+            if home != dest:
+                instr = block[i] = instr.copy(dest=home)
+            self.write(dest, vn, home)
+
+            if block[i] is not original:
+                self.rewritten += 1
+
         return block
-    
+
+    def function_lvn(self, func, am=None):
+        # fresh names must not clash with anything in the function
+        names = {name for name, _ in func.args}
+        names.update(instr.dest for instr in func.instrs if instr.dest is not None)
+        counter = [0]
+        def fresh(var):
+            while True:
+                counter[0] += 1
+                name = f'{var}.lvn{counter[0]}'
+                if name not in names:
+                    names.add(name)
+                    return ir.intern(name)
+
+        if am is None:
+            am = AnalysisManager(func, cfg.ANALYSES)
+        with stats.timed('lvn'):
+            blocks = am.get('blocks')
+            before = self.rewritten
+            changed = []
+            for b, block in enumerate(blocks):
+                self.reset()
+                count = self.rewritten
+                self.lvn(block, fresh)
+                if self.rewritten != count:
+                    changed.append(b)
+            if changed:
+                func.instrs = join_blocks(blocks)
+                # liveness, if it was computed, is updated for just the
+                # rewritten blocks
+                live = am.cached('liveness')
+                if live is not None:
+                    live.update(changed)
+                    am.invalidate(LVN_Class.preserves + ('liveness',))
+                else:
+                    am.invalidate(LVN_Class.preserves)
+
+        if stats.enabled:
+            stats.count('lvn.blocks', len(blocks))
+            stats.count('lvn.rewritten', self.rewritten - before)
+        return func, self.rewritten
+
     def run_lvn(self):
-        blocks = get_blocks(self.input)
-        self.input["functions"][0]["instrs"] = self.lvn(list(blocks.values())[0])
-        # for block in blocks.values():
-        #     block = self.lvn(block)
+        # every function, on a process pool when the program is large
+        results = map_functions(lvn_function, ir.functions(self.input), self.workers)
+        self.input["functions"] = [func.to_json() for func, _ in results]
+        self.rewritten = sum(n for _, n in results)
         return self.input
 
     def print_hash_table(self):
         for key, value in self.hash_table.items():
-            print(f"{key}: {value}")    
+            print(f"{key}: {value}")
 
     def print_vn2var(self):
         for key, value in self.vn2var.items():
-            print(f"{key}: {value}")    
+            print(f"{key}: {value}")
+
+# module-level so the process pool can pickle it
+def lvn_function(func):
+    return LVN_Class().function_lvn(func)
 
 if __name__ == "__main__":
-    filename = sys.argv[1]
-    text2bril = subprocess.check_output(f"bril2json < {filename}", shell=True)  
+    parser = argparse.ArgumentParser(description="Local value numbering on BRIL programs")
+    parser.add_argument("filename")
+    parser.add_argument("-j", "--jobs", type=int, help="Worker processes for large programs (default: one per core)")
+    parser.add_argument("--stream", action="store_true", help="Process one function at a time and write compact JSON (bounded memory, one process)")
+    parser.add_argument("--stats", action="store_true", help="Print pass times, peak memory and counters as JSON on stderr (runs in one process)")
+    args = parser.parse_args()
+    if args.stats:
+        stats.enable()
+
+    filename = args.filename
+
+    if args.stream:
+        lvn = LVN_Class()
+        stream_functions(lambda func: lvn.function_lvn(func)[0], filename,
+                         f"{filename.replace('_t.bril', '_j.bril')}_lvn")
+        print(f"rewrote {lvn.rewritten} instructions", file=sys.stderr)
+        sys.exit()
+
+    with stats.timed('load'):
+        text2bril = briltxt.load(filename)
 
     filename = filename.replace("_t.bril", "_j.bril")
-     
-    lvn = LVN_Class(text2bril)
-    after_dce = lvn.run_lvn()
-    # after_dce = lvn.run_lvn()
 
-    print(lvn.hash_table)    
+    lvn = LVN_Class(text2bril, args.jobs)
+    after_dce = lvn.run_lvn()
+    print(f"rewrote {lvn.rewritten} instructions", file=sys.stderr)
 
     # output new program after running dce
-    with open(f"{filename}_lvn", 'w') as json_file:
+    with stats.timed('write'), open(f"{filename}_lvn", 'w') as json_file:
         json.dump(after_dce, json_file, indent=4)
-    
\ No newline at end of file
@@ -0,0 +1,56 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+import briltxt
+# cfg puts ../common on the path
+import cfg
+import ir
+import stream
+import stats
+
+# below this many instructions it is cheaper to stay in one process
+PARALLEL_THRESHOLD = 5000
+
+def map_functions(fn, funcs, workers=None, threshold=PARALLEL_THRESHOLD):
+    """Return `[fn(func) for func in funcs]`.
+
+    Functions are independent, so for large programs they are spread
+    over a process pool. `fn` must be a module-level function so it can
+    be pickled. Results come back in the original function order, so
+    the output does not depend on scheduling.
+    """
+    size = sum(len(func.instrs) for func in funcs)
+    workers = workers or os.cpu_count() or 1
+
+    # --stats counters are only collected in this process
+    if workers == 1 or stats.enabled or len(funcs) < 2 or size < threshold:
+        return [fn(func) for func in funcs]
+
+    # a few chunks per worker keeps the pool busy without pickling
+    # every function separately
+    chunksize = max(1, len(funcs) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(fn, funcs, chunksize=chunksize))
+
+def read_functions(filename):
+    """Yield the functions (as JSON dicts) of the program in `filename`.
+    JSON is decoded one function at a time; Bril text is parsed whole.
+    """
+    with open(filename) as f:
+        head = f.read(256).lstrip()
+        f.seek(0)
+        if filename.endswith('.json') or head.startswith('{'):
+            yield from stream.iter_functions(f)
+            return
+        text = f.read()
+    yield from briltxt.parse_bril(text)['functions']
+
+def stream_functions(fn, filename, outname):
+    """Like `map_functions`, but reads the program from `filename` and
+    writes the result to `outname` (as compact JSON) one function at a
+    time, so only one function is in memory at once. `fn` takes and
+    returns an `ir.Function`. Runs in this process.
+    """
+    with open(outname, 'w') as out, stream.ProgramWriter(out) as writer:
+        for func in read_functions(filename):
+            writer.write(fn(ir.Function.from_json(func)).to_json())
+        return writer.count
@@ -0,0 +1,108 @@
+import sys
+import json
+import argparse
+import functools
+import briltxt
+from dce import DCE_Class, ANALYSES
+from lvn import LVN_Class
+from parallel import map_functions, stream_functions
+# dce put ../common on the path (through cfg)
+from passmgr import AnalysisManager
+import ir
+import interp
+import stats
+
+# run several passes over each function with one analysis manager, so
+# an analysis is only recomputed when a pass actually invalidated it
+
+def run_lvn(func, am, log):
+    _, rewritten = LVN_Class().function_lvn(func, am)
+    log.append(f"rewrote {rewritten} instructions")
+
+def run_dce(func, am, log):
+    _, removed = DCE_Class.function_dce(func, am)
+    log.append(f"removed {len(removed)} instructions")
+
+def run_live(func, am, log):
+    # report the variables live out of every block
+    liveness = am.get('liveness')
+    names = am.get('cfg').names
+    var = {i: v for v, i in liveness.index.items()}
+    for name, live in zip(names, liveness.live_out):
+        live_vars = sorted(var[i] for i in range(len(var)) if live >> i & 1)
+        log.append(f"{name}: {', '.join(live_vars) or '∅'}")
+
+PASSES = {'lvn': run_lvn, 'dce': run_dce, 'live': run_live}
+
+def run_function(passes, func):
+    am = AnalysisManager(func, ANALYSES)
+    log = []
+    for name in passes:
+        PASSES[name](func, am, log)
+    return func, log, am.computed
+
+def run_pipeline(bril, passes, workers=None):
+    # module-level function + partial, so the process pool can pickle it
+    results = map_functions(functools.partial(run_function, passes), ir.functions(bril), workers)
+    bril['functions'] = [func.to_json() for func, _, _ in results]
+    return bril, [(func.name, log, computed) for func, log, computed in results]
+
+
+def print_report(name, log, computed):
+    print(f"@{name}:")
+    for line in log:
+        print(f"  {line}")
+    counts = ', '.join(f"{a} {n}" for a, n in sorted(computed.items()))
+    print(f"@{name}: computed {counts}", file=sys.stderr)
+
+def compare_runs(before, after, args):
+    # run the program as it was and as it is now, in this process, and
+    # report what the passes saved (and whether the output changed)
+    old = before.run(args)
+    new = after.run(args)
+    for line in new.output:
+        print(f"output: {line}")
+    print(f"dynamic instructions: {old.total} -> {new.total}")
+    for op in sorted(old.ops.keys() | new.ops.keys()):
+        if old.ops[op] != new.ops[op]:
+            print(f"  {op}: {old.ops[op]} -> {new.ops[op]}")
+    return old.output == new.output
+
+def run_streamed(passes, func):
+    func, log, computed = run_function(passes, func)
+    print_report(func.name, log, computed)
+    return func
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a pipeline of passes on BRIL programs")
+    parser.add_argument("filename")
+    parser.add_argument("passes", nargs="+", choices=sorted(PASSES), help="Passes to run, in order")
+    parser.add_argument("-j", "--jobs", type=int, help="Worker processes for large programs (default: one per core)")
+    parser.add_argument("--stream", action="store_true", help="Process one function at a time and write compact JSON (bounded memory, one process)")
+    parser.add_argument("--stats", action="store_true", help="Print pass times, peak memory and counters as JSON on stderr (runs in one process)")
+    parser.add_argument("--run", nargs="*", metavar="ARG", help="Interpret the program before and after the passes (ARGs go to @main) and print how many instructions each run executed")
+    args = parser.parse_args()
+    if args.stats:
+        stats.enable()
+    if args.run is not None and args.stream:
+        parser.error("--run needs the whole program, so it can't be combined with --stream")
+
+    if args.stream:
+        stream_functions(functools.partial(run_streamed, args.passes), args.filename, f"{args.filename}_opt")
+        sys.exit()
+
+    with stats.timed('load'):
+        bril = briltxt.load(args.filename)
+    if args.run is not None:
+        # decoded now, before the passes change the program
+        before = interp.Interpreter(bril)
+    bril, report = run_pipeline(bril, args.passes, args.jobs)
+    for name, log, computed in report:
+        print_report(name, log, computed)
+    if args.run is not None and not compare_runs(before, interp.Interpreter(bril), args.run):
+        print("error: the output changed", file=sys.stderr)
+        sys.exit(1)
+
+    with stats.timed('write'), open(f"{args.filename}_opt", 'w') as json_file:
+        json.dump(bril, json_file, indent=4)
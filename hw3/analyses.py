@@ -0,0 +1,270 @@
+from collections import defaultdict
+
+from framework import Analysis, BitVectorAnalysis
+from defuse import SparseAnalysis, solve_sparse
+from ir import PURE_OPS, FOLD
+
+
+class Liveness(BitVectorAnalysis):
+    """Variables that may be read before being written again."""
+    forward = False
+
+    def summarize(self, func, blocks):
+        intern = self.items.intern
+        summaries = {}
+        for name, block in blocks.items():
+            defined = set()
+            used = []
+            for instr in block:
+                # args that were not reassigned before being used
+                for var in instr.args:
+                    if var not in defined:
+                        used.append(intern(var))
+                if instr.dest is not None:
+                    defined.add(instr.dest)
+            summaries[name] = (used, [intern(v) for v in defined])
+        return summaries
+
+
+class ReachingDefinitions(BitVectorAnalysis):
+    """Definitions (dest@block:index) that may reach each point.
+    Function arguments are definitions at the entry (dest@args)."""
+
+    def summarize(self, func, blocks):
+        intern = self.items.intern
+        defs_of = defaultdict(list)
+
+        self.arg_defs = []
+        for arg, _ in func.args:
+            d = intern((arg, None, 0))
+            defs_of[arg].append(d)
+            self.arg_defs.append(d)
+
+        # the last definition of each variable in each block
+        last_defs = {}
+        for name, block in blocks.items():
+            last = {}
+            for i, instr in enumerate(block):
+                if instr.dest is not None:
+                    d = intern((instr.dest, name, i))
+                    defs_of[instr.dest].append(d)
+                    last[instr.dest] = d
+            last_defs[name] = last
+
+        summaries = {}
+        for name, last in last_defs.items():
+            kill = [d for var in last for d in defs_of[var] if d != last[var]]
+            summaries[name] = (list(last.values()), kill)
+        return summaries
+
+    def boundary(self):
+        return self.bits.from_indices(self.arg_defs)
+
+    def show_item(self, item):
+        var, blk, i = item
+        if blk is None:
+            return f'{var}@args'
+        return f'{var}@{blk}:{i}'
+
+
+class AvailableExpressions(BitVectorAnalysis):
+    """Pure expressions that have been computed on every path and whose
+    arguments have not been redefined since."""
+    may = False
+
+    def summarize(self, func, blocks):
+        intern = self.items.intern
+
+        # intern every expression first, so we know which ones mention
+        # each variable
+        uses_var = defaultdict(list)
+        for block in blocks.values():
+            for instr in block:
+                if instr.op in PURE_OPS and instr.dest is not None:
+                    expr = (instr.op, instr.args)
+                    if expr not in self.items.index:
+                        e = intern(expr)
+                        for var in set(expr[1]):
+                            uses_var[var].append(e)
+
+        summaries = {}
+        for name, block in blocks.items():
+            available = set()
+            defined = set()
+            for instr in block:
+                if instr.op in PURE_OPS and instr.dest is not None:
+                    available.add(self.items.index[(instr.op, instr.args)])
+                if instr.dest is not None:
+                    # anything mentioning the old value is gone
+                    available.difference_update(uses_var[instr.dest])
+                    defined.add(instr.dest)
+            kill = [e for var in defined for e in uses_var[var]]
+            summaries[name] = (available, kill)
+        return summaries
+
+    def show_item(self, item):
+        op, args = item
+        return ' '.join((op,) + args)
+
+
+class NonConstant:
+    """Lattice value for a variable that is not a known constant."""
+    def __repr__(self):
+        return '?'
+
+    __str__ = __repr__
+
+
+NONCONST = NonConstant()
+
+
+class ConstantPropagation(Analysis):
+    """Maps each variable to its constant value, or ? if it may hold
+    more than one value."""
+
+    def prepare(self, func, blocks):
+        # a compact (dest, op, args, value) summary of every instruction
+        # that writes a variable
+        self.code = [[(instr.dest, instr.op, instr.args, instr.value)
+                      for instr in block if instr.dest is not None]
+                     for block in blocks.values()]
+        self.params = [arg for arg, _ in func.args]
+
+    def init(self):
+        return {}
+
+    def boundary(self):
+        return {name: NONCONST for name in self.params}
+
+    def meet(self, facts):
+        out = {}
+        for fact in facts:
+            for var, val in fact.items():
+                if var not in out:
+                    out[var] = val
+                elif out[var] is not NONCONST and (val is NONCONST or out[var] != val):
+                    out[var] = NONCONST
+        return out
+
+    def transfer(self, blk, fact):
+        env = dict(fact)
+        for dest, op, args, value in self.code[blk]:
+            if op == 'const':
+                env[dest] = value
+                continue
+            fold = FOLD.get(op)
+            if fold is None:
+                env[dest] = NONCONST
+                continue
+            # an argument with no value yet (not reached, or never
+            # defined) leaves dest without one too, so the transfer stays
+            # monotone: it can only go down once that value arrives
+            if any(a not in env for a in args):
+                env.pop(dest, None)
+                continue
+            vals = [env[a] for a in args]
+            if any(v is NONCONST for v in vals):
+                env[dest] = NONCONST
+                continue
+            try:
+                env[dest] = fold(*vals)
+            except (ZeroDivisionError, TypeError):
+                env[dest] = NONCONST
+        return env
+
+    def decode(self, fact):
+        return {var: str(val).lower() if isinstance(val, bool) else val
+                for var, val in fact.items()}
+
+
+ANALYSES = {
+    'live': Liveness,
+    'reaching': ReachingDefinitions,
+    'available': AvailableExpressions,
+    'cprop': ConstantPropagation,
+}
+
+
+### SPARSE
+# The same results from a `defuse.DefUse` index. `solve(du)` returns
+# (in_, out) by block name, like `framework.analyze_dataflow`, but only
+# for variables that are live there.
+
+class SparseLiveness:
+    """Liveness, as found while building the def-use chains."""
+
+    def solve(self, du):
+        names = du.cfg.names
+        return dict(zip(names, du.live_in)), dict(zip(names, du.live_out))
+
+    def decode(self, fact):
+        return fact
+
+
+class SparseConstantPropagation(SparseAnalysis):
+    """Constant propagation along the def-use chains: the value of a
+    variable at a block boundary is the meet of its reaching
+    definitions' values.
+    """
+
+    def argument(self, var):
+        return NONCONST
+
+    def meet(self, values):
+        # None: no value yet (or never defined), which the meet ignores
+        out = None
+        for val in values:
+            if val is None:
+                continue
+            if out is None:
+                out = val
+            elif out is not NONCONST and (val is NONCONST or out != val):
+                out = NONCONST
+        return out
+
+    def transfer(self, instr, args):
+        if instr.op == 'const':
+            return instr.value
+        fold = FOLD.get(instr.op)
+        if fold is None:
+            return NONCONST
+        # like the dense transfer: no value yet in, no value yet out
+        if any(v is None for v in args):
+            return None
+        if any(v is NONCONST for v in args):
+            return NONCONST
+        try:
+            return fold(*args)
+        except (ZeroDivisionError, TypeError):
+            return NONCONST
+
+    def solve(self, du):
+        values = solve_sparse(du, self)
+        n = len(du.cfg)
+        in_ = [{} for _ in range(n)]
+        for var in du.live:
+            memo = {}
+            for b, ds in du.reaching(var):
+                if ds not in memo:
+                    memo[ds] = self.meet([values[d] for d in ds])
+                if memo[ds] is not None:
+                    in_[b][var] = memo[ds]
+        out = []
+        for b in range(n):
+            last = du.last[b]
+            env = {}
+            for var in du.live_out[b]:
+                val = values[last[var]] if var in last else in_[b].get(var)
+                if val is not None:
+                    env[var] = val
+            out.append(env)
+        names = du.cfg.names
+        return dict(zip(names, in_)), dict(zip(names, out))
+
+    decode = ConstantPropagation.decode
+
+
+SPARSE_ANALYSES = {
+    'live': SparseLiveness,
+    'cprop': SparseConstantPropagation,
+}
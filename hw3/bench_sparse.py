@@ -0,0 +1,95 @@
+import sys
+import time
+import argparse
+
+import utils
+import ir
+import workloads
+from passmgr import AnalysisManager
+from framework import analyze_dataflow
+from analyses import ANALYSES, SPARSE_ANALYSES
+from defuse import DefUse
+
+# Times the sparse analyses against the dense solver on the workloads.
+# With --check, their results are compared on the workloads and on
+# --functions random CFGs (workloads.random_cfg): the same live sets, and
+# the dense constants of every variable the sparse solver reports, i.e.
+# every live one. Exits 1 on the first mismatch.
+
+def dense(func, blocks, cfg, name):
+    analysis = ANALYSES[name]()
+    in_, out, _ = analyze_dataflow(func, blocks, analysis, cfg=cfg)
+    return ({b: analysis.decode(f) for b, f in in_.items()},
+            {b: analysis.decode(f) for b, f in out.items()})
+
+def sparse(func, blocks, cfg, name):
+    analysis = SPARSE_ANALYSES[name]()
+    in_, out = analysis.solve(DefUse(func, blocks, cfg))
+    return ({b: analysis.decode(f) for b, f in in_.items()},
+            {b: analysis.decode(f) for b, f in out.items()})
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+def compare(func, blocks, cfg):
+    """The first difference between the sparse and dense results, or
+    None.
+    """
+    live = sparse(func, blocks, cfg, 'live')
+    if live != dense(func, blocks, cfg, 'live'):
+        return 'live'
+    want = dense(func, blocks, cfg, 'cprop')
+    got = sparse(func, blocks, cfg, 'cprop')
+    for side, facts in enumerate(want):
+        for b in blocks:
+            # the sparse solver only reports live variables, and only
+            # those that have a value
+            expect = {v: val for v, val in facts[b].items() if v in live[side][b]}
+            if got[side][b] != expect:
+                return f"cprop {'out' if side else 'in'} of {b}"
+    return None
+
+def check(bril, what):
+    for func in ir.each_function(bril):
+        am = AnalysisManager(func, utils.ANALYSES)
+        problem = compare(func, am.get('blocks'), am.get('cfg'))
+        if problem:
+            print(f"# {what} @{func.name}: {problem} differs", file=sys.stderr)
+            return False
+    return True
+
+def main(args):
+    print("workload,size,live_s,live_sparse_s,cprop_s,cprop_sparse_s")
+    for kind in args.workloads:
+        for size in args.sizes:
+            bril = workloads.generate(kind, size, args.seed)
+            if args.check and not check(bril, f'{kind} {size}'):
+                sys.exit(1)
+            times = [0.0] * 4
+            for func in ir.each_function(bril):
+                am = AnalysisManager(func, utils.ANALYSES)
+                blocks, cfg = am.get('blocks'), am.get('cfg')
+                for i, (solve, name) in enumerate([(dense, 'live'), (sparse, 'live'),
+                                                   (dense, 'cprop'), (sparse, 'cprop')]):
+                    times[i] += timed(solve, func, blocks, cfg, name)[1]
+            print(','.join([kind, str(size)] + [f'{t:.4f}' for t in times]))
+            sys.stdout.flush()
+
+    if args.check:
+        for seed in range(args.seed, args.seed + args.functions):
+            if not check(workloads.random_cfg(10 + seed % 90, seed), f'random_cfg seed {seed}'):
+                sys.exit(1)
+        print(f"# {args.functions} random functions match", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time (and check) the sparse analyses against the dense solver")
+    parser.add_argument("--workloads", nargs="+", choices=sorted(workloads.WORKLOADS), default=list(workloads.WORKLOADS))
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000])
+    parser.add_argument("--check", action="store_true", help="Compare the sparse and dense results")
+    parser.add_argument("--functions", type=int, default=2000, help="Random functions to check with --check")
+    parser.add_argument("--seed", type=int, default=0)
+
+    main(parser.parse_args())
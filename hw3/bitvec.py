@@ -0,0 +1,105 @@
+"""Dense bit-vector sets for dataflow facts.
+
+Names (variables, definitions, expressions) are interned to small
+integer indices once, and each fact is a bit vector over those indices,
+so meet and transfer are a handful of bitwise operations. Two
+representations share one interface:
+
+  * `IntBits` stores a set as a Python int (bit i <=> index i).
+  * `NumpyBits` stores it as a NumPy array of uint64 words.
+"""
+
+
+class Interner:
+    """Map names to dense indices, in first-seen order."""
+    def __init__(self):
+        self.names = []
+        self.index = {}
+
+    def intern(self, name):
+        i = self.index.get(name)
+        if i is None:
+            i = self.index[name] = len(self.names)
+            self.names.append(name)
+        return i
+
+    def __len__(self):
+        return len(self.names)
+
+
+class IntBits:
+    def __init__(self, size):
+        self.size = size
+
+    def empty(self):
+        return 0
+
+    def full(self):
+        return (1 << self.size) - 1
+
+    def from_indices(self, indices):
+        mask = 0
+        for i in indices:
+            mask |= 1 << i
+        return mask
+
+    def union(self, a, b):
+        return a | b
+
+    def intersect(self, a, b):
+        return a & b
+
+    def transfer(self, gen, kill, x):
+        return gen | (x & ~kill)
+
+    def equal(self, a, b):
+        return a == b
+
+    def indices(self, a):
+        # scan the binary string, least significant bit first
+        return [i for i, c in enumerate(bin(a)[:1:-1]) if c == '1']
+
+
+class NumpyBits:
+    def __init__(self, size):
+        # numpy is optional; only needed when this backend is picked
+        import numpy
+        self.np = numpy
+        self.size = size
+        self.words = (size + 63) // 64
+
+    def empty(self):
+        return self.np.zeros(self.words, dtype=self.np.uint64)
+
+    def full(self):
+        return self.from_indices(range(self.size))
+
+    def from_indices(self, indices):
+        words = [0] * self.words
+        for i in indices:
+            words[i >> 6] |= 1 << (i & 63)
+        return self.np.array(words, dtype=self.np.uint64)
+
+    def union(self, a, b):
+        return a | b
+
+    def intersect(self, a, b):
+        return a & b
+
+    def transfer(self, gen, kill, x):
+        return gen | (x & ~kill)
+
+    def equal(self, a, b):
+        return self.np.array_equal(a, b)
+
+    def indices(self, a):
+        out = []
+        for w, word in enumerate(a.tolist()):
+            while word:
+                low = word & -word
+                out.append((w << 6) + low.bit_length() - 1)
+                word ^= low
+        return out
+
+
+BACKENDS = {'int': IntBits, 'numpy': NumpyBits}
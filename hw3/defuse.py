@@ -0,0 +1,261 @@
+"""Def-use chains and a sparse solver over them.
+
+The dense solver in `framework.py` moves a whole set of facts along
+every CFG edge, including facts about temporaries that are defined and
+read in one block. Here the structure of the function is indexed once:
+
+- every definition (an instruction with a `dest`, or a function
+  argument) gets an id;
+- every variable gets the blocks it is live into;
+- every argument of every instruction gets its use-def chain, the
+  definitions that may reach it, and every definition its def-use
+  chain, the instructions reading it (built by `link()`, when an
+  analysis needs them).
+
+A read of a variable defined earlier in the same block is resolved
+while scanning the block. Only reads of values from other blocks need
+the CFG, and for those the work is done one variable at a time, over the
+blocks that variable is live in (walking back from its reads to its
+definitions). A temporary that never leaves its block costs nothing
+beyond the scan, however big the function is.
+
+Liveness falls out of that walk. `solve_sparse` then propagates a value
+per definition along the def-use chains, for analyses like constant
+propagation: when a definition's value changes, only the instructions
+that read it are evaluated again.
+"""
+from collections import deque
+
+from flowgraph import CFG
+import stats
+
+
+class DefUse:
+    """The def-use index of one function, over an ordered block map
+    (with terminators) as `utils.block_map` / `add_terminators` make it.
+    Blocks are ids of the function's `flowgraph.CFG`.
+    """
+    def __init__(self, func, blocks, cfg=None):
+        if cfg is None:
+            cfg = CFG.from_block_map(blocks)
+        self.cfg = cfg
+        self.code = code = list(blocks.values())
+        n = len(code)
+
+        self.defs = []      # def id -> (var, block, index); arguments have index -1
+        self.def_at = {}    # (block, index) -> def id
+        self.ud = {}        # (block, index) -> per argument, the def ids reaching it
+        self.last = []      # per block: var -> def id of its last definition there
+        self.live_in = [set() for _ in range(n)]
+        self.live_out = [set() for _ in range(n)]
+        self._reach = {}    # var -> (def ids, {block: bitmask over them})
+
+        entry_defs = {}
+        for name, _ in func.args:
+            entry_defs[name] = len(self.defs)
+            self.defs.append((name, cfg.entry, -1))
+
+        # one scan per block: reads of a value from this block are
+        # resolved right away, the others are "exposed"
+        exposed = {}        # var -> [(block, index, argument position)]
+        for b, block in enumerate(code):
+            cur = {}
+            for i, instr in enumerate(block):
+                if instr.args:
+                    chains = []
+                    for k, arg in enumerate(instr.args):
+                        d = cur.get(arg)
+                        if d is None:
+                            exposed.setdefault(arg, []).append((b, i, k))
+                            chains.append(())
+                        else:
+                            chains.append((d,))
+                    self.ud[(b, i)] = chains
+                if instr.dest is not None:
+                    d = len(self.defs)
+                    self.defs.append((instr.dest, b, i))
+                    self.def_at[(b, i)] = d
+                    cur[instr.dest] = d
+            self.last.append(cur)
+
+        # plain lists walk faster than the CFG's arrays
+        self.preds = [list(cfg.preds[b]) for b in range(n)]
+        self.succs = [list(cfg.succs[b]) for b in range(n)]
+        self.exposed = exposed
+        self.entry_defs = entry_defs
+        self.live = {var: self._live_blocks(var, uses) for var, uses in exposed.items()}
+        self.du = None
+
+        if stats.enabled:
+            stats.count('defuse.defs', len(self.defs))
+            stats.count('defuse.live_blocks', sum(map(len, self.live.values())))
+
+    def link(self):
+        """Fill in the use-def chains of reads of values from other
+        blocks, and the def-use chains. Liveness doesn't need them, so
+        they are only built when an analysis asks.
+        """
+        if self.du is not None:
+            return
+        for var, uses in self.exposed.items():
+            ids, reach = self._reaching(var, self.live[var], self.entry_defs.get(var))
+            self._reach[var] = (ids, reach)
+            decoded = {}
+            for b, i, k in uses:
+                mask = reach[b]
+                if mask not in decoded:
+                    decoded[mask] = tuple([ids[j] for j in range(len(ids)) if mask >> j & 1])
+                self.ud[(b, i)][k] = decoded[mask]
+
+        # def-use chains are the use-def chains turned around
+        self.du = [[] for _ in self.defs]
+        chains = 0
+        for (b, i), args in self.ud.items():
+            for ds in args:
+                for d in ds:
+                    uses = self.du[d]
+                    # an instruction reading d twice is listed once
+                    if not uses or uses[-1] != (b, i):
+                        uses.append((b, i))
+                        chains += 1
+        if stats.enabled:
+            stats.count('defuse.chains', chains)
+
+    def _live_blocks(self, var, uses):
+        """The blocks `var` is live into: walk back from the blocks that
+        read it before writing it, up to the blocks that write it. Marks
+        `live_in` / `live_out` on the way.
+        """
+        preds, last = self.preds, self.last
+        live_in, live_out = self.live_in, self.live_out
+        live = {b for b, _, _ in uses}
+        stack = list(live)
+        while stack:
+            b = stack.pop()
+            live_in[b].add(var)
+            for p in preds[b]:
+                live_out[p].add(var)
+                if p not in live and var not in last[p]:
+                    live.add(p)
+                    stack.append(p)
+        return live
+
+    def _reaching(self, var, live, arg_def):
+        """The definitions of `var` reaching the start of each block in
+        `live`. Outside those blocks nothing reads them, so nothing else
+        is solved. Sets are bitmasks over `ids`, the definitions of `var`
+        that are last in their block (no others leave their block).
+        """
+        entry, last = self.cfg.entry, self.last
+        preds, succs = self.preds, self.succs
+        ids = []
+        bit = {}
+
+        def mask_of(d):
+            if d not in bit:
+                bit[d] = 1 << len(ids)
+                ids.append(d)
+            return bit[d]
+
+        entry_mask = mask_of(arg_def) if arg_def is not None else 0
+        reach = dict.fromkeys(live, 0)
+        queue = deque(live)
+        queued = set(live)
+        while queue:
+            b = queue.popleft()
+            queued.discard(b)
+            mask = entry_mask if b == entry else 0
+            for p in preds[b]:
+                d = last[p].get(var)
+                # a predecessor that doesn't define var has it live too
+                mask |= mask_of(d) if d is not None else reach[p]
+            if mask != reach[b]:
+                reach[b] = mask
+                if var not in last[b]:
+                    for s in succs[b]:
+                        if s in reach and s not in queued:
+                            queued.add(s)
+                            queue.append(s)
+        return ids, reach
+
+    def reaching(self, var):
+        """`(block, def ids)` for every block `var` is live into: the
+        definitions of `var` that reach the start of the block. Blocks
+        reached by the same definitions share one tuple.
+        """
+        self.link()
+        ids, reach = self._reach[var]
+        decoded = {}
+        for b, mask in reach.items():
+            if mask not in decoded:
+                decoded[mask] = tuple([ids[j] for j in range(len(ids)) if mask >> j & 1])
+            yield b, decoded[mask]
+
+
+class SparseAnalysis:
+    """A forward analysis computing one value per definition. Values
+    start at `init()` (nothing known yet); the value of an argument
+    of an instruction is the `meet` of the values of its reaching
+    definitions.
+    """
+    def init(self):
+        return None
+
+    def argument(self, var):
+        """Value of a function argument."""
+        raise NotImplementedError
+
+    def meet(self, values):
+        raise NotImplementedError
+
+    def transfer(self, instr, args):
+        """Value of the definition `instr`, given its argument values."""
+        raise NotImplementedError
+
+    def equal(self, a, b):
+        return a == b
+
+
+def solve_sparse(du, analysis):
+    """Solve `analysis` over the def-use chains of `du`. Returns the value
+    of every definition, by def id. Like the dense solver, this also
+    evaluates blocks that can't be reached from the entry.
+    """
+    du.link()
+    cfg = du.cfg
+    values = [analysis.init()] * len(du.defs)
+    queued = bytearray(len(du.defs))
+    # definitions in reverse postorder, so most are evaluated after
+    # the definitions they read; unreachable blocks last
+    queue = deque()
+    order = list(cfg.rpo) + [b for b in range(len(cfg)) if not cfg.reachable(b)]
+    for b in order:
+        for i in range(len(du.code[b])):
+            d = du.def_at.get((b, i))
+            if d is not None:
+                queue.append(d)
+                queued[d] = 1
+    for d, (var, _, i) in enumerate(du.defs):
+        if i < 0:
+            values[d] = analysis.argument(var)
+
+    pops = 0
+    while queue:
+        d = queue.popleft()
+        queued[d] = 0
+        pops += 1
+        _, b, i = du.defs[d]
+        args = [analysis.meet([values[x] for x in ds]) for ds in du.ud.get((b, i), ())]
+        value = analysis.transfer(du.code[b][i], args)
+        if not analysis.equal(value, values[d]):
+            values[d] = value
+            for use in du.du[d]:
+                u = du.def_at.get(use)
+                if u is not None and not queued[u]:
+                    queued[u] = 1
+                    queue.append(u)
+
+    if stats.enabled:
+        stats.count('sparse.solves')
+        stats.count('sparse.transfers', pops)
+    return values
@@ -1,117 +1,76 @@
 import json
 import sys
+import argparse
 import utils
+import ir
+from passmgr import AnalysisManager
+import stream
+import stats
+from bitvec import BACKENDS
+from worklist import ORDERS
+from framework import analyze_dataflow
+from analyses import ANALYSES, SPARSE_ANALYSES
+from defuse import DefUse
 
-class DFA_Liveness:
-    def __init__(self, bril):
+class DFA:
+    def __init__(self, bril, analysis='live', backend='int', order='scc', report=False, sparse=False):
+        self.name = analysis
+        self.sparse = sparse
+        if sparse:
+            self.analysis = SPARSE_ANALYSES[analysis]()
+        else:
+            self.analysis = ANALYSES[analysis](backend)
+        self.order = order
+        self.report = report
         self.run_dfa(bril)
 
-    def get_successors(self, block):
-        # last instr in block
-        instr = block[-1]
-        # get successors
-        if instr['op'] in ['jmp', 'br']:
-            return instr['labels']
-        # no successor
-        elif instr['op'] == 'ret':
-            return []
-        else: 
-            return
+    def analyze_dataflow(self, func, blocks, cfg=None):
+        if self.sparse:
+            with stats.timed(self.name):
+                self.du = DefUse(func, blocks, cfg)
+                return self.analysis.solve(self.du)
+        with stats.timed(self.name):
+            in_, out, self.worklist = analyze_dataflow(func, blocks, self.analysis, self.order, cfg)
+        self.iterations = self.worklist.pops
+        return in_, out
 
-    def generate_graph(self, blocks):
-        # init all to empty lists
-        self.predecessors = {blk_id: [] for blk_id in blocks}
-        self.successors = {blk_id: [] for blk_id in blocks}
-        for name, block in blocks.items():
-            # get all succcessors
-            successors = self.get_successors(block)
-            self.successors[name].extend(successors) 
-            
-            # make current block predecessors to all its successors
-            for s in successors:
-                self.predecessors[s].append(name)
-
-    def analyze_dataflow(self, blocks):
-        # generate successors and predecessors for every block
-        self.generate_graph(blocks)
-
-        blk_start = list(blocks.keys())[-1]
-        in_set = self.successors
-        out_set = self.predecessors
-
-        # init first block
-        self.in_set = {blk_start: set()}
-        self.out_set = {blk: set() for blk in blocks}
-
-        # iterative worklist dataflow algorithm
-        worklist = list(blocks.keys())
-        while worklist:
-            blk = worklist.pop(0)
-
-            # in values = merge all previous value 
-            in_val = self.union_op(self.out_set[n] for n in in_set[blk])
-            self.in_set[blk] = in_val
-            
-            # out values generated using the transfer function
-            out_val = self.transfer_func(blocks[blk], in_val)
-
-            # if there was a change
-            if out_val != self.out_set[blk]:
-                # update
-                self.out_set[blk] = out_val
-                # add item to the workloist
-                worklist += out_set[blk]
-
-        return self.out_set, self.in_set
-        
-    def transfer_func(self, block, set):
-        return self.vars_used(block).union(set - self.vars_written(block))
-    
-    def union_op(self, sets):
-        out = set()
-        for s in sets:
-            out.update(s)
-        return out
-        
     # run the data flow analysis
     def run_dfa(self, bril):
-        for func in bril['functions']:
+        for func in ir.each_function(bril):
             # build the control flow graph
-            blocks = utils.block_map(utils.form_blocks(func['instrs']))
-            utils.add_terminators(blocks)
+            am = AnalysisManager(func, utils.ANALYSES)
+            blocks = am.get('blocks')
 
             # run the dataflow analysis
-            in_, out = self.analyze_dataflow(blocks)
+            in_, out = self.analyze_dataflow(func, blocks, am.get('cfg'))
             # print the in and out values
             for block in blocks:
                 print('{}:'.format(block))
-                print('  in: ', utils.fmt(in_[block]))
-                print('  out:', utils.fmt(out[block]))    
+                print('  in: ', utils.fmt(in_[block], self.analysis.decode))
+                print('  out:', utils.fmt(out[block], self.analysis.decode))
 
-    # variables written to inside the block
-    def vars_written(self, block):
-        result = set()
-        for instr in block:
-            if 'dest' in instr:
-                result.add(instr['dest'])
-        return result
+            if self.report and not self.sparse:
+                print('@{}: {} iterations ({} pushes, {} blocks)'.format(
+                    func.name, self.iterations, self.worklist.pushes, len(blocks)), file=sys.stderr)
 
-    # variables used before being written to in the block
-    def vars_used(self, block):
-        defined = set()
-        used = set()
-        for instr in block:
-            # if instr has args
-            for var in instr.get('args', []):
-                # and those arguments were not reassigned before being used
-                if var not in defined:
-                    # add them to the seet
-                    used.add(var)
-            # add to defined set(), if an instr writes to a dest
-            if 'dest' in instr:
-                defined.add(instr['dest'])
-        return used
+class DFA_Liveness(DFA):
+    def __init__(self, bril, backend='int', order='scc', report=False):
+        super().__init__(bril, 'live', backend, order, report)
 
 if __name__ == "__main__":
-    bril = json.load(sys.stdin)
-    dfa = DFA_Liveness(bril)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Dataflow analyses on BRIL programs")
+    parser.add_argument("analysis", nargs="?", choices=sorted(ANALYSES), default="live", help="Analysis to run (default: live)")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="int", help="Bit-vector representation: Python ints (default) or NumPy uint64 words")
+    parser.add_argument("--order", choices=ORDERS, default="scc", help="Worklist order: textual, reverse postorder, or loop-nested SCC order (default)")
+    parser.add_argument("--iterations", action="store_true", help="Report the number of transfer function evaluations on stderr")
+    parser.add_argument("--sparse", action="store_true", help="Solve over def-use chains instead of whole blocks (live and cprop only)")
+    parser.add_argument("--stats", action="store_true", help="Print pass times, peak memory and solver counters as JSON on stderr")
+    args = parser.parse_args()
+    if args.sparse and args.analysis not in SPARSE_ANALYSES:
+        parser.error(f"--sparse works with {' and '.join(sorted(SPARSE_ANALYSES))}, not {args.analysis}")
+    if args.stats:
+        stats.enable()
+
+    # functions are decoded one at a time, as the analysis gets to them
+    bril = {'functions': stream.iter_functions(sys.stdin)}
+    dfa = DFA(bril, args.analysis, args.backend, args.order, args.iterations, args.sparse)
@@ -0,0 +1,151 @@
+"""A generic worklist dataflow solver.
+
+An analysis supplies a direction, a meet operator, an initial value and
+a per-block transfer function. Everything it needs to know about a block
+is computed once in `prepare()` (for bit-vector analyses, the block's
+GEN and KILL sets), so the fixpoint loop never re-scans instructions.
+The solver itself works on integer block ids from a `flowgraph.CFG`; block
+names only come back when the results are handed out.
+"""
+from bitvec import Interner, BACKENDS
+from flowgraph import CFG
+import stats
+from worklist import Worklist, priorities
+
+
+class Analysis:
+    forward = True
+
+    def __init__(self, backend='int'):
+        # `backend` picks the bit-vector representation, where one is used
+        self.backend = backend
+
+    def prepare(self, func, blocks):
+        """Compute per-block summaries once, before solving. Blocks are
+        identified by their position in `blocks` from here on."""
+        pass
+
+    def init(self):
+        """Value every block starts from."""
+        raise NotImplementedError
+
+    def boundary(self):
+        """Value flowing into the entry (forward) or out of the exits
+        (backward)."""
+        return self.init()
+
+    def meet(self, facts):
+        raise NotImplementedError
+
+    def transfer(self, blk, fact):
+        raise NotImplementedError
+
+    def equal(self, a, b):
+        return a == b
+
+    def decode(self, fact):
+        """Turn a fact into something `utils.fmt` can print."""
+        return fact
+
+
+class BitVectorAnalysis(Analysis):
+    """Facts are sets over a universe of interned items, stored as bit
+    vectors; the transfer function is GEN | (x - KILL). Subclasses fill
+    in `summarize()`, which returns the GEN and KILL item lists of a
+    block, interning items through `self.items`.
+    """
+    may = True  # meet is union; otherwise intersection
+
+    def prepare(self, func, blocks):
+        self.items = Interner()
+        summaries = self.summarize(func, blocks)
+
+        self.bits = BACKENDS[self.backend](len(self.items))
+        self.gen = [self.bits.from_indices(summaries[name][0]) for name in blocks]
+        self.kill = [self.bits.from_indices(summaries[name][1]) for name in blocks]
+
+    def summarize(self, func, blocks):
+        raise NotImplementedError
+
+    def init(self):
+        return self.bits.empty() if self.may else self.bits.full()
+
+    def boundary(self):
+        return self.bits.empty()
+
+    def meet(self, facts):
+        bits = self.bits
+        if self.may:
+            out = bits.empty()
+            for f in facts:
+                out = bits.union(out, f)
+        else:
+            out = bits.full()
+            for f in facts:
+                out = bits.intersect(out, f)
+        return out
+
+    def transfer(self, blk, fact):
+        return self.bits.transfer(self.gen[blk], self.kill[blk], fact)
+
+    def equal(self, a, b):
+        return self.bits.equal(a, b)
+
+    def decode(self, fact):
+        return {self.show_item(self.items.names[i]) for i in self.bits.indices(fact)}
+
+    def show_item(self, item):
+        return item
+
+
+def analyze_dataflow(func, blocks, analysis, order='scc', cfg=None):
+    """Solve `analysis` over an ordered block map (with terminators).
+    Returns (in_, out, worklist): the facts at the start and end of every
+    block, by block name, and the worklist, for its counters.
+    """
+    if cfg is None:
+        cfg = CFG.from_block_map(blocks)
+    n = len(cfg)
+    analysis.prepare(func, blocks)
+
+    if analysis.forward:
+        flow_in, flow_out = cfg.preds, cfg.succs
+        roots = [cfg.entry] if n else []
+    else:
+        flow_in, flow_out = cfg.succs, cfg.preds
+        roots = cfg.exits()
+    is_root = bytearray(n)
+    for b in roots:
+        is_root[b] = 1
+
+    before = [None] * n
+    after = [analysis.init() for _ in range(n)]
+
+    worklist = Worklist(*priorities(n, flow_out, roots, order))
+    worklist.extend(range(n))
+    while worklist:
+        b = worklist.pop()
+
+        # merge the facts flowing in
+        facts = [after[p] for p in flow_in[b]]
+        if is_root[b]:
+            facts.append(analysis.boundary())
+        before[b] = analysis.meet(facts)
+
+        out_val = analysis.transfer(b, before[b])
+        if not analysis.equal(out_val, after[b]):
+            after[b] = out_val
+            worklist.extend(flow_out[b])
+
+    if stats.enabled:
+        # every pop is one meet and one transfer function evaluation
+        stats.count('dataflow.solves')
+        stats.count('dataflow.pops', worklist.pops)
+        stats.count('dataflow.pushes', worklist.pushes)
+        stats.count('dataflow.transfers', worklist.pops)
+
+    before = dict(zip(cfg.names, before))
+    after = dict(zip(cfg.names, after))
+    if analysis.forward:
+        return before, after, worklist
+    return after, before, worklist
@@ -1,10 +1,16 @@
-import json
+import os
 import sys
 import itertools
-from collections import OrderedDict
+
+# code shared between the homeworks lives in ../common
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from flowgraph import CFG
+from blocks import (fresh_names, labeled_blocks, name_blocks, block_map,
+                    add_terminators, function_blocks)
+import ir
 
 # Instructions that terminate a basic block.
-TERMINATORS = 'br', 'jmp', 'ret'
+TERMINATORS = ir.TERMINATORS
 
 ### FORM BLOCKS
 def form_blocks(instrs):
@@ -22,14 +28,14 @@ def form_blocks(instrs):
     cur_block = []
 
     for instr in instrs:
-        if 'op' in instr:  # It's an instruction.
+        if instr.op is not None:  # It's an instruction.
             # Add the instruction to the currently-being-formed block.
             cur_block.append(instr)
 
             # If this is a terminator (branching instruction), it's the
             # last instruction in the block. Finish this block and
             # start a new one.
-            if instr['op'] in TERMINATORS:
+            if instr.op in TERMINATORS:
                 yield cur_block
                 cur_block = []
 
@@ -48,28 +54,26 @@ def form_blocks(instrs):
 def print_blocks(bril):
     """Given a Bril program, print out its basic blocks.
     """
-    import briltxt
-
-    func = bril['functions'][0]  # We only process one function.
-    for block in form_blocks(func['instrs']):
+    func = ir.functions(bril)[0]  # We only process one function.
+    for block in form_blocks(func.instrs):
         # Mark the block.
         leader = block[0]
-        if 'label' in leader:
-            print('block "{}":'.format(leader['label']))
+        if leader.op is None:
+            print('block "{}":'.format(leader.label))
             block = block[1:]  # Hide the label, for concision.
         else:
             print('anonymous block:')
 
         # Print the instructions.
         for instr in block:
-            print('  {}'.format(briltxt.instr_to_string(instr)))
+            print('  {}'.format(instr))
 
 
 ### UTIL
 def flatten(ll):
     """Flatten an iterable of iterable to a single list.
     """
-    return list(itertools.chain(*ll))
+    return list(itertools.chain.from_iterable(ll))
 
 def fresh(seed, names):
     """Generate a new name that is not in `names` starting with `seed`.
@@ -82,10 +86,13 @@ def fresh(seed, names):
         i += 1
 
 ### DataFLOW
-def fmt(val):
+def fmt(val, decode=None):
     """Guess a good way to format a data flow value. (Works for sets and
-    dicts, at least.)
+    dicts, at least.) Bit-vector values are turned back into sets with
+    `decode` first.
     """
+    if decode is not None:
+        val = decode(val)
     if isinstance(val, set):
         if val:
             return ', '.join(v for v in sorted(val))
@@ -102,51 +109,10 @@ def fmt(val):
         return str(val)
     
 
-### CFG
-def block_map(blocks):
-    """Given a sequence of basic blocks, which are lists of instructions,
-    produce a `OrderedDict` mapping names to blocks.
-
-    The name of the block comes from the label it starts with, if any.
-    Anonymous blocks, which don't start with a label, get an
-    automatically generated name. Blocks in the mapping have their
-    labels removed.
-    """
-    by_name = OrderedDict()
-
-    for block in blocks:
-        # Generate a name for the block.
-        if 'label' in block[0]:
-            # The block has a label. Remove the label but use it for the
-            # block's name.
-            name = block[0]['label']
-            block = block[1:]
-        else:
-            # Make up a new name for this anonymous block.
-            name = fresh('b', by_name)
-
-        # Add the block to the mapping.
-        by_name[name] = block
-
-    return by_name
-
-def add_terminators(blocks):
-    """Given an ordered block map, modify the blocks to add terminators
-    to all blocks (avoiding "fall-through" control flow transfers).
-    """
-    for i, block in enumerate(blocks.values()):
-        if not block:
-            if i == len(blocks) - 1:
-                # In the last block, return.
-                block.append({'op': 'ret', 'args': []})
-            else:
-                dest = list(blocks.keys())[i + 1]
-                block.append({'op': 'jmp', 'labels': [dest]})
-        elif block[-1]['op'] not in TERMINATORS:
-            if i == len(blocks) - 1:
-                block.append({'op': 'ret', 'args': []})
-            else:
-                # Otherwise, jump to the next block.
-                dest = list(blocks.keys())[i + 1]
-                block.append({'op': 'jmp', 'labels': [dest]})
-
+### ANALYSES
+# what an AnalysisManager can compute for any function; analyses built
+# on top of these extend the table
+ANALYSES = {
+    'blocks': function_blocks,
+    'cfg': lambda func, am: CFG.from_block_map(am.get('blocks')),
+}
@@ -0,0 +1,187 @@
+"""Worklist scheduling for the dataflow solver.
+
+A `Worklist` never holds the same block twice and always hands out the
+queued block with the lowest priority number. `priorities()` builds
+those numbers for one of three strategies:
+
+  * 'fifo' - textual block order (the old behaviour, minus duplicates)
+  * 'rpo'  - reverse postorder of the graph in the direction facts flow
+  * 'scc'  - strongly connected components in topological order, each
+             laid out as a weak topological order (loop header first,
+             inner loops contiguous)
+
+Within a component the worklist runs in sweeps: a block queued behind
+the current position waits for the next sweep instead of restarting the
+scan, and a component is iterated until it is stable before any block
+of a later component is visited.
+"""
+import heapq
+from collections import deque
+
+from flowgraph import postorder
+
+ORDERS = ('fifo', 'rpo', 'scc')
+
+
+class Worklist:
+    def __init__(self, priority=None, component=None):
+        # no priority map means plain first-in first-out
+        self.priority = priority
+        self.component = component
+        self.queued = set()
+        self.items = [] if priority is not None else deque()
+        self.pushes = 0
+        self.pops = 0
+        # where the current sweep is: (component, round, priority)
+        self.current = (-1, 0, -1)
+
+    def key(self, node):
+        # blocks behind the current position in the same component wait
+        # for the next sweep; everything else is taken in priority order
+        comp = self.component[node] if self.component is not None else 0
+        pos = self.priority[node]
+        cur_comp, cur_round, cur_pos = self.current
+        if comp != cur_comp:
+            return (comp, 0, pos)
+        if pos > cur_pos:
+            return (comp, cur_round, pos)
+        return (comp, cur_round + 1, pos)
+
+    def push(self, node):
+        if node in self.queued:
+            return
+        self.queued.add(node)
+        self.pushes += 1
+        if self.priority is None:
+            self.items.append(node)
+        else:
+            heapq.heappush(self.items, (self.key(node), node))
+
+    def extend(self, nodes):
+        for node in nodes:
+            self.push(node)
+
+    def pop(self):
+        if self.priority is None:
+            node = self.items.popleft()
+        else:
+            self.current, node = heapq.heappop(self.items)
+        self.queued.discard(node)
+        self.pops += 1
+        return node
+
+    def __bool__(self):
+        return bool(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def postorder_all(succs, roots, n):
+    # postorder from `roots`, then from anything not yet reached
+    return postorder(succs, list(roots) + list(range(n)), n)
+
+
+def sccs(members, succs, rank):
+    """Tarjan's algorithm restricted to `members`. Returns the components
+    in topological order, each sorted by `rank`.
+    """
+    inside = set(members)
+    index = {}
+    low = {}
+    on_stack = set()
+    stack = []
+    comps = []
+
+    for root in members:
+        if root in index:
+            continue
+        index[root] = low[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(succs[root]))]
+        while work:
+            node, children = work[-1]
+            for child in children:
+                if child not in inside:
+                    continue
+                if child not in index:
+                    index[child] = low[child] = len(index)
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(succs[child])))
+                    break
+                if child in on_stack:
+                    low[node] = min(low[node], index[child])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                if low[node] == index[node]:
+                    comp = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        comp.append(member)
+                        if member == node:
+                            break
+                    comp.sort(key=rank.__getitem__)
+                    comps.append(comp)
+
+    # tarjan finds sinks first
+    comps.reverse()
+    return comps
+
+
+def weak_topological_order(succs, roots, n):
+    """Returns (order, component): the nodes laid out so that every loop
+    is its header followed by its body, inner loops contiguous, and the
+    index of each node's outermost strongly connected component.
+    """
+    rpo = postorder_all(succs, roots, n)[::-1]
+    rank = [0] * n
+    for i, node in enumerate(rpo):
+        rank[node] = i
+
+    order = []
+
+    def layout(members):
+        # components in topological order; a loop contributes its header
+        # followed by the layout of the rest of its body
+        for comp in sccs(members, succs, rank):
+            order.append(comp[0])
+            if len(comp) > 1:
+                layout(comp[1:])
+
+    component = [0] * n
+    for c, comp in enumerate(sccs(rpo, succs, rank)):
+        for node in comp:
+            component[node] = c
+        order.append(comp[0])
+        if len(comp) > 1:
+            layout(comp[1:])
+
+    return order, component
+
+
+def priorities(n, succs, roots, order='scc'):
+    """Scheduling maps for a `Worklist` over blocks 0..n-1, where
+    `succs[b]` are the blocks facts flow into from `b` and `roots` are
+    where the flow starts. Returns (priority, component), as lists
+    indexed by block; both are None for 'fifo'.
+    """
+    if order == 'fifo':
+        return None, None
+    if order == 'rpo':
+        priority = [0] * n
+        for i, b in enumerate(reversed(postorder_all(succs, roots, n))):
+            priority[b] = i
+        return priority, None
+    if order == 'scc':
+        seq, comp = weak_topological_order(succs, roots, n)
+        priority = [0] * n
+        for i, b in enumerate(seq):
+            priority[b] = i
+        return priority, comp
+    raise ValueError(f"unknown worklist order {order!r}")
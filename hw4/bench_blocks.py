@@ -0,0 +1,100 @@
+import sys
+import time
+import argparse
+from collections import OrderedDict
+
+import utils
+import ir
+
+# The original block map and terminator pass, kept as the reference for
+# the benchmark. Both are quadratic in the number of blocks.
+def quadratic_block_map(blocks):
+    by_name = OrderedDict()
+    for block in blocks:
+        if block[0].op is None:
+            name = block[0].label
+            block = block[1:]
+        else:
+            name = utils.fresh('b', by_name)
+        by_name[name] = block
+    return by_name
+
+def quadratic_add_terminators(blocks):
+    for i, block in enumerate(blocks.values()):
+        if not block or block[-1].op not in utils.TERMINATORS:
+            if i == len(blocks) - 1:
+                block.append(ir.Instr('ret'))
+            else:
+                dest = list(blocks.keys())[i + 1]
+                block.append(ir.Instr('jmp', labels=(dest,)))
+
+def synthetic_instrs(n):
+    """About `n` instructions in short blocks: anonymous blocks after
+    jumps, and labeled blocks that fall through into each other, which
+    are the two cases that used to be quadratic.
+    """
+    instrs = []
+    i = 0
+    while len(instrs) < n:
+        instrs.append(ir.Instr('const', dest='x', type='int', value=i))
+        instrs.append(ir.Instr('add', dest='y', type='int', args=('x', 'y')))
+        if i % 2:
+            instrs.append(ir.Instr('jmp', labels=(f'l{i + 1}',)))
+        else:
+            instrs.append(ir.Label(f'l{i}'))
+        i += 1
+    instrs.append(ir.Label(f'l{i}'))
+    instrs.append(ir.Instr('ret'))
+    return instrs
+
+def front_end(instrs):
+    blocks = utils.name_blocks(utils.labeled_blocks(instrs))
+    utils.add_terminators(blocks)
+    return blocks
+
+def quadratic_front_end(instrs):
+    blocks = quadratic_block_map(utils.form_blocks(instrs))
+    quadratic_add_terminators(blocks)
+    return blocks
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+def main(args):
+    print("instrs,blocks,quadratic_s,linear_s,cfg_s,ns_per_instr,match")
+    per_instr = []
+    for n in args.sizes:
+        instrs = synthetic_instrs(n)
+
+        blocks, t_new = timed(front_end, instrs)
+        _, t_cfg = timed(utils.CFG.from_block_map, blocks)
+
+        t_old, match = '', ''
+        if n <= args.quadratic_max:
+            old, t_old = timed(quadratic_front_end, instrs)
+            match = list(old) == list(blocks) and all(
+                [repr(i) for i in old[b]] == [repr(i) for i in blocks[b]] for b in blocks)
+            t_old = f'{t_old:.4f}'
+
+        ns = (t_new + t_cfg) / len(instrs) * 1e9
+        per_instr.append(ns)
+        print(f"{len(instrs)},{len(blocks)},{t_old},{t_new:.4f},{t_cfg:.4f},{ns:.0f},{match}")
+        sys.stdout.flush()
+
+    # linear time means the cost per instruction stays flat; allow for
+    # cache effects and noise on the largest inputs
+    ratio = max(per_instr) / min(per_instr)
+    print(f"# per-instruction cost varies by {ratio:.2f}x (limit {args.max_ratio}x)")
+    if ratio > args.max_ratio:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that forming blocks and the CFG scales linearly")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--quadratic_max", type=int, default=10000, help="Largest size to run the original code on")
+    parser.add_argument("--max_ratio", type=float, default=3.0)
+
+    main(parser.parse_args())
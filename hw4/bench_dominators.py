@@ -0,0 +1,95 @@
+import sys
+import time
+import random
+import argparse
+from collections import OrderedDict
+
+import utils
+import ir
+from dominator import generate_graph, get_dominators
+
+# The original set-based algorithm, kept as the reference for the benchmark.
+def iterative_dominators(blocks):
+    all_blks_l = list(blocks.keys())
+    all_blks_s = set(all_blks_l)
+    entry = next(iter(blocks))
+
+    dom = {name: all_blks_s for name in blocks.keys()}
+    dom[entry] = {entry}
+
+    _, predecessors = generate_graph(blocks)
+
+    changed = True
+    while changed:
+        changed = False
+        for v in all_blks_l[1:]:
+            intrsct = all_blks_s
+            for pred in predecessors[v]:
+                intrsct = intrsct.intersection(dom[pred])
+            new_dom = intrsct.union({v})
+            if new_dom != dom[v]:
+                dom[v] = new_dom
+                changed = True
+
+    return dom
+
+def synthetic_cfg(n, seed=0):
+    """A block map with `n` blocks: a chain of if/else diamonds with
+    loops closing back over random distances, in shuffled program order
+    (so plain block order is a poor visiting order).
+    """
+    rng = random.Random(seed)
+    names = [f'b{i}' for i in range(n)]
+    blocks = OrderedDict()
+    for i, name in enumerate(names):
+        if i == n - 1:
+            term = ir.Instr('ret')
+        elif i % 3 == 0 and i + 2 < n:
+            # diamond head
+            term = ir.Instr('br', args=('c',), labels=(names[i + 1], names[i + 2]))
+        elif i % 3 == 1:
+            term = ir.Instr('jmp', labels=(names[i + 2] if i + 2 < n else names[i + 1],))
+        elif i > 3 and rng.random() < 0.3:
+            # loop latch
+            back = names[rng.randrange(max(0, i - 30), i)]
+            term = ir.Instr('br', args=('c',), labels=(back, names[i + 1]))
+        else:
+            term = ir.Instr('jmp', labels=(names[i + 1],))
+        blocks[name] = [term]
+
+    # keep the entry first, shuffle the rest
+    rest = names[1:]
+    rng.shuffle(rest)
+    return OrderedDict((name, blocks[name]) for name in [names[0]] + rest)
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def main(args):
+    print("blocks,iterative_s,chk_s,lt_s,match")
+    for n in args.sizes:
+        blocks = synthetic_cfg(n, args.seed)
+
+        chk, t_chk = timed(get_dominators, blocks, method='chk')
+        lt, t_lt = timed(get_dominators, blocks, method='lt')
+        match = chk.idom == lt.idom
+
+        t_old = ''
+        if n <= args.iterative_max:
+            old, t_old = timed(iterative_dominators, blocks)
+            match = match and all(old[b] == chk[b] for b in blocks)
+            t_old = f'{t_old:.4f}'
+
+        print(f"{n},{t_old},{t_chk:.4f},{t_lt:.4f},{match}")
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare dominator algorithms on synthetic CFGs")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 2000, 5000, 20000, 50000])
+    parser.add_argument("--iterative_max", type=int, default=2000, help="Largest size to run the old set-based algorithm on")
+    parser.add_argument("--seed", type=int, default=0)
+
+    main(parser.parse_args())
@@ -0,0 +1,111 @@
+import sys
+import random
+import argparse
+
+import utils
+from dominator import idoms_chk
+from dynamic_dominators import DynamicDominators
+from bench_dominators import synthetic_cfg, timed
+
+# Random edits (edge insertions and deletions, block merges) on synthetic
+# CFGs, with the dominators kept up to date by DynamicDominators. With
+# --check, every edge change is compared against recomputing them from
+# scratch (idoms, depths and dominates() on random pairs); exits 1 on the
+# first mismatch.
+
+def merge_edit(dyn, rng):
+    """The edits merging a block into its only predecessor, when that
+    jumps nowhere else: the successors move up and the block is left
+    unreachable. None if there is no such pair.
+    """
+    n = len(dyn.succs)
+    for _ in range(20):
+        a = rng.randrange(n)
+        if len(dyn.succs[a]) != 1 or not dyn.reachable(a):
+            continue
+        b = dyn.succs[a][0]
+        if b == a or b == dyn.entry or dyn.preds[b] != [a] or b in dyn.succs[b]:
+            continue
+        ops = [('insert', (a, s)) for s in dyn.succs[b]]
+        ops += [('delete', (b, s)) for s in dyn.succs[b]]
+        return ops + [('delete', (a, b))]
+    return None
+
+def random_edit(dyn, rng):
+    """A list of edge insertions and deletions: a block merge, a random
+    deletion, or a random insertion (mostly of a short edge).
+    """
+    n = len(dyn.succs)
+    r = rng.random()
+    if r < 0.3:
+        ops = merge_edit(dyn, rng)
+        if ops:
+            return ops
+    if r < 0.6:
+        edges = [(u, v) for u in range(n) for v in dyn.succs[u]]
+        if edges:
+            return [('delete', rng.choice(edges))]
+    u = rng.randrange(n)
+    v = min(n - 1, max(0, u + rng.randint(-8, 8))) if rng.random() < 0.7 else rng.randrange(n)
+    return [('insert', (u, v))]
+
+def check(dyn, rng):
+    cfg = utils.CFG(dyn.names, dyn.succs, dyn.entry)
+    idom = list(idoms_chk(cfg))
+    if idom != dyn.idom:
+        return 'idom'
+    for b in range(len(idom)):
+        if idom[b] == -1:
+            continue
+        if dyn.depth[b] != (0 if b == dyn.entry else dyn.depth[idom[b]] + 1):
+            return 'depth'
+    for _ in range(50):
+        a, b = rng.randrange(len(idom)), rng.randrange(len(idom))
+        x = b
+        while x != -1 and x != a and idom[x] != x:
+            x = idom[x]
+        if dyn.dominates(a, b) != (x == a and idom[b] != -1 or a == b):
+            return 'dominates'
+    return None
+
+def main(args):
+    print("blocks,edits,incremental_s,recompute_s,match")
+    for n in args.sizes:
+        rng = random.Random(args.seed)
+        blocks = synthetic_cfg(n, args.seed)
+        cfg = utils.CFG.from_block_map(blocks)
+        dyn = DynamicDominators(cfg)
+
+        t_inc = t_full = 0.0
+        match = True
+        for _ in range(args.edits):
+            ops = random_edit(dyn, rng)
+            for op, (u, v) in ops:
+                _, t = timed(dyn.insert_edge if op == 'insert' else dyn.delete_edge, u, v)
+                t_inc += t
+                if args.check:
+                    problem = check(dyn, rng)
+                    if problem:
+                        print(f"# {problem} differs after {op} {dyn.names[u]} -> {dyn.names[v]}", file=sys.stderr)
+                        match = False
+                        break
+            if not match:
+                break
+            # recomputing once per edit, as a pass would after a change
+            _, t = timed(idoms_chk, utils.CFG(dyn.names, dyn.succs, dyn.entry))
+            t_full += t
+
+        print(f"{n},{args.edits},{t_inc:.4f},{t_full:.4f},{match if args.check else ''}")
+        sys.stdout.flush()
+        if not match:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time (and check) incremental dominators against recomputing them")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--edits", type=int, default=200, help="Random edge insertions and deletions per CFG")
+    parser.add_argument("--check", action="store_true", help="Compare with a full recomputation after every edit")
+    parser.add_argument("--seed", type=int, default=0)
+
+    main(parser.parse_args())
@@ -1,98 +1,330 @@
 import sys
 import json
 import utils
+import ir
+from passmgr import AnalysisManager
+import stream
+import stats
 import graph
 import argparse
 import subprocess
+from array import array
+from collections.abc import Mapping
 
 def get_successors(block):
     # last instr in block
     instr = block[-1]
     # get successors
-    if instr['op'] in ['jmp', 'br']:
-        return instr['labels']
+    if instr.op in ['jmp', 'br']:
+        return list(instr.labels)
     # no successor
-    elif instr['op'] == 'ret':
+    elif instr.op == 'ret':
         return []
     else: 
         return None
 
 def generate_graph(blocks):
-    # init all to empty lists
-    predecessor_dict = {blk_id: [] for blk_id in blocks}
-    successor_dict = {blk_id: [] for blk_id in blocks}
-    for name, block in blocks.items():
-        # get all succcessors
-        successors = get_successors(block)
-        successor_dict[name].extend(successors) 
-        
-        # make current block predecessors to all its successors
-        for s in successors:
-            predecessor_dict[s].append(name)
-
-    return successor_dict, predecessor_dict
-
-def get_dominators(blocks):
-    # get block list and block set structures
-    all_blks_l = list(blocks.keys())
-    all_blks_s = set(all_blks_l)
-
-    # get the firs block
-    entry = next(iter(blocks))
-
-    # init dominator dict
-    dom = {name: all_blks_s for name in blocks.keys()} 
-    dom[entry] = {entry}
-
-    _, predecessors = generate_graph(blocks)
+    # name -> list of names views, for callers that want the old dicts
+    cfg = utils.CFG.from_block_map(blocks)
+    return cfg.successors, cfg.predecessors
 
-    changed = True
-    while changed:
-        changed = False
-        # all vertices except the entry point
-        for v in all_blks_l[1:]:
-            intrsct = all_blks_s
+def number_blocks(blocks):
+    # give every block a dense integer id in program order (entry is 0)
+    return utils.CFG.from_block_map(blocks)
 
-            # get the common ancestors of all predecessors
-            for pred in predecessors[v]:
-                intrsct = intrsct.intersection(dom[pred])
+def idoms_chk(cfg):
+    """Immediate dominators using Cooper, Harvey and Kennedy's
+    "A Simple, Fast Dominance Algorithm". Returns the idom array
+    (idom[entry] == entry, unreachable blocks get -1).
+    """
+    preds, rpo, order, entry = cfg.preds, cfg.rpo, cfg.rpo_number, cfg.entry
 
-            # self dominates
-            new_dom = intrsct.union({v})
+    idom = [-1] * len(cfg)
+    idom[entry] = entry
 
-            # update the dominator tree entries
-            if new_dom != dom[v]:
-                dom[v] = new_dom
+    rounds = 0
+    changed = True
+    while changed:
+        changed = False
+        rounds += 1
+        # all reachable vertices except the entry point
+        for b in rpo[1:]:
+            new_idom = -1
+            for p in preds[b]:
+                # skip predecessors we haven't reached yet
+                if idom[p] == -1:
+                    continue
+                if new_idom == -1:
+                    new_idom = p
+                    continue
+
+                # walk both fingers up the tree until they meet
+                f1, f2 = p, new_idom
+                while f1 != f2:
+                    while order[f1] > order[f2]:
+                        f1 = idom[f1]
+                    while order[f2] > order[f1]:
+                        f2 = idom[f2]
+                new_idom = f1
+
+            if idom[b] != new_idom:
+                idom[b] = new_idom
                 changed = True
 
-    return dom
+    if stats.enabled:
+        # the last round only confirms the fixpoint
+        stats.count('dominators.rounds', rounds)
+        stats.count('dominators.block_visits', rounds * (len(rpo) - 1))
+    return idom
+
+def idoms_lengauer_tarjan(cfg):
+    """Immediate dominators using Lengauer and Tarjan's algorithm with
+    path compression. Same result as `idoms_chk` but O(E log N) in the
+    worst case, which pays off on very large or irregular cfgs.
+    """
+    succs, preds, entry = cfg.succs, cfg.preds, cfg.entry
+    n = len(cfg)
+
+    # number the blocks in dfs preorder
+    dfnum = [-1] * n
+    vertex = []
+    parent = [-1] * n
+    stack = [(entry, -1)]
+    while stack:
+        v, p = stack.pop()
+        if dfnum[v] != -1:
+            continue
+        dfnum[v] = len(vertex)
+        vertex.append(v)
+        parent[v] = p
+        for w in reversed(succs[v]):
+            if dfnum[w] == -1:
+                stack.append((w, v))
+
+    semi = dfnum[:]
+    ancestor = [-1] * n
+    label = list(range(n))
+    samedom = [-1] * n
+    idom = [-1] * n
+    bucket = [[] for _ in range(n)]
+
+    def eval_(v):
+        # node with the lowest semidominator on the forest path to v
+        if ancestor[v] == -1:
+            return v
+        path = []
+        u = v
+        while ancestor[ancestor[u]] != -1:
+            path.append(u)
+            u = ancestor[u]
+        for u in reversed(path):
+            a = ancestor[u]
+            if semi[label[a]] < semi[label[u]]:
+                label[u] = label[a]
+            ancestor[u] = ancestor[a]
+        return label[v]
+
+    for i in range(len(vertex) - 1, 0, -1):
+        w = vertex[i]
+        p = parent[w]
+
+        # semidominator of w
+        s = dfnum[p]
+        for v in preds[w]:
+            if dfnum[v] == -1:
+                continue
+            cand = dfnum[v] if dfnum[v] <= dfnum[w] else semi[eval_(v)]
+            if cand < s:
+                s = cand
+        semi[w] = s
+        bucket[vertex[s]].append(w)
+
+        # link w into the forest and resolve everything waiting on p
+        ancestor[w] = p
+        for v in bucket[p]:
+            y = eval_(v)
+            if semi[y] == semi[v]:
+                idom[v] = p
+            else:
+                samedom[v] = y
+        bucket[p] = []
+
+    for w in vertex[1:]:
+        if samedom[w] != -1:
+            idom[w] = idom[samedom[w]]
+
+    idom[entry] = entry
+    return idom
+
+IDOM_METHODS = {'chk': idoms_chk, 'lt': idoms_lengauer_tarjan}
+
+class DominatorMap(Mapping):
+    """The old `dom` dict (block name -> set of its dominators), backed
+    by an idom array. Sets are only built when a block is looked up.
+    """
+    def __init__(self, cfg, idom):
+        self.cfg = cfg
+        self.names = cfg.names
+        self.index = cfg.index
+        self.idom = idom
+        self._sets = {}
+
+    def immediate(self, name):
+        # immediate dominator of a block, or None for the entry/unreachable
+        b = self.index[name]
+        d = self.idom[b]
+        if d == -1 or d == b:
+            return None
+        return self.names[d]
+
+    def __getitem__(self, name):
+        if name in self._sets:
+            return self._sets[name]
+
+        b = self.index[name]
+        if self.idom[b] == -1:
+            # unreachable blocks are (vacuously) dominated by everything
+            doms = set(self.names)
+        else:
+            doms = {name}
+            while self.idom[b] != b:
+                b = self.idom[b]
+                doms.add(self.names[b])
+
+        self._sets[name] = doms
+        return doms
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+def get_dominators(blocks, method='chk', cfg=None):
+    if cfg is None:
+        cfg = number_blocks(blocks)
+    if not cfg:
+        return DominatorMap(cfg, [])
+    if stats.enabled:
+        stats.count('dominators.solves')
+    return DominatorMap(cfg, IDOM_METHODS[method](cfg))
 
 
 
 def strictly_dominates(b1, b2, doms):
     return b1 in doms[b2] and b1 != b2
 
+def idoms_from_sets(dom, blocks=None):
+    # recover an idom array from a plain {block: set of dominators} dict:
+    # the immediate dominator is the strict dominator with the most dominators
+    if blocks is not None:
+        cfg = number_blocks(blocks)
+    else:
+        # no blocks, no edges: enough for building the tree
+        cfg = utils.CFG(list(dom), [()] * len(dom))
+    index = cfg.index
+    idom = [-1] * len(cfg)
+    for name, doms in dom.items():
+        b = index[name]
+        strict = [d for d in doms if d != name]
+        idom[b] = index[max(strict, key=lambda d: len(dom[d]))] if strict else b
+    return DominatorMap(cfg, idom)
+
+class DominatorTree(Mapping):
+    """Dominator tree stored in CSR form: the children of block `b` are
+    `children[offsets[b]:offsets[b + 1]]`, as integer block ids. Indexing
+    by block name gives the list of child names, like the old dict.
+    """
+    def __init__(self, names, index, idom, offsets, children):
+        self.names = names
+        self.index = index
+        self.idom = idom
+        self.offsets = offsets
+        self.children = children
+        self.pre = None
+        self.post = None
+
+    def child_ids(self, b):
+        return self.children[self.offsets[b]:self.offsets[b + 1]]
+
+    def number(self):
+        # pre/post dfs numbering: a dominates b iff b's interval is
+        # nested inside a's. Blocks outside the tree keep -1.
+        n = len(self.names)
+        pre = array('i', [-1]) * n
+        post = array('i', [-1]) * n
+        offsets, children = self.offsets, self.children
+        clock = 0
+        for root in range(n):
+            if self.idom[root] != root:
+                continue
+            pre[root] = clock
+            clock += 1
+            stack = [(root, offsets[root])]
+            while stack:
+                b, i = stack[-1]
+                if i < offsets[b + 1]:
+                    stack[-1] = (b, i + 1)
+                    c = children[i]
+                    pre[c] = clock
+                    clock += 1
+                    stack.append((c, offsets[c]))
+                else:
+                    stack.pop()
+                    post[b] = clock
+                    clock += 1
+        self.pre, self.post = pre, post
+
+    def dominates_id(self, a, b):
+        if self.pre is None:
+            self.number()
+        if self.pre[a] == -1 or self.pre[b] == -1:
+            return a == b
+        return self.pre[a] <= self.pre[b] and self.post[b] <= self.post[a]
+
+    def dominates(self, nodeA, nodeB):
+        return self.dominates_id(self.index[nodeA], self.index[nodeB])
+
+    def __getitem__(self, name):
+        return [self.names[c] for c in self.child_ids(self.index[name])]
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
 def build_dominance_tree(dom):
-    # init dominator tree
-    dom_tree = {node: [] for node in dom.keys()}
-
-    for a in dom.keys():
-        for b, b_doms in dom.items():
-            if a != b:
-                E_a_stric_dom_c = False
-                # look at all dominators of b
-                for c in b_doms:
-                    # c != b
-                    if c != b:
-                        # check if a strictly dominates any of b's dominators
-                        E_a_stric_dom_c = E_a_stric_dom_c or strictly_dominates(a, c, dom)
-
-                # b1 strictly dominates 
-                if a in b_doms and not E_a_stric_dom_c:
-                    dom_tree[a].append(b)
-    return dom_tree
+    if not isinstance(dom, DominatorMap):
+        dom = idoms_from_sets(dom)
+    idom = dom.idom
+    n = len(idom)
+
+    # count the children of every node, then prefix-sum into offsets
+    offsets = array('i', bytes(4 * (n + 1)))
+    for b in range(n):
+        p = idom[b]
+        if p != -1 and p != b:
+            offsets[p + 1] += 1
+    for b in range(n):
+        offsets[b + 1] += offsets[b]
+
+    # place children in block order
+    children = array('i', bytes(4 * offsets[n]))
+    fill = offsets[:n]
+    for b in range(n):
+        p = idom[b]
+        if p != -1 and p != b:
+            children[fill[p]] = b
+            fill[p] += 1
+
+    return DominatorTree(dom.names, dom.index, idom, offsets, children)
 
 def test_dominance(nodeA, nodeB, dom_tree):
+    # O(1) interval check when we have a numbered tree
+    if isinstance(dom_tree, DominatorTree):
+        return dom_tree.dominates(nodeA, nodeB)
+
     stack = [nodeA]
     
     while stack:
@@ -104,62 +336,161 @@ def test_dominance(nodeA, nodeB, dom_tree):
     
     return False
 
-def get_dominance_frontier(blks):
-    # get predecessors and dominators for each block
-    _, p = generate_graph(blks)
-    doms = get_dominators(blks)
-
-    # init the frontier dict
-    frontier = {name: [] for name in doms.keys()}
+def dominance_frontier_ids(doms):
+    # frontier[b] lists the ids of the blocks in b's dominance frontier
+    names, idom, preds = doms.names, doms.idom, doms.cfg.preds
+    entry = doms.cfg.entry
+    frontier = [[] for _ in names]
 
-    # loop over all nodes
-    for node in doms:
-        # get the dominators of all predecessors of the current node
-        pred_doms = [doms[pred] for pred in p[node]]
-        # if none, we can skip to the next node
-        if len(pred_doms) == 0:
+    for b in range(len(names)):
+        # unreachable blocks have no frontier
+        if idom[b] == -1:
             continue
-
-        # get the set intersection for dominators of all predecessors of current node
-        intersection = set.intersection(*map(set,pred_doms))
-        # get the set union for dominators of all predecessors of the current node
-        union = set.union(*map(set,pred_doms)) 
-        frontier_set = union - intersection
-        
-        # add nodes to the frontier dict
-        for block in frontier_set:
-            frontier[block].append(node)
+        # walk up from each predecessor until we reach b's idom; every
+        # block on the way has b in its frontier
+        stop = idom[b] if b != entry else -1
+        for p in preds[b]:
+            if idom[p] == -1:
+                continue
+            runner = p
+            while runner != stop:
+                if not frontier[runner] or frontier[runner][-1] != b:
+                    frontier[runner].append(b)
+                if runner == entry:
+                    break
+                runner = idom[runner]
 
     return frontier
 
-def main(bril, args):
-    for func in bril['functions']:
-        # build the control flow graph
-        blocks = utils.block_map(utils.form_blocks(func['instrs']))
-        utils.add_terminators(blocks)
-        s, _ = generate_graph(blocks)
-
-        if args.doms: 
-            dom = get_dominators(blocks)
-            graph.generate_control_flow_with_dominators(s, dom)
+def get_dominance_frontier(blks, doms=None):
+    # reuse the dominators if the caller already has them
+    if doms is None:
+        doms = get_dominators(blks)
+    elif not isinstance(doms, DominatorMap):
+        doms = idoms_from_sets(doms, blks)
+
+    return frontier_names(doms.names, dominance_frontier_ids(doms))
+
+def frontier_names(names, frontier):
+    return {names[b]: [names[x] for x in df] for b, df in enumerate(frontier)}
+
+def iterated_dominance_frontier(def_blocks, frontier):
+    """DF+ of a set of blocks: the blocks that need a phi node for a
+    variable defined in `def_blocks`, given a precomputed frontier.
+    """
+    result = set()
+    worklist = list(def_blocks)
+    seen = set(worklist)
+    while worklist:
+        b = worklist.pop()
+        for d in frontier[b]:
+            if d not in result:
+                result.add(d)
+                if d not in seen:
+                    seen.add(d)
+                    worklist.append(d)
+    return result
+
+def iterated_dominance_frontiers(defs, frontier):
+    # batch version: {var: def blocks} -> {var: blocks needing a phi}
+    return {var: iterated_dominance_frontier(blks, frontier) for var, blks in defs.items()}
+
+def read_queries(source):
+    # one "A B" pair per line; blank lines and '#' comments are skipped
+    f = sys.stdin if source == '-' else open(source)
+    pairs = []
+    with f:
+        for line in f:
+            line = line.split('#', 1)[0].split()
+            if line:
+                if len(line) != 2:
+                    raise ValueError(f"expected two block names per line, got {line}")
+                pairs.append(tuple(line))
+    return pairs
+
+def answer(nodeA, nodeB, result):
+    if result:
+        return f"{nodeA} dominates {nodeB}"
+    return f"{nodeA} doesn't dominate {nodeB}"
+
+# dominance analyses, for an AnalysisManager; the algorithm comes from
+# the manager's `dom_method` option
+ANALYSES = dict(
+    utils.ANALYSES,
+    dominators=lambda func, am: get_dominators(am.get('blocks'), am.options.get('dom_method', 'chk'), am.get('cfg')),
+    dom_tree=lambda func, am: build_dominance_tree(am.get('dominators')),
+    frontier_ids=lambda func, am: dominance_frontier_ids(am.get('dominators')),
+    frontier=lambda func, am: frontier_names(am.get('cfg').names, am.get('frontier_ids')),
+)
+
+def unanswered(pairs, answered, names):
+    """A message for every pair no function could answer: a name that
+    isn't a block anywhere, or two blocks of different functions.
+    """
+    for q, (a, b) in enumerate(pairs):
+        if q in answered:
+            continue
+        unknown = [name for name in (a, b) if name not in names]
+        if unknown:
+            why = f"no block is named {' or '.join(unknown)}"
+        else:
+            why = "no function has both blocks"
+        yield f"skipped '{a} {b}': {why}"
+
+def main(bril, args, queries=None, export=None):
+    """Returns a message for every --nodes or --queries pair that was
+    skipped.
+    """
+    pairs = [tuple(args.nodes)] if args.test_dom else []
+    pairs += queries or []
+    answered = set()    # index in `pairs` of every answered pair
+    names = set()       # every block name, for the messages
+
+    for func in ir.each_function(bril):
+        # everything is computed at most once per function
+        am = AnalysisManager(func, ANALYSES, dom_method=args.dom_method)
+
+        if args.dom_tree or args.test_dom or queries:
+            dom_tree = am.get('dom_tree')
+
+        if args.doms:
+            graph.generate_control_flow_with_dominators(am.get('cfg').successors, am.get('dominators'))
 
         if args.dom_tree:
-            dom_tree = build_dominance_tree(dom)
             graph.generate_dominance_tree_graph(dom_tree)
 
         if args.dom_frontier:
-            dom_frontier = get_dominance_frontier(blocks)
+            dom_frontier = am.get('frontier')
             print("Dominance Frontier\n")
             print(dom_frontier)
 
+        if pairs:
+            names.update(dom_tree.index)
+
         if args.test_dom:
             node1, node2 = args.nodes
-            result = test_dominance(node1, node2, dom_tree)
-
-            if result:
-                print(f"{node1} dominates {node2}")
-            else:
-                print(f"{node1} doesn't dominate {node2}")
+            if node1 in dom_tree.index and node2 in dom_tree.index:
+                result = test_dominance(node1, node2, dom_tree)
+                print(answer(node1, node2, result))
+                answered.add(0)
+
+        if export:
+            graph.export_function(export, func.name, am.get('cfg'), am.get('dom_tree'),
+                                  args.export_graph, args.collapse, args.collapse_depth)
+
+        if queries:
+            # answer every pair whose blocks belong to this function
+            index = dom_tree.index
+            first = 1 if args.test_dom else 0
+            out = []
+            for q, (a, b) in enumerate(queries, first):
+                if a in index and b in index:
+                    out.append(answer(a, b, dom_tree.dominates_id(index[a], index[b])))
+                    answered.add(q)
+            if out:
+                sys.stdout.write('\n'.join(out) + '\n')
+
+    return list(unanswered(pairs, answered, names))
 
 
 if __name__ == "__main__":
@@ -181,8 +512,40 @@ if __name__ == "__main__":
     parser.add_argument("--dom_frontier", action="store_true", help="Generate the dominance frontier")
     parser.add_argument("--test_dom", action="store_true", help="Test if node A dominates node B")
     parser.add_argument("--nodes", nargs=2, help="Input 2 nodes to test if the first dominates the second. (Requires --test_dom)")
+    parser.add_argument("--queries", metavar="FILE", help="Answer many dominance queries in one run: a file (or - for stdin) with one 'A B' pair per line")
+    parser.add_argument("--input", metavar="FILE", help="Read the program from FILE instead of stdin")
+    parser.add_argument("--dom_method", choices=sorted(IDOM_METHODS), default="chk", help="Immediate dominator algorithm: Cooper-Harvey-Kennedy (default) or Lengauer-Tarjan")
+    parser.add_argument("--export", metavar="FILE", help="Write the graph of every function to FILE (- for stdout) as Graphviz DOT, or JSON if FILE ends in .json")
+    parser.add_argument("--export_graph", choices=["cfg", "dom_tree"], default="cfg", help="Graph to export (default: cfg)")
+    parser.add_argument("--collapse", choices=["subtrees", "loops"], help="Collapse dominator subtrees below --collapse_depth, or whole loops, into one node each")
+    parser.add_argument("--collapse_depth", type=int, default=3, help="Dominator tree depth to collapse subtrees at (default: 3)")
+    parser.add_argument("--stats", action="store_true", help="Print pass times, peak memory and solver counters as JSON on stderr")
 
     args = parser.parse_args()
-    
-    bril = json.load(sys.stdin)
-    main(bril, args)
\ No newline at end of file
+    if args.stats:
+        stats.enable()
+
+    if args.test_dom and not args.nodes:
+        parser.error("--test_dom requires --nodes")
+    if args.queries == '-' and not args.input:
+        parser.error("--queries - reads stdin, so pass the program with --input")
+
+    queries = read_queries(args.queries) if args.queries else None
+    export = None
+    if args.export:
+        out = sys.stdout if args.export == '-' else open(args.export, 'w')
+        export = graph.WRITERS['json' if args.export.endswith('.json') else 'dot'](out)
+
+    with (open(args.input) if args.input else sys.stdin) as f:
+        # functions are decoded one at a time, as main gets to them
+        skipped = main({'functions': stream.iter_functions(f)}, args, queries, export)
+
+    if export:
+        export.close()
+        if out is not sys.stdout:
+            out.close()
+
+    for message in skipped:
+        print(f"dominator.py: {message}", file=sys.stderr)
+    if skipped:
+        sys.exit(1)
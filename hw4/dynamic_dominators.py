@@ -0,0 +1,326 @@
+import heapq
+
+from dominator import idoms_chk, DominatorMap, build_dominance_tree
+import stats
+
+# Gaps between the pre/post labels of a freshly numbered tree. A subtree
+# that moves is labeled inside a gap of its new parent, so most moves
+# only relabel the subtree that moved.
+SPACING = 1 << 32
+
+
+class DynamicDominators:
+    """Dominators of a CFG that is being edited, kept up to date edge by
+    edge instead of recomputed.
+
+    Blocks are the integer ids of the `utils.CFG` it starts from; the set
+    of blocks is fixed, but blocks can become unreachable (and reachable
+    again). Besides `idom` (-1 for unreachable blocks) it keeps the
+    children, the depth and a pre/post interval of every block in the
+    dominator tree, so `dominates()` is an interval test.
+
+    - Inserting an edge (u, v) can only move blocks up: the blocks it
+      affects all get the nearest common dominator of u and v as their
+      idom. They are found with a search from v in order of decreasing
+      depth (Georgiadis et al.'s depth-based search). If v was
+      unreachable, the blocks it makes reachable are attached first.
+    - Deleting an edge (u, v) can only move blocks down, and only in the
+      subtree of v's old idom, which is recomputed on its own. Blocks
+      that become unreachable take their edges with them, which can
+      move blocks elsewhere down too.
+    """
+    def __init__(self, cfg, idom=None):
+        self.cfg = cfg
+        self.names = cfg.names
+        self.index = cfg.index
+        self.entry = cfg.entry
+        n = len(cfg)
+        self.succs = [list(cfg.succs[b]) for b in range(n)]
+        self.preds = [list(cfg.preds[b]) for b in range(n)]
+        if idom is None:
+            idom = idoms_chk(cfg) if n else []
+        self.idom = list(idom)
+        self.children = [set() for _ in range(n)]
+        for b, d in enumerate(self.idom):
+            if d != -1 and d != b:
+                self.children[d].add(b)
+        self.depth = [-1] * n
+        self.pre = [-1] * n
+        self.post = [-1] * n
+        self._held = set()      # edges _attach hasn't inserted yet
+        if n:
+            self.renumber()
+
+    ### QUERIES
+    def reachable(self, b):
+        return self.idom[b] != -1
+
+    def dominates(self, a, b):
+        if self.pre[a] == -1 or self.pre[b] == -1:
+            return a == b
+        return self.pre[a] <= self.pre[b] and self.post[b] <= self.post[a]
+
+    def nca(self, a, b):
+        # nearest common ancestor in the dominator tree
+        idom, depth = self.idom, self.depth
+        while depth[a] > depth[b]:
+            a = idom[a]
+        while depth[b] > depth[a]:
+            b = idom[b]
+        while a != b:
+            a, b = idom[a], idom[b]
+        return a
+
+    def dominator_map(self):
+        return DominatorMap(self.cfg, list(self.idom))
+
+    def tree(self):
+        return build_dominance_tree(self.dominator_map())
+
+    ### EDITS
+    def insert_edge(self, u, v):
+        self.succs[u].append(v)
+        self.preds[v].append(u)
+        if self.idom[u] == -1:
+            # nothing new is reachable
+            return
+        if stats.enabled:
+            stats.count('dyndom.inserts')
+        if self.idom[v] == -1:
+            self._attach(u, v)
+        else:
+            self._insert(u, v)
+
+    def delete_edge(self, u, v):
+        self.succs[u].remove(v)
+        self.preds[v].remove(u)
+        if self.idom[u] == -1 or self.idom[v] == -1 or v in self.succs[u]:
+            # unreachable, or a parallel edge is still there
+            return
+        if self.dominates(v, u):
+            # every path to u already went through v
+            return
+        if stats.enabled:
+            stats.count('dyndom.deletes')
+        self._repair([v])
+
+    ### INSERTION
+    def _insert(self, u, v):
+        nca = self.nca(u, v)
+        if nca == self.idom[v] or nca == v:
+            return
+        depth, succs, idom, held = self.depth, self.succs, self.idom, self._held
+        top = depth[nca] + 1
+
+        # v, and every block reachable from it through blocks at least
+        # as deep as itself, whose idom is below nca
+        affected = []
+        seen = {v}
+        heap = [(-depth[v], v)]
+        while heap:
+            _, r = heapq.heappop(heap)
+            affected.append(r)
+            level = depth[r]
+            stack = [r]
+            while stack:
+                z = stack.pop()
+                for w in succs[z]:
+                    if w in seen or idom[w] == -1 or held and (z, w) in held:
+                        continue
+                    if depth[w] > level:
+                        seen.add(w)
+                        stack.append(w)
+                    elif depth[w] > top:
+                        seen.add(w)
+                        heapq.heappush(heap, (-depth[w], w))
+
+        if stats.enabled:
+            stats.count('dyndom.visited', len(seen))
+            stats.count('dyndom.moved', len(affected))
+        for w in affected:
+            self._move(w, nca)
+
+    def _attach(self, u, v):
+        """v (and whatever it reaches) just became reachable through u.
+        Nothing reachable had an edge into the new blocks, so their
+        dominators are solved on their own, below u. The edges from them
+        to blocks that were already reachable are then inserted one at a
+        time, with the ones still to come hidden from the search.
+        """
+        idom, succs = self.idom, self.succs
+        region = [v]
+        new = {v}
+        for x in region:
+            for y in succs[x]:
+                if idom[y] == -1 and y not in new:
+                    new.add(y)
+                    region.append(y)
+        self._move(v, u)
+        self._solve_within(v, region)
+        self._held = {(x, y) for x in region for y in succs[x] if y not in new}
+        for x, y in list(self._held):
+            self._held.discard((x, y))
+            self._insert(x, y)
+
+    ### DELETION
+    def _repair(self, pending):
+        """Fix up the blocks below the idoms of the blocks in `pending`,
+        which each lost an edge into them. If v's idom is still a
+        predecessor, v keeps it, and then so does every other block (a
+        block whose idom changes has a path from v that didn't go
+        through its new idom). If v has no predecessors left but ones
+        it dominates, its subtree is gone. Otherwise the subtree of v's
+        idom, which only has paths into it through the idom, is solved
+        on its own. The edges out of blocks that become unreachable are
+        lost too.
+        """
+        idom, preds, succs = self.idom, self.preds, self.succs
+        while pending:
+            v = pending.pop()
+            if idom[v] == -1 or v == self.entry or idom[v] in preds[v]:
+                continue
+            if all(idom[p] == -1 or self.dominates(v, p) for p in preds[v]):
+                members = self._subtree(v)
+                self.children[idom[v]].discard(v)
+                lost = members
+            else:
+                members = self._subtree(idom[v])
+                lost = self._solve_within(idom[v], members)
+            for x in lost:
+                self.children[x].clear()
+                idom[x] = self.depth[x] = self.pre[x] = self.post[x] = -1
+            inside = set(members)
+            for x in lost:
+                for w in succs[x]:
+                    if idom[w] != -1 and w not in inside:
+                        pending.append(w)
+
+    def _solve_within(self, root, members):
+        # Cooper, Harvey and Kennedy's algorithm on the subgraph of
+        # `members` below `root`; returns the members it can't reach
+        succs, preds = self.succs, self.preds
+        local = {b: i for i, b in enumerate(members)}
+        seen = bytearray(len(members))
+        seen[0] = 1
+        order = []
+        stack = [(root, iter(succs[root]))]
+        while stack:
+            b, it = stack[-1]
+            for s in it:
+                i = local.get(s)
+                if i is not None and not seen[i]:
+                    seen[i] = 1
+                    stack.append((s, iter(succs[s])))
+                    break
+            else:
+                stack.pop()
+                order.append(b)
+        order.reverse()
+
+        # renumber the reached blocks in reverse postorder
+        number = [-1] * len(members)
+        for k, b in enumerate(order):
+            number[local[b]] = k
+        rpreds = [[number[local[p]] for p in preds[b] if p in local and number[local[p]] != -1]
+                  for b in order]
+        doms = [-1] * len(order)
+        doms[0] = 0
+        changed = True
+        while changed:
+            changed = False
+            for k in range(1, len(order)):
+                new = -1
+                for p in rpreds[k]:
+                    if doms[p] == -1:
+                        continue
+                    if new == -1:
+                        new = p
+                        continue
+                    f1, f2 = p, new
+                    while f1 != f2:
+                        while f1 > f2:
+                            f1 = doms[f1]
+                        while f2 > f1:
+                            f2 = doms[f2]
+                    new = f1
+                if doms[k] != new:
+                    doms[k] = new
+                    changed = True
+
+        if stats.enabled:
+            stats.count('dyndom.recomputed', len(members))
+        for b in members:
+            self.children[b].clear()
+        for k in range(1, len(order)):
+            b, d = order[k], order[doms[k]]
+            self.idom[b] = d
+            self.children[d].add(b)
+        self._relabel_below(root)
+        return [b for b in members if number[local[b]] == -1]
+
+    ### TREE LABELS
+    def _subtree(self, x):
+        nodes = [x]
+        for b in nodes:
+            nodes.extend(self.children[b])
+        return nodes
+
+    def _spread(self, roots, lo, hi, depth, size):
+        # label the subtrees of `roots`, `size` blocks in all, evenly
+        # inside the open interval (lo, hi), which must have room for them
+        step = (hi - lo) // (2 * size + 1)
+        label = lo
+        children, pre, post, depths = self.children, self.pre, self.post, self.depth
+        for r in roots:
+            stack = [(r, iter(children[r]))]
+            label += step
+            pre[r] = label
+            depths[r] = depth
+            while stack:
+                b, it = stack[-1]
+                for c in it:
+                    label += step
+                    pre[c] = label
+                    depths[c] = depths[b] + 1
+                    stack.append((c, iter(children[c])))
+                    break
+                else:
+                    stack.pop()
+                    label += step
+                    post[b] = label
+
+    def renumber(self):
+        # labels for the whole tree, with SPACING between them
+        size = len(self._subtree(self.entry))
+        self._spread([self.entry], 0, SPACING * (2 * size + 1), 0, size)
+
+    def _relabel_below(self, p):
+        # relabel p's descendants inside p's interval, or, if it has
+        # run out of room, inside its parent's, and so on up
+        while True:
+            below = len(self._subtree(p)) - 1
+            if self.post[p] - self.pre[p] - 1 >= 2 * below:
+                self._spread(sorted(self.children[p]), self.pre[p], self.post[p], self.depth[p] + 1, below)
+                return
+            if p == self.entry:
+                self.renumber()
+                return
+            p = self.idom[p]
+
+    def _move(self, x, p):
+        """Make p the idom of x, taking x's subtree along."""
+        old = self.idom[x]
+        if old != -1 and old != x:
+            self.children[old].discard(x)
+        self.idom[x] = p
+        self.children[p].add(x)
+
+        # put it in the gap after p's other children, using half of it
+        # so there is room for the next one
+        lo = max((self.post[c] for c in self.children[p] if c != x), default=self.pre[p])
+        hi = self.post[p]
+        size = len(self._subtree(x))
+        if (hi - lo) // 2 - 1 >= 2 * size:
+            self._spread([x], lo, lo + (hi - lo) // 2, self.depth[p] + 1, size)
+        else:
+            self._relabel_below(p)
@@ -1,33 +1,48 @@
-import igraph as ig
+import json
+from json.encoder import encode_basestring
+
+# The plots need igraph, which is slow to import and only used here, so
+# it is imported when a plot is drawn. The DOT / JSON export below
+# doesn't need it at all.
+def _igraph():
+    import igraph
+    return igraph
+
+def _bbox(n):
+    # 1000x1000 is plenty for the small test programs; bigger graphs get
+    # a bigger image (but use the DOT export for really big ones)
+    side = max(1000, min(20000, int(100 * n ** 0.5)))
+    return (side, side)
 
 # New function to add dominator sets next to each node
 def generate_control_flow_with_dominators(graph_dict, dominator_dict):
+    ig = _igraph()
     # Create an empty graph
     g = ig.Graph(directed=True)
-    
+
     # Add vertices
     vertices = list(graph_dict.keys())
+    index = {name: i for i, name in enumerate(vertices)}
     g.add_vertices(len(vertices))
     g.vs['name'] = vertices
-    
+
     # Add edges
     edges = []
     for source, targets in graph_dict.items():
-        source_index = vertices.index(source)
+        source_index = index[source]
         for target in targets:
-            target_index = vertices.index(target)
-            edges.append((source_index, target_index))
+            edges.append((source_index, index[target]))
     g.add_edges(edges)
-    
+
     # Define a custom layout
     layout = g.layout('rt')  # Use the Reingold-Tilford (rt) layout
-    
+
     # Manually adjust the layout to place the first node at the top
     # layout[0] = (0, 1)  # Root node at the top-center
-    
+
     # Color the root node orange and others blue
     g.vs['color'] = ['orange'] + ['lightblue'] * (len(vertices) - 1)
-    
+
     # Modify labels to include dominators for each node
     labels_with_dominators = []
     for node in vertices:
@@ -35,37 +50,39 @@ def generate_control_flow_with_dominators(graph_dict, dominator_dict):
         dominator_str = ', '.join(dominators) if dominators else 'None'
         label = f"{node}\n[{dominator_str}]"
         labels_with_dominators.append(label)
-    
+
     # Save the plot as a PNG file with updated labels
     ig.plot(g, layout=layout, target='dominator_graph.png',
             title="Control Flow Graph with Dominators",
-            vertex_label=labels_with_dominators, 
-            vertex_color=g.vs['color'], 
+            vertex_label=labels_with_dominators,
+            vertex_color=g.vs['color'],
             vertex_size=50,  # Increase node size
-            bbox=(1000, 1000),  # Set the width and height of the image (width, height)
+            bbox=_bbox(len(vertices)),  # Set the width and height of the image (width, height)
             margin=150)  # Add margin around the plot
-    
+
 
 def generate_dominance_tree_graph(graph_dict):
+    ig = _igraph()
     # Create an empty directed graph
     g = ig.Graph(directed=True)
 
     # Add vertices
     vertices = list(graph_dict.keys())
+    index = {name: i for i, name in enumerate(vertices)}
     g.add_vertices(len(vertices))
     g.vs['name'] = vertices
 
     # Add edges based on the dictionary
     edges = []
     for parent, children in graph_dict.items():
-        parent_index = vertices.index(parent)
+        parent_index = index[parent]
         for child in children:
             # Check if child is not already in vertices
-            if child not in vertices:
+            if child not in index:
+                index[child] = len(vertices)
                 vertices.append(child)
                 g.add_vertices(1)
-            child_index = vertices.index(child)
-            edges.append((parent_index, child_index))
+            edges.append((parent_index, index[child]))
     g.add_edges(edges)
 
     # Define the Reingold-Tilford layout ('rt') for a tree structure
@@ -82,6 +99,187 @@ def generate_dominance_tree_graph(graph_dict):
             vertex_label=g.vs['name'],  # Label the vertices with their names
             vertex_color=g.vs['color'],  # Set the node colors
             vertex_size=50,  # Size of the nodes
-            bbox=(1000, 1000),  # Size of the output image
+            bbox=_bbox(len(vertices)),  # Size of the output image
             margin=150)  # Margin for spacing
 
+
+### EXPORT
+# Graphs are written out node by node and edge by edge, so nothing the
+# size of the output is built in memory. Blocks are integer ids of a
+# `utils.CFG`; the dominator tree is a `dominator.DominatorTree`.
+
+def subtree_groups(tree, depth):
+    """Collapse every dominator subtree rooted at `depth`: each block maps
+    to its ancestor at that depth (or itself, if it is shallower).
+    """
+    n = len(tree.names)
+    group = list(range(n))
+    level = [0] * n
+    # parents come before their children in this order
+    order = [b for b in range(n) if tree.idom[b] == b]
+    for b in order:
+        for c in tree.child_ids(b):
+            level[c] = level[b] + 1
+            if level[c] > depth:
+                group[c] = group[b]
+            order.append(c)
+    return group
+
+def loop_groups(cfg, tree):
+    """Collapse every outermost natural loop into its header. A back edge
+    is an edge to a block that dominates its source.
+    """
+    n = len(cfg)
+    if tree.pre is None:
+        tree.number()
+    pre = tree.pre
+    latches = {}
+    for u in range(n):
+        for h in cfg.succs[u]:
+            if tree.dominates_id(h, u):
+                latches.setdefault(h, []).append(u)
+
+    group = list(range(n))
+    claimed = bytearray(n)
+    # an outer header dominates, so precedes in preorder, its inner
+    # headers: it claims the blocks of the inner loops first
+    for h in sorted(latches, key=pre.__getitem__):
+        if claimed[h]:
+            continue
+        claimed[h] = 1
+        body = [h]
+        seen = {h}
+        stack = list(latches[h])
+        while stack:
+            b = stack.pop()
+            if b in seen:
+                continue
+            seen.add(b)
+            body.append(b)
+            stack.extend(cfg.preds[b])
+        for b in body:
+            if not claimed[b] or b == h:
+                claimed[b] = 1
+                group[b] = h
+    return group
+
+
+class DotWriter:
+    """Graphviz output: one cluster per function in one digraph."""
+    def __init__(self, f):
+        self.f = f
+        f.write('digraph bril {\n  node [shape=ellipse, style=filled, fillcolor=lightblue];\n')
+
+    @staticmethod
+    def quote(s):
+        return '"' + str(s).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+    def begin(self, func):
+        self.func = func
+        self.f.write(f'  subgraph {self.quote("cluster_" + func)} {{\n    label={self.quote("@" + func)};\n')
+
+    def node_id(self, name):
+        return self.quote(f'{self.func}.{name}')
+
+    def node(self, name, size, root):
+        attrs = []
+        if size > 1:
+            attrs += [f'label={self.quote(f"{name} (+{size - 1})")}', 'shape=box']
+        else:
+            attrs.append(f'label={self.quote(name)}')
+        if root:
+            attrs.append('fillcolor=orange')
+        self.f.write(f'    {self.node_id(name)} [{", ".join(attrs)}];\n')
+
+    def edge(self, u, v):
+        self.f.write(f'    {self.node_id(u)} -> {self.node_id(v)};\n')
+
+    def end(self):
+        self.f.write('  }\n')
+
+    def close(self):
+        self.f.write('}\n')
+
+
+class JsonGraphWriter:
+    """`{"functions": [{"name", "nodes": [{"id", "size", "root"}], "edges":
+    [[u, v]]}]}`, written as it goes. All nodes of a function come before
+    its edges.
+    """
+    def __init__(self, f):
+        self.f = f
+        self.funcs = 0
+        f.write('{"functions":[')
+
+    def begin(self, func):
+        self.f.write((',' if self.funcs else '') + '{"name":' + json.dumps(func) + ',"nodes":[')
+        self.funcs += 1
+        self.items = 0
+        self.in_edges = False
+
+    def sep(self):
+        if self.items:
+            self.f.write(',')
+        self.items += 1
+
+    def node(self, name, size, root):
+        self.sep()
+        self.f.write(f'{{"id":{encode_basestring(name)},"size":{size},"root":{"true" if root else "false"}}}')
+
+    def edge(self, u, v):
+        if not self.in_edges:
+            self.f.write('],"edges":[')
+            self.in_edges = True
+            self.items = 0
+        self.sep()
+        self.f.write(f'[{encode_basestring(u)},{encode_basestring(v)}]')
+
+    def end(self):
+        if not self.in_edges:
+            self.f.write('],"edges":[')
+        self.f.write(']}')
+
+    def close(self):
+        self.f.write(']}\n')
+
+
+WRITERS = {'dot': DotWriter, 'json': JsonGraphWriter}
+
+def export_function(writer, func, cfg, tree, which='cfg', collapse=None, depth=3):
+    """Write the CFG (`which='cfg'`) or the dominator tree of one function.
+    `collapse` is None, 'subtrees' (everything below `depth` in the
+    dominator tree goes into its ancestor there) or 'loops' (every
+    outermost loop goes into its header). Collapsed nodes are labeled
+    with how many blocks they hide; edges between them are merged.
+    """
+    n = len(cfg)
+    writer.begin(func)
+    if collapse == 'subtrees':
+        group = subtree_groups(tree, depth)
+    elif collapse == 'loops':
+        group = loop_groups(cfg, tree)
+    else:
+        group = range(n)
+
+    size = [0] * n
+    for b in range(n):
+        size[group[b]] += 1
+    names = cfg.names
+    for b in range(n):
+        if size[b]:
+            writer.node(names[b], size[b], b == cfg.entry)
+
+    seen = set()
+    def edge(u, v):
+        gu, gv = group[u], group[v]
+        if gu != gv and (gu, gv) not in seen:
+            seen.add((gu, gv))
+            writer.edge(names[gu], names[gv])
+
+    for u in range(n):
+        if which == 'cfg':
+            for v in cfg.succs[u]:
+                edge(u, v)
+        elif tree.idom[u] not in (-1, u):
+            edge(tree.idom[u], u)
+    writer.end()
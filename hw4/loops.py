@@ -0,0 +1,468 @@
+import sys
+import argparse
+from collections import OrderedDict
+import utils
+import ir
+from passmgr import AnalysisManager
+import stream
+import stats
+import dominator
+from ssa import Names, live_in, add_entry_block, variable_names
+
+# ops whose result only depends on their arguments and that can't fail,
+# so they can run in a preheader even if the loop wouldn't have run them;
+# ir.TRAPPING_OPS only move if the loop would run them before anything
+# else it does that can be seen
+INVARIANT_OPS = (ir.PURE_OPS - ir.TRAPPING_OPS) | {'const', 'id'}
+
+
+class Loop:
+    """A natural loop. `blocks` are the ids of its blocks, header first,
+    without the blocks of the loops nested in it (its `children`).
+    `parent` is the loop it is nested in, `depth` 1 for an outermost
+    loop. `preheader` is the block every entry into the loop comes from,
+    if there is one.
+    """
+    def __init__(self, header, latches):
+        self.header = header
+        self.latches = latches
+        self.blocks = [header]
+        self.children = []
+        self.parent = None
+        self.depth = 1
+        self.preheader = None
+        self.exits = []     # (exiting block, target) for every edge leaving it
+        self.pre = self.post = -1
+
+    def body(self):
+        # all the blocks of the loop, nested loops included
+        blocks = []
+        work = [self]
+        for loop in work:
+            blocks.extend(loop.blocks)
+            work.extend(loop.children)
+        return blocks
+
+
+class LoopForest:
+    """The natural loops of a CFG, nested. `roots` are the outermost
+    loops, `loop_of[b]` is the innermost loop containing block b (None
+    outside loops). Iterating gives the loops innermost first.
+    """
+    def __init__(self, cfg, roots, loop_of):
+        self.cfg = cfg
+        self.roots = roots
+        self.loop_of = loop_of
+        # number the loops so that containment is an interval test
+        self.order = []
+        clock = 0
+        stack = [(loop, False) for loop in reversed(roots)]
+        while stack:
+            loop, done = stack.pop()
+            if done:
+                loop.post = clock
+                clock += 1
+                self.order.append(loop)
+                continue
+            loop.pre = clock
+            clock += 1
+            loop.depth = loop.parent.depth + 1 if loop.parent else 1
+            stack.append((loop, True))
+            stack.extend((c, False) for c in reversed(loop.children))
+
+    def __iter__(self):
+        return iter(self.order)
+
+    def __len__(self):
+        return len(self.order)
+
+    def contains(self, loop, b):
+        inner = self.loop_of[b]
+        return inner is not None and loop.pre <= inner.pre and inner.post <= loop.post
+
+
+def find_loops(cfg, dom_tree):
+    """The natural loops of `cfg`: a back edge is an edge to a block that
+    dominates its source, and the loop of a header is every block that
+    reaches one of its back edges without going through the header.
+    Loops are found innermost first (an inner header is deeper in the
+    dominator tree), and a block already in a loop stands for that loop,
+    so every block is visited once. Retreating edges that aren't back
+    edges (irreducible loops) make no loop.
+    """
+    n = len(cfg)
+    if dom_tree.pre is None:
+        dom_tree.number()
+    pre, idom = dom_tree.pre, dom_tree.idom
+    succs, preds = cfg.succs, cfg.preds
+
+    latches = {}
+    for u in range(n):
+        if idom[u] == -1:
+            continue
+        for h in succs[u]:
+            if dom_tree.dominates_id(h, u):
+                latches.setdefault(h, []).append(u)
+
+    loop_of = [None] * n
+    outer = {}      # loop -> a loop it is nested in, towards the outermost
+
+    def outermost(loop):
+        top = loop
+        while top in outer:
+            top = outer[top]
+        while loop is not top:
+            up = outer[loop]
+            outer[loop] = top
+            loop = up
+        return top
+
+    loops = []
+    for h in sorted(latches, key=pre.__getitem__, reverse=True):
+        loop = Loop(h, latches[h])
+        loops.append(loop)
+        loop_of[h] = loop
+        stack = [u for u in latches[h] if u != h]
+        while stack:
+            b = stack.pop()
+            inner = loop_of[b]
+            if inner is None:
+                loop_of[b] = loop
+                loop.blocks.append(b)
+                stack.extend(p for p in preds[b] if idom[p] != -1)
+                continue
+            top = outermost(inner)
+            if top is not loop:
+                # a loop nested in this one: carry on from its entries
+                top.parent = loop
+                loop.children.append(top)
+                outer[top] = loop
+                stack.extend(p for p in preds[top.header] if idom[p] != -1)
+
+    roots = sorted((loop for loop in loops if loop.parent is None), key=lambda loop: loop.header)
+    for loop in loops:
+        loop.children.sort(key=lambda c: c.header)
+    forest = LoopForest(cfg, roots, loop_of)
+
+    # a preheader is the only block entering the loop, and it only
+    # jumps to the header. The exits of a loop are those of its own
+    # blocks and those of its inner loops that leave it too.
+    for loop in forest:
+        loop.exits = [(u, v) for u in loop.blocks for v in succs[u] if not forest.contains(loop, v)]
+        for c in loop.children:
+            loop.exits.extend((u, v) for u, v in c.exits if not forest.contains(loop, v))
+        h = loop.header
+        entering = [p for p in preds[h] if idom[p] != -1 and not forest.contains(loop, p)]
+        if len(entering) == 1 and set(succs[entering[0]]) == {h}:
+            loop.preheader = entering[0]
+    if stats.enabled:
+        stats.count('loops.found', len(loops))
+    return forest
+
+
+ANALYSES = dict(
+    dominator.ANALYSES,
+    loops=lambda func, am: find_loops(am.get('cfg'), am.get('dom_tree')),
+)
+
+
+def emit(blocks):
+    # like ssa.emit, but without the jumps to the next block and the
+    # return at the end that `add_terminators` put in, so the output
+    # doesn't run more instructions than it has to
+    instrs = []
+    names = list(blocks)
+    for i, (name, block) in enumerate(blocks.items()):
+        instrs.append(ir.Label(name))
+        term = block[-1] if block else None
+        if term is not None and (
+                term.op == 'jmp' and i + 1 < len(names) and term.labels[0] == names[i + 1]
+                or term.op == 'ret' and not term.args and i + 1 == len(names)):
+            instrs.extend(block[:-1])
+        else:
+            instrs.extend(block)
+    return instrs
+
+def add_preheaders(func, am):
+    """Give every loop that doesn't have one a preheader: a new block in
+    front of the header that the edges entering the loop go to instead.
+    Phis in the header (for code in SSA form) get their values for those
+    edges from phis in the preheader. Returns the new preheaders, as a
+    preheader -> header dict, and the entry block added in front of a
+    loop header (or None).
+    """
+    entry = add_entry_block(func, am)
+    forest = am.get('loops')
+    missing = [loop for loop in forest if loop.preheader is None]
+    if not missing:
+        return {}, entry
+
+    blocks = am.get('blocks')
+    cfg = am.get('cfg')
+    names, preds = cfg.names, cfg.preds
+    labels = Names(set(blocks))
+    variables = None
+    before = {}     # header name -> (preheader name, its block)
+    for loop in missing:
+        h = names[loop.header]
+        entering = sorted({names[p] for p in preds[loop.header] if not forest.contains(loop, p)})
+        pre = labels.fresh(f'{h}.preheader')
+        block = []
+        header = blocks[h]
+        for i, instr in enumerate(header):
+            if instr.op != 'phi':
+                break
+            outside = [(a, l) for a, l in zip(instr.args, instr.labels) if l in entering]
+            inside = [(a, l) for a, l in zip(instr.args, instr.labels) if l not in entering]
+            if variables is None:
+                variables = Names(variable_names(func))
+            value = variables.fresh(instr.dest)
+            block.append(ir.Instr('phi', value, instr.type, tuple(a for a, _ in outside),
+                                  labels=tuple(l for _, l in outside)))
+            header[i] = instr.copy(args=tuple(a for a, _ in inside) + (value,),
+                                   labels=tuple(l for _, l in inside) + (pre,))
+        block.append(ir.Instr('jmp', labels=(h,)))
+        before[h] = (pre, block)
+        for p in entering:
+            term = blocks[p][-1]
+            blocks[p][-1] = term.copy(labels=tuple([pre if l == h else l for l in term.labels]))
+
+    # a preheader goes right before its header, so its jump is a fall
+    # through, unless a block of the loop falls through to the header
+    out = OrderedDict()
+    last = OrderedDict()
+    order = list(blocks)
+    for i, (name, block) in enumerate(blocks.items()):
+        if name in before:
+            pre, pre_block = before[name]
+            prev = cfg.index[order[i - 1]] if i else None
+            if prev is not None and forest.contains(forest.loop_of[cfg.index[name]], prev) \
+                    and list(cfg.succs[prev]) == [cfg.index[name]]:
+                last[pre] = pre_block
+            else:
+                out[pre] = pre_block
+        out[name] = block
+    out.update(last)
+    func.instrs = emit(out)
+    am.invalidate()
+    if stats.enabled:
+        stats.count('licm.preheaders', len(missing))
+    return {pre: h for h, (pre, _) in before.items()}, entry
+
+def remove_empty_preheaders(blocks, added, entry):
+    """Undo `add_preheaders` for the loops nothing was hoisted out of:
+    a preheader in `added` that only has phis and its jump goes, the
+    edges entering its loop go to the header again, and the header's
+    phis take the preheader phis' arguments back. The added `entry`
+    block goes too if the block it jumps to has no phis. Edits the block
+    map in place; returns how many blocks were removed.
+    """
+    empty = {pre: h for pre, h in added.items()
+             if all(instr.op == 'phi' for instr in blocks[pre][:-1])}
+    for pre, h in empty.items():
+        phis = {instr.dest: instr for instr in blocks.pop(pre)[:-1]}
+        header = blocks[h]
+        for i, instr in enumerate(header):
+            if instr.op != 'phi':
+                break
+            args, labels = [], []
+            for a, l in zip(instr.args, instr.labels):
+                if l == pre:
+                    args.extend(phis[a].args)
+                    labels.extend(phis[a].labels)
+                else:
+                    args.append(a)
+                    labels.append(l)
+            header[i] = instr.copy(args=tuple(args), labels=tuple(labels))
+    if empty:
+        for block in blocks.values():
+            term = block[-1] if block else None
+            if term is not None and any(l in empty for l in term.labels):
+                block[-1] = term.copy(labels=tuple(empty.get(l, l) for l in term.labels))
+
+    removed = len(empty)
+    if entry is not None:
+        # phis need the entry block as their predecessor; without them,
+        # the block it jumps to can be the entry itself
+        target = blocks[entry][-1].labels[0]
+        if all(instr.op != 'phi' for instr in blocks[target]):
+            del blocks[entry]
+            blocks.move_to_end(target, last=False)
+            removed += 1
+    return removed
+
+
+def licm(func, am=None):
+    """Loop-invariant code motion: move instructions that compute the
+    same value on every iteration into the loop's preheader, innermost
+    loops first (so an instruction can move out of several loops).
+    An instruction `x = op args` in block D moves if
+    - op has no side effects. Ops that can fail only move from the
+      header, and only when nothing with an effect (or that can fail)
+      comes before them there, so they fail at the same point;
+    - it is the only definition of x in the loop;
+    - no argument is defined in the loop (any more: the definition may
+      have moved already);
+    - D dominates every use of x in the loop (and comes before them in
+      D), so no use sees a value of x from before the loop;
+    - D dominates every exit, or x isn't live after the loop, so
+      leaving the loop before D doesn't see the new value either.
+    An instruction that stays in an inner loop can't leave an outer one,
+    so every loop only looks at its own blocks (which include the
+    preheaders of its inner loops). Returns the function and how many
+    instructions moved.
+    """
+    if am is None:
+        am = AnalysisManager(func, ANALYSES)
+    if not func.instrs:
+        return func, 0
+    with stats.timed('licm'):
+        original = func.instrs
+        added, entry = add_preheaders(func, am)
+        forest = am.get('loops')
+        blocks = am.get('blocks')
+        cfg = am.get('cfg')
+        dom_tree = am.get('dom_tree')
+        dominates = dom_tree.dominates_id
+        code = list(blocks.values())
+        preds = [[p for p in cfg.preds[b] if dom_tree.idom[p] != -1] for b in range(len(code))]
+
+        # the blocks defining and reading every variable (once per
+        # instruction), kept up to date as instructions move
+        defs = {}
+        uses = {}
+        for b, block in enumerate(code):
+            for instr in block:
+                for var in instr.args:
+                    uses.setdefault(var, []).append(b)
+                if instr.dest is not None:
+                    defs.setdefault(instr.dest, []).append(b)
+        live = {}
+
+        def live_blocks(var):
+            if var not in live:
+                first = set()
+                for b in set(uses.get(var, ())):
+                    for instr in code[b]:
+                        if var in instr.args:
+                            first.add(b)
+                            break
+                        if instr.dest == var:
+                            break
+                live[var] = live_in(first, set(defs.get(var, ())), preds)
+            return live[var]
+
+        def live_after(loop, var, exits):
+            # the uses in the loop come after the definition, so only
+            # uses outside it can make var live at an exit
+            if all(forest.contains(loop, u) for u in uses.get(var, ())):
+                return False
+            return any(v in live_blocks(var) for _, v in exits)
+
+        def quiet_before(block, i):
+            # nothing before block[i] prints, calls, stores or can fail
+            return all(instr.op in INVARIANT_OPS or instr.op == 'phi' for instr in block[:i])
+
+        def used_before(var, block, i):
+            return any(var in instr.args for instr in block[:i + 1])
+
+        moved = 0
+        counts = {}     # loop -> definitions in it per variable, once its inner loops are done
+        for loop in forest:
+            # inner loops come first, and what moved out of them is in
+            # their preheaders, which are blocks of this loop
+            count = {}
+            for c in loop.children:
+                for var, k in counts.pop(c).items():
+                    count[var] = count.get(var, 0) + k
+            for b in loop.blocks:
+                for instr in code[b]:
+                    if instr.dest is not None:
+                        count[instr.dest] = count.get(instr.dest, 0) + 1
+            counts[loop] = count
+            pre = loop.preheader
+            exits = loop.exits
+            if pre is None:
+                continue
+            own = sorted(loop.blocks, key=cfg.rpo_number.__getitem__)
+            changed = True
+            while changed:
+                changed = False
+                for b in own:
+                    always = all(dominates(b, u) for u, _ in exits)
+                    block = code[b]
+                    i = 0
+                    while i < len(block):
+                        instr = block[i]
+                        x = instr.dest
+                        if (x is None or count[x] != 1
+                                or not (instr.op in INVARIANT_OPS or instr.op in ir.TRAPPING_OPS
+                                        and b == loop.header and quiet_before(block, i))
+                                or any(a in count for a in instr.args)
+                                or any(forest.contains(loop, u) and (not dominates(b, u) or u == b and used_before(x, block, i))
+                                       for u in uses.get(x, ()))
+                                or not always and live_after(loop, x, exits)):
+                            i += 1
+                            continue
+                        # append it to the preheader, before its jump
+                        del block[i]
+                        code[pre].insert(len(code[pre]) - 1, instr)
+                        moved += 1
+                        changed = True
+                        del count[x]
+                        defs[x].remove(b)
+                        defs[x].append(pre)
+                        live.pop(x, None)
+                        for a in instr.args:
+                            uses[a].remove(b)
+                            uses[a].append(pre)
+                            live.pop(a, None)
+
+        if moved:
+            # a preheader that got nothing only costs a jump
+            remove_empty_preheaders(blocks, added, entry)
+            func.instrs = emit(blocks)
+            am.invalidate()
+        elif func.instrs is not original:
+            # with nothing to move, the preheaders aren't worth it
+            func.instrs = original
+            am.invalidate()
+
+    if stats.enabled:
+        stats.count('licm.hoisted', moved)
+    return func, moved
+
+
+def print_loops(func, forest):
+    names = forest.cfg.names
+    print(f"@{func.name}:")
+    stack = list(reversed(forest.roots))
+    while stack:
+        loop = stack.pop()
+        blocks = ', '.join(names[b] for b in loop.body())
+        pre = names[loop.preheader] if loop.preheader is not None else '-'
+        print(f"{'  ' * loop.depth}{names[loop.header]}: {blocks} (preheader {pre})")
+        stack.extend(reversed(loop.children))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move loop-invariant code out of loops in BRIL programs (JSON on stdin and stdout)")
+    parser.add_argument("--loops", action="store_true", help="Print the loop nesting forest of every function instead")
+    parser.add_argument("--input", metavar="FILE", help="Read the program from FILE instead of stdin")
+    parser.add_argument("--stats", action="store_true", help="Print pass times, peak memory and counters as JSON on stderr")
+    args = parser.parse_args()
+    if args.stats:
+        stats.enable()
+
+    with (open(args.input) if args.input else sys.stdin) as f:
+        if args.loops:
+            for func in ir.each_function({'functions': stream.iter_functions(f)}):
+                print_loops(func, AnalysisManager(func, ANALYSES).get('loops'))
+            sys.exit()
+
+        def convert(func):
+            func = ir.Function.from_json(func)
+            licm(func, AnalysisManager(func, ANALYSES))
+            return func.to_json()
+
+        stream.transform(f, sys.stdout, convert)
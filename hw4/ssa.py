@@ -0,0 +1,343 @@
+import sys
+import argparse
+from collections import OrderedDict
+import utils
+import ir
+from passmgr import AnalysisManager
+import stream
+import stats
+from dominator import ANALYSES
+
+# A phi argument for a path on which the variable was never assigned.
+UNDEFINED = '__undefined'
+
+# what an undefined value becomes when a phi is turned into a copy
+ZERO = {'int': 0, 'bool': False, 'float': 0.0}
+
+
+class Names:
+    """Fresh names base.1, base.2, ... that clash with nothing in `taken`.
+    Numbering goes on from the last name handed out for the same base, so
+    renaming a function is linear in its size.
+    """
+    def __init__(self, taken):
+        self.taken = taken
+        self.last = {}
+
+    def fresh(self, base):
+        n = self.last.get(base, 0)
+        while True:
+            n += 1
+            name = f'{base}.{n}'
+            if name not in self.taken:
+                self.taken.add(name)
+                self.last[base] = n
+                return ir.intern(name)
+
+def variable_names(func):
+    names = {name for name, _ in func.args}
+    for instr in func.instrs:
+        if instr.dest is not None:
+            names.add(instr.dest)
+        names.update(instr.args)
+    return names
+
+def emit(blocks):
+    # every block gets a label, so phis and jumps can name any of them
+    instrs = []
+    for name, block in blocks.items():
+        instrs.append(ir.Label(name))
+        instrs.extend(block)
+    return instrs
+
+def add_entry_block(func, am):
+    """Phis can't go in the entry block (values come in as arguments, not
+    from a predecessor), so if anything jumps back to it, put a new entry
+    block in front of it. Returns the new block's name, or None.
+    """
+    cfg = am.get('cfg')
+    if not cfg or not len(cfg.preds[cfg.entry]):
+        return None
+    blocks = am.get('blocks')
+    entry = Names(set(blocks)).fresh('entry')
+    old = cfg.names[cfg.entry]
+    func.instrs = emit(OrderedDict([(entry, [ir.Instr('jmp', labels=(old,))])] + list(blocks.items())))
+    am.invalidate()
+    return entry
+
+
+### INTO SSA
+def live_in(uses, def_blocks, preds):
+    """The blocks a variable is live into: walk back from the blocks that
+    read it first, stopping at the blocks that write it. `preds` are
+    plain lists (of reachable blocks only), which is faster to walk.
+    """
+    live = set(uses)
+    stack = list(live)
+    while stack:
+        for p in preds[stack.pop()]:
+            if p not in live and p not in def_blocks:
+                live.add(p)
+                stack.append(p)
+    return live
+
+def pruned_idf(def_blocks, frontier, live):
+    """The part of the iterated dominance frontier of `def_blocks` where
+    the variable is live. A block it is dead in can be skipped with all
+    of its frontier: any path from there to a use goes through another
+    definition, whose own frontier is followed.
+    """
+    result = set()
+    worklist = list(def_blocks)
+    while worklist:
+        for d in frontier[worklist.pop()]:
+            if d in live and d not in result:
+                result.add(d)
+                if d not in def_blocks:
+                    worklist.append(d)
+    return result
+
+def to_ssa(func, am=None):
+    """Put `func` in SSA form: pruned phis at the iterated dominance
+    frontiers of every variable's definitions (only where the variable
+    is live), then every definition
+    renamed (x -> x.1, x.2, ...) in a walk over the dominator tree.
+    Unreachable blocks are dropped. Function arguments keep their names.
+    """
+    if am is None:
+        am = AnalysisManager(func, ANALYSES)
+    if not func.instrs:
+        return func
+    with stats.timed('to_ssa'):
+        add_entry_block(func, am)
+        blocks = am.get('blocks')
+        cfg = am.get('cfg')
+        dom_tree = am.get('dom_tree')
+        frontier = am.get('frontier_ids')
+        idom = dom_tree.idom
+        names, succs, preds = cfg.names, cfg.succs, cfg.preds
+        code = list(blocks.values())
+        n = len(code)
+
+        # where every variable is defined, its type, and the blocks that
+        # read it before writing it
+        defs = {}
+        types = {}
+        exposed = {}
+        for name, t in func.args:
+            defs[name] = {cfg.entry}
+            types[name] = t
+        for b in range(n):
+            if idom[b] == -1:
+                continue
+            written = set()
+            for instr in code[b]:
+                for arg in instr.args:
+                    if arg not in written:
+                        exposed.setdefault(arg, set()).add(b)
+                if instr.dest is not None:
+                    written.add(instr.dest)
+                    defs.setdefault(instr.dest, set()).add(b)
+                    types[instr.dest] = instr.type
+
+        reachable_preds = [[p for p in preds[b] if idom[p] != -1] for b in range(n)]
+        # phis[b]: [variable, new name, one argument per predecessor]
+        phis = [[] for _ in range(n)]
+        for var, def_blocks in defs.items():
+            if var not in exposed:
+                continue
+            # a phi is only needed where the variable is live on entry;
+            # without this a deep loop nest gets a phi for every inner
+            # loop's variables in every outer header
+            live = live_in(exposed[var], def_blocks, reachable_preds)
+            for b in sorted(pruned_idf(def_blocks, frontier, live)):
+                phis[b].append([var, None, [UNDEFINED] * len(preds[b])])
+
+        # the positions of p among the predecessors of s
+        positions = {}
+        for s in range(n):
+            for j, p in enumerate(preds[s]):
+                positions.setdefault((p, s), []).append(j)
+
+        taken = Names(variable_names(func))
+        stacks = {name: [name] for name, _ in func.args}
+        work = [(cfg.entry, None)]
+        while work:
+            b, pushed = work.pop()
+            if pushed is not None:
+                # leaving b's subtree: its definitions go out of scope
+                for var in pushed:
+                    stacks[var].pop()
+                continue
+
+            pushed = []
+            for phi in phis[b]:
+                phi[1] = taken.fresh(phi[0])
+                stacks.setdefault(phi[0], []).append(phi[1])
+                pushed.append(phi[0])
+
+            block = code[b]
+            for i, instr in enumerate(block):
+                changes = {}
+                if instr.args:
+                    # a variable with no definition in scope keeps its name
+                    args = tuple([stacks[a][-1] if stacks.get(a) else a for a in instr.args])
+                    if args != instr.args:
+                        changes['args'] = args
+                if instr.dest is not None:
+                    changes['dest'] = taken.fresh(instr.dest)
+                    stacks.setdefault(instr.dest, []).append(changes['dest'])
+                    pushed.append(instr.dest)
+                if changes:
+                    block[i] = instr.copy(**changes)
+
+            for s in succs[b]:
+                for phi in phis[s]:
+                    stack = stacks.get(phi[0])
+                    for j in positions[(b, s)]:
+                        phi[2][j] = stack[-1] if stack else UNDEFINED
+
+            work.append((b, pushed))
+            work.extend((c, None) for c in dom_tree.child_ids(b))
+
+        out = OrderedDict()
+        count = 0
+        for b in range(n):
+            if idom[b] == -1:
+                continue
+            # phis of unreachable predecessors go with them
+            keep = [j for j, p in enumerate(preds[b]) if idom[p] != -1]
+            labels = tuple([names[preds[b][j]] for j in keep])
+            out[names[b]] = [ir.Instr('phi', dest, types[var], tuple([args[j] for j in keep]), labels=labels)
+                             for var, dest, args in phis[b]] + code[b]
+            count += len(phis[b])
+
+        func.instrs = emit(out)
+        am.invalidate()
+
+    if stats.enabled:
+        stats.count('ssa.phis', count)
+    return func
+
+
+### OUT OF SSA
+def sequentialize(copies, types, taken):
+    """Order the parallel copies `(dest, src)` so no source is overwritten
+    before it is read, breaking cycles (like a swap) with a temporary.
+    """
+    pending = [(d, s) for d, s in copies if d != s]
+    out = []
+    while pending:
+        sources = {s for _, s in pending}
+        ready = [(d, s) for d, s in pending if d not in sources]
+        if ready:
+            for d, s in ready:
+                out.append(ir.Instr('id', d, types[d], (s,)))
+            done = set(ready)
+            pending = [c for c in pending if c not in done]
+        else:
+            # every destination is still needed as a source: save one
+            d, _ = pending[0]
+            tmp = taken.fresh(d)
+            types[tmp] = types[d]
+            out.append(ir.Instr('id', tmp, types[d], (d,)))
+            pending = [(dd, tmp if s == d else s) for dd, s in pending]
+    return out
+
+def from_ssa(func, am=None):
+    """Replace every phi with copies at the end of its predecessors. Edges
+    from a block with several successors into a block with phis are split
+    first, so the copies only run on that edge.
+    """
+    if am is None:
+        am = AnalysisManager(func, ANALYSES)
+    if not func.instrs:
+        return func
+    with stats.timed('from_ssa'):
+        blocks = am.get('blocks')
+        cfg = am.get('cfg')
+        taken = Names(variable_names(func))
+        types = {}
+        copies = OrderedDict()   # (pred, block) -> [(dest, src)]
+        phi_args = {}
+        count = 0
+        for name, block in blocks.items():
+            n_phis = 0
+            for instr in block:
+                if instr.op != 'phi':
+                    break
+                n_phis += 1
+                types[instr.dest] = instr.type
+                phi_args[instr.dest] = instr.args
+                for arg, label in zip(instr.args, instr.labels):
+                    if arg != UNDEFINED:
+                        copies.setdefault((label, name), []).append((instr.dest, arg))
+            del block[:n_phis]
+
+        # a phi whose value can come from an undefined variable is just
+        # undefined on that path, but a copy from it would be an error:
+        # give those phis a value at the start of the function
+        maybe_undefined = set()
+        changed = True
+        while changed:
+            changed = False
+            for dest, args in phi_args.items():
+                if dest not in maybe_undefined and any(
+                        a == UNDEFINED or a in maybe_undefined for a in args):
+                    maybe_undefined.add(dest)
+                    changed = True
+        sources = {src for edge_copies in copies.values() for _, src in edge_copies}
+        init = [ir.Instr('const', var, types[var], value=ZERO[types[var]])
+                for var in phi_args if var in maybe_undefined and var in sources and types[var] in ZERO]
+
+        split = 0
+        labels = Names(set(blocks))
+        extra = OrderedDict()
+        for (pred, name), edge_copies in copies.items():
+            code = sequentialize(edge_copies, types, taken)
+            count += len(code)
+            block = blocks[pred]
+            term = block[-1]
+            if len(set(cfg[pred])) > 1:
+                # a critical edge: the copies get a block of their own
+                middle = labels.fresh(f'{pred}.{name}')
+                extra[middle] = code + [ir.Instr('jmp', labels=(name,))]
+                block[-1] = term.copy(labels=tuple([middle if l == name else l for l in term.labels]))
+                split += 1
+            else:
+                block[-1:-1] = code
+
+        blocks.update(extra)
+        entry = blocks[next(iter(blocks))]
+        entry[0:0] = init
+        func.instrs = emit(blocks)
+        am.invalidate()
+
+    if stats.enabled:
+        stats.count('ssa.copies', count)
+        stats.count('ssa.split_edges', split)
+    return func
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert BRIL programs to and from SSA form (JSON on stdin and stdout)")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--from_ssa", action="store_true", help="Translate out of SSA instead of into it")
+    group.add_argument("--roundtrip", action="store_true", help="Translate into SSA and back out")
+    parser.add_argument("--input", metavar="FILE", help="Read the program from FILE instead of stdin")
+    parser.add_argument("--stats", action="store_true", help="Print pass times, peak memory and counters as JSON on stderr")
+    args = parser.parse_args()
+    if args.stats:
+        stats.enable()
+
+    def convert(func):
+        func = ir.Function.from_json(func)
+        am = AnalysisManager(func, ANALYSES)
+        if not args.from_ssa:
+            to_ssa(func, am)
+        if args.from_ssa or args.roundtrip:
+            from_ssa(func, am)
+        return func.to_json()
+
+    with (open(args.input) if args.input else sys.stdin) as f:
+        stream.transform(f, sys.stdout, convert)